@@ -0,0 +1,511 @@
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+import cache, crud, gradebook, models, schemas, search
+
+
+async def get_user(db: AsyncSession, user_id: int):
+    """
+    Return the user with the given user_id, see crud.get_user.
+
+    Args:
+        db (AsyncSession): The async database session.
+        user_id (int): The ID of the user.
+
+    Returns:
+        Row: The USER_COLUMNS of the user, or None if not found.
+    """
+    result = await db.execute(
+        crud.user_rows_statement().where(models.User.id == user_id)
+    )
+    return result.first()
+
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    """
+    Return the user with the given username
+
+    Args:
+        db (AsyncSession): The async database session.
+        username (str): The username of the user.
+
+    Returns:
+        User: The user with the specified username, or None if not found.
+    """
+    return await db.scalar(select(models.User).where(models.User.username == username))
+
+
+async def get_user_by_email(db: AsyncSession, email: str) -> models.User:
+    """
+    Return the user with the given email
+
+    Args:
+        db (AsyncSession): The async database session.
+        email (str): The email of the user.
+
+    Returns:
+        User: The user with the specified email, or None if not found.
+    """
+    return await db.scalar(select(models.User).where(models.User.email == email))
+
+
+async def get_user_role(db: AsyncSession, user_id: int):
+    """
+    Return the role of the user with the given user_id
+
+    Args:
+        db (AsyncSession): The async database session.
+        user_id (int): The ID of the user.
+
+    Returns:
+        str: The role of the user.
+    """
+    return await db.scalar(
+        select(models.Role.name)
+        .join(models.User, models.User.role_id == models.Role.id)
+        .where(models.User.id == user_id)
+    )
+
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate, hashed_password: str):
+    """
+    Create a new student with the given user details
+
+    Args:
+        db (AsyncSession): The async database session.
+        user (UserCreate): The user data to be created.
+        hashed_password (str): The password hashed with hashing.hash_password.
+
+    Returns:
+        User: The created user.
+    """
+    db_user = models.User(
+        email=user.email,
+        hashed_password=hashed_password,
+        username=user.username,
+        role_id=4,  # default role is student
+    )
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+
+async def get_user_item(db: AsyncSession, user_id: int):
+    """
+    Retrieve the items owned by a specific user from the database.
+
+    Args:
+        db (AsyncSession): The async database session.
+        user_id (int): The ID of the user.
+
+    Returns:
+        List[Item]: The items owned by the user.
+    """
+    return (
+        await db.scalars(select(models.Item).where(models.Item.owner_id == user_id))
+    ).all()
+
+
+async def get_user_progress(db: AsyncSession, user_id: int):
+    """
+    Retrieve the status of a student in every assignment of their classes, see
+    crud.get_user_progress.
+
+    Args:
+        db (AsyncSession): The async database session.
+        user_id (int): The ID of the user.
+
+    Returns:
+        list[Row]: The progress rows with the assignment and classroom names.
+    """
+    return (await db.execute(crud.user_progress_statement(user_id))).all()
+
+
+async def get_items_pass(db: AsyncSession, user_id: int, ass_ids: list) -> dict:
+    """
+    Return whether the items of a user for the given assignments are passed.
+
+    Args:
+        db (AsyncSession): The async database session.
+        user_id (int): The ID of the user.
+        ass_ids (list): The IDs of the assignments.
+
+    Returns:
+        dict: The passed flag by assignment ID, False for assignments without an item.
+    """
+    result = await db.execute(crud.items_pass_statement(user_id, ass_ids))
+    return dict.fromkeys(ass_ids, False) | {
+        ass_id: status == gradebook.PASSED for ass_id, status in result
+    }
+
+
+async def search_records(db: AsyncSession, q: str, kinds: list, limit: int = 20):
+    """
+    Search users, classrooms and assignments through the full-text index.
+
+    Every typed word has to be the start of a word in the username or email of
+    a user, or in the name or description of a classroom or assignment.
+
+    Args:
+        db (AsyncSession): The async database session.
+        q (str): The query as typed.
+        kinds (list): The kinds of records to search, keys of search.SOURCES.
+        limit (int, optional): Maximum number of records. Defaults to 20.
+
+    Returns:
+        list[Row]: The kind, id, title, body and rank of the records, best matches first.
+    """
+    sqlite = db.bind.dialect.name == "sqlite"
+    query = search.match_query(q, sqlite)
+    if query is None or not kinds:
+        return []
+    statement = search.hits_statement(kinds, sqlite)
+    return (await db.execute(statement, {"q": query, "limit": limit})).all()
+
+
+async def get_assignment_by_id(db: AsyncSession, assignment_id: int):
+    """
+    Retrieve an assignment from the database by its ID.
+
+    Args:
+        db (AsyncSession): The async database session.
+        assignment_id (int): The ID of the assignment to retrieve.
+
+    Returns:
+        AssignmentRow: The assignment with the specified ID, or None if not found,
+            served from cache.assignments like crud.get_assignment_by_id.
+    """
+
+    async def load():
+        statement = crud.assignment_rows_statement().where(
+            models.Assignment.id == assignment_id
+        )
+        return crud.as_dict((await db.execute(statement)).first())
+
+    values = await cache.read_through_async(cache.assignments, str(assignment_id), load)
+    return None if values is None else schemas.AssignmentRow(**values)
+
+
+async def get_assignment_stats(db: AsyncSession, assignment_id: int):
+    """
+    Retrieve the aggregated results of an assignment kept by gradebook.sync.
+
+    Args:
+        db (AsyncSession): The async database session.
+        assignment_id (int): The ID of the assignment.
+
+    Returns:
+        AssignmentStats: The stats of the assignment, or None if not found.
+    """
+    return await db.get(models.AssignmentStats, assignment_id)
+
+
+async def get_assignment_results(
+    db: AsyncSession,
+    assignment_id: int,
+    class_id: int,
+    sort: str = "name",
+    descending: bool = False,
+    status: str | None = None,
+    after: list | None = None,
+    limit: int = 100,
+):
+    """
+    Retrieve one page of the results of all students of a class for an assignment.
+
+    See crud.get_assignment_results for the arguments.
+
+    Returns:
+        list: Dictionaries with user_id, username, status, mark and sort_key.
+    """
+    statement = crud.assignment_results_statement(
+        assignment_id, class_id, sort, descending, status, after, limit
+    )
+    return crud.assignment_results_rows((await db.execute(statement)).all())
+
+
+async def get_classrooms(db: AsyncSession, after: int | None = None, limit: int = 100):
+    """
+    Retrieve a page of classrooms ordered by ID, see crud.get_classrooms.
+
+    Args:
+        db (AsyncSession): The async database session.
+        after (int | None, optional): The ID of the last classroom of the previous
+            page. Defaults to the first page.
+        limit (int, optional): Maximum number of classrooms to retrieve. Defaults to 100.
+
+    Returns:
+        List[Classroom]: List of classrooms retrieved from the database.
+    """
+    statement = crud.keyset(select(models.Classroom), models.Classroom.id, after, limit)
+    return (await db.scalars(statement)).all()
+
+
+async def get_classroom_by_id(db: AsyncSession, classroom_id: int):
+    """
+    Retrieve a classroom from the database by its ID.
+
+    Args:
+        db (AsyncSession): The async database session.
+        classroom_id (int): The ID of the classroom to retrieve.
+
+    Returns:
+        ClassroomRow: The classroom with the specified ID, or None if not found,
+            served from cache.classrooms like crud.get_classroom_by_id.
+    """
+
+    async def load():
+        statement = crud.classroom_rows_statement().where(
+            models.Classroom.id == classroom_id
+        )
+        return crud.as_dict((await db.execute(statement)).first())
+
+    values = await cache.read_through_async(cache.classrooms, str(classroom_id), load)
+    return None if values is None else schemas.ClassroomRow(**values)
+
+
+async def get_classroom_with_assignments(db: AsyncSession, classroom_id: int):
+    """
+    Retrieve a classroom with its assignments loaded in the same round trip.
+
+    Args:
+        db (AsyncSession): The async database session.
+        classroom_id (int): The ID of the classroom to retrieve.
+
+    Returns:
+        Classroom: The classroom with the specified ID, or None if not found.
+    """
+    return await db.scalar(
+        select(models.Classroom)
+        .options(selectinload(models.Classroom.assignments))
+        .where(models.Classroom.id == classroom_id)
+    )
+
+
+async def get_my_classrooms(db: AsyncSession, user_id: int):
+    """
+    Return classes in which is user enrolled.
+    """
+    return (
+        await db.scalars(
+            select(models.Classroom)
+            .join(
+                models.UserClassroom,
+                models.UserClassroom.classroom_id == models.Classroom.id,
+            )
+            .where(models.UserClassroom.user_id == user_id)
+        )
+    ).all()
+
+
+async def is_student_in_classroom(
+    db: AsyncSession, classroom_id: int, student_email: str
+):
+    """
+    Check if a student is in a classroom.
+
+    Args:
+        db (AsyncSession): The async database session.
+        classroom_id (int): The ID of the classroom.
+        student_email (str): The email of the student.
+
+    Returns:
+        bool: True if the student is in the classroom, False otherwise, None if
+            there is no such classroom.
+    """
+    if await get_classroom_by_id(db, classroom_id) is None:
+        return None
+    user_id = await db.scalar(
+        select(models.UserClassroom.user_id)
+        .join(models.User, models.User.id == models.UserClassroom.user_id)
+        .where(models.UserClassroom.classroom_id == classroom_id)
+        .where(models.User.email == student_email)
+    )
+    return user_id is not None
+
+
+async def enroll_student(db: AsyncSession, classroom_id: int, user_id: int):
+    """
+    Add a student to a classroom in the database.
+
+    Args:
+        db (AsyncSession): The async database session.
+        classroom_id (int): The ID of the classroom.
+        user_id (int): The ID of the student.
+
+    Returns:
+        Classroom: The classroom.
+    """
+    db.add(models.UserClassroom(classroom_id=classroom_id, user_id=user_id))
+    await db.run_sync(gradebook.sync, user_ids=[user_id])
+    await db.commit()
+    return await get_classroom_by_id(db, classroom_id)
+
+
+async def get_user_ids_by_emails(db: AsyncSession, emails: list) -> dict:
+    """
+    Look up the users with the given emails in one query.
+
+    Args:
+        db (AsyncSession): The async database session.
+        emails (list): The emails.
+
+    Returns:
+        dict: The user ID by email of the emails that belong to a user.
+    """
+    if not emails:
+        return {}
+    result = await db.execute(
+        select(models.User.email, models.User.id).where(models.User.email.in_(emails))
+    )
+    return dict(result.all())
+
+
+async def get_enrolled_user_ids(db: AsyncSession, classroom_id: int, user_ids: list):
+    """
+    Return which of the given users are enrolled in a classroom.
+
+    Args:
+        db (AsyncSession): The async database session.
+        classroom_id (int): The ID of the classroom.
+        user_ids (list): The IDs of the users.
+
+    Returns:
+        set: The IDs of the enrolled users.
+    """
+    if not user_ids:
+        return set()
+    result = await db.scalars(
+        select(models.UserClassroom.user_id)
+        .where(models.UserClassroom.classroom_id == classroom_id)
+        .where(models.UserClassroom.user_id.in_(user_ids))
+    )
+    return set(result)
+
+
+async def get_taken_usernames(db: AsyncSession, usernames: list) -> set:
+    """
+    Return which of the given usernames already belong to a user.
+
+    Args:
+        db (AsyncSession): The async database session.
+        usernames (list): The usernames.
+
+    Returns:
+        set: The taken usernames.
+    """
+    if not usernames:
+        return set()
+    result = await db.scalars(
+        select(models.User.username).where(models.User.username.in_(usernames))
+    )
+    return set(result)
+
+
+async def enroll_students(
+    db: AsyncSession,
+    classroom_id: int,
+    user_ids: list,
+    new_users: list,
+    emails: list = (),
+):
+    """
+    Create students and enroll them and existing users into a classroom in one transaction.
+
+    Args:
+        db (AsyncSession): The async database session.
+        classroom_id (int): The ID of the classroom.
+        user_ids (list): The IDs of the existing users to enroll.
+        new_users (list): Dictionaries with the email, username and hashed_password
+            of the students to create and enroll.
+        emails (list, optional): Column values of OutboxEmail rows to queue in the
+            same transaction, see mailer.welcome_email. Defaults to none.
+
+    Returns:
+        list: The IDs of all enrolled users.
+    """
+    user_ids = list(user_ids)
+    if emails:
+        await db.execute(insert(models.OutboxEmail), list(emails))
+    if new_users:
+        result = await db.execute(
+            insert(models.User).returning(models.User.id),
+            [{**user, "role_id": 4} for user in new_users],  # students
+        )
+        user_ids += result.scalars().all()
+    if not user_ids:
+        await db.commit()
+        return []
+    await db.execute(
+        insert(models.UserClassroom),
+        [{"classroom_id": classroom_id, "user_id": user_id} for user_id in user_ids],
+    )
+    await db.run_sync(
+        gradebook.sync,
+        select(models.Assignment.id).where(
+            models.Assignment.classroom_id == classroom_id
+        ),
+    )
+    await db.commit()
+    return user_ids
+
+
+async def queue_emails(db: AsyncSession, emails: list):
+    """
+    Queue emails in the outbox for mailer, see mailer.welcome_email.
+
+    Args:
+        db (AsyncSession): The async database session.
+        emails (list): Column values of the OutboxEmail rows.
+    """
+    if emails:
+        await db.execute(insert(models.OutboxEmail), list(emails))
+        await db.commit()
+
+
+async def get_outbox_summary(db: AsyncSession, failed_limit: int = 50) -> dict:
+    """
+    Count the emails of the outbox by status and list the latest failures.
+
+    Args:
+        db (AsyncSession): The async database session.
+        failed_limit (int, optional): Maximum number of failed emails. Defaults to 50.
+
+    Returns:
+        dict: The number of emails by status in "counts", the latest given up
+            emails in "failed" and the pending emails with a failed attempt in
+            "retrying".
+    """
+    outbox = models.OutboxEmail
+    counts = await db.execute(
+        select(outbox.status, func.count()).group_by(outbox.status)
+    )
+    columns = (
+        outbox.id,
+        outbox.recipient,
+        outbox.subject,
+        outbox.attempts,
+        outbox.last_error,
+        outbox.next_attempt_at,
+        outbox.created_at,
+    )
+    failed = await db.execute(
+        select(*columns)
+        .where(outbox.status == "failed")
+        .order_by(outbox.id.desc())
+        .limit(failed_limit)
+    )
+    retrying = await db.execute(
+        select(*columns)
+        .where(outbox.status == "pending")
+        .where(outbox.attempts > 0)
+        .order_by(outbox.next_attempt_at)
+        .limit(failed_limit)
+    )
+    return {
+        "counts": dict(counts.all()),
+        "failed": [row._asdict() for row in failed],
+        "retrying": [row._asdict() for row in retrying],
+    }
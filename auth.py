@@ -1,23 +1,27 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from typing import Annotated
 from datetime import datetime, timedelta, timezone
-from secrets import token_hex
+from secrets import token_hex, token_urlsafe
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+import hashlib
 import os
-import crud, schemas
-from database import get_db
-
+import async_crud, cache, crud, hashing, schemas
+from permissions import Permission, SUPER_TEACHER_PLUS, TEACHER_PLUS, for_role
+from database import get_async_db, get_db
 
 # to get a string like this run:
 # openssl rand -hex 32
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 14))
+# a refresh token used again within this time is taken for a concurrent refresh
+# from another tab, not for a stolen token
+REFRESH_REUSE_GRACE = timedelta(seconds=30)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -33,7 +37,7 @@ def verify_password(plain_password, hashed_password):
     Returns:
         bool: True if the passwords match, False otherwise.
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    return hashing.pwd_context.verify(plain_password, hashed_password)
 
 
 def get_password_hash(password):
@@ -46,7 +50,7 @@ def get_password_hash(password):
     Returns:
         str: The hashed password.
     """
-    return pwd_context.hash(password)
+    return hashing.hash_password_sync(password)
 
 
 def get_random_password():
@@ -59,10 +63,16 @@ def get_random_password():
     return token_hex(6)
 
 
-def authenticate_user(username: str, password: str, db: Session = Depends(get_db)):
+async def authenticate_user(
+    username: str, password: str, db: Session = Depends(get_db)
+):
     """
     Authenticate a user based on the provided username and password.
 
+    The password is verified in the hashing process pool and the queries run
+    in the threadpool. A hash made with a different cost factor than
+    BCRYPT_ROUNDS is replaced by a new one.
+
     Args:
         username (str): The username of the user.
         password (str): The password of the user.
@@ -71,11 +81,14 @@ def authenticate_user(username: str, password: str, db: Session = Depends(get_db
     Returns:
         User: The authenticated user if successful, False otherwise.
     """
-    user = crud.get_user_by_username(db, username=username)
+    user = await run_in_threadpool(crud.get_user_by_username, db, username=username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await hashing.verify_and_update(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash is not None:
+        await run_in_threadpool(crud.set_password_hash, db, user.id, new_hash)
     return user
 
 
@@ -100,18 +113,113 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
+def get_token_claims(user) -> dict:
+    """
+    Return the claims of the access token of a user.
+
+    The permissions of the role are resolved here once and stored as a
+    bitmask in "perm", "rv" is the role version of the user, tokens with an
+    older version are rejected after a role change.
+
+    Args:
+        user (User): The user.
+
+    Returns:
+        dict: The claims.
+    """
+    return {
+        "sub": user.username,
+        "perm": int(for_role(user.role.name if user.role else None)),
+        "rv": user.role_version,
+    }
+
+
+def hash_refresh_token(token: str) -> str:
+    """Return the sha256 of a refresh token, the tokens are random so no salt is needed."""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def issue_refresh_token(db: Session, user_id: int, family: str | None = None) -> str:
+    """
+    Create a new refresh token of a user.
+
+    Args:
+        db (Session): The database session.
+        user_id (int): The ID of the user.
+        family (str, optional): The family of the rotated token. Defaults to a new family.
+
+    Returns:
+        str: The refresh token, only its hash is stored.
+    """
+    token = token_urlsafe(32)
+    now = datetime.utcnow()
+    if family is None:
+        crud.delete_expired_refresh_tokens(db, now)
+    crud.create_refresh_token(
+        db,
+        user_id=user_id,
+        token_hash=hash_refresh_token(token),
+        family=family or token_hex(16),
+        expires_at=now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    )
+    return token
+
+
+def rotate_refresh_token(db: Session, token: str):
+    """
+    Use a refresh token and issue its successor in the same family.
+
+    A token that was already used revokes its whole family, as either the
+    token or its successor may have been stolen.
+
+    Args:
+        db (Session): The database session.
+        token (str): The refresh token.
+
+    Returns:
+        tuple: The user and the new refresh token.
+
+    Raises:
+        HTTPException: If the token is unknown, expired, revoked or its user is inactive.
+    """
+    invalid_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    db_token = crud.get_refresh_token(db, hash_refresh_token(token))
+    now = datetime.utcnow()
+    if db_token is None or db_token.expires_at < now:
+        raise invalid_exception
+    if db_token.revoked_at is not None or not crud.use_refresh_token(
+        db, db_token.id, now
+    ):
+        db.refresh(db_token)
+        if now - db_token.revoked_at > REFRESH_REUSE_GRACE:
+            crud.revoke_refresh_tokens(db, family=db_token.family)
+        raise invalid_exception
+    user = db_token.user
+    if user is None or not user.is_active:
+        raise invalid_exception
+    return user, issue_refresh_token(db, user.id, family=db_token.family)
+
+
 async def get_current_user(
-    token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(get_db)
+    token: Annotated[str, Depends(oauth2_scheme)],
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Get the current authenticated user based on the provided token.
 
+    The user is cached in cache.principals for a short time, so most requests
+    do not touch the database here.
+
     Args:
         token (str): The access token.
-        db (Session, optional): The database session. Defaults to Depends(get_db).
+        db (AsyncSession, optional): The async database session. Defaults to Depends(get_async_db).
 
     Returns:
-        User: The current authenticated user.
+        Principal: The current authenticated user.
 
     Raises:
         HTTPException: If the credentials cannot be validated.
@@ -129,10 +237,23 @@ async def get_current_user(
         token_data = schemas.TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = crud.get_user_by_username(db, username=token_data.username)
-    if user is None:
+
+    async def load():
+        user = await async_crud.get_user_by_username(db, username=token_data.username)
+        return None if user is None else schemas.Principal.model_validate(user)
+
+    principal = await cache.read_through_async(
+        cache.principals, token_data.username, load
+    )
+    if principal is not None and principal.role_version != payload.get("rv"):
+        # the cached principal may predate a role change, check the database
+        generation = cache.principals.version()
+        principal = await load()
+        if principal is not None:
+            cache.principals.set(token_data.username, principal, generation)
+    if principal is None or principal.role_version != payload.get("rv"):
         raise credentials_exception
-    return user
+    return principal.model_copy(update={"permissions": payload.get("perm", 0)})
 
 
 async def get_current_active_user(
@@ -153,3 +274,32 @@ async def get_current_active_user(
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
+
+
+def has_permission(user, permission: Permission) -> bool:
+    """
+    Check the permissions of the current user from the claims of their token.
+
+    Args:
+        user (User): The user from get_current_user.
+        permission (Permission): The permissions, any of them is enough.
+
+    Returns:
+        bool: True if the user has any of the permissions.
+    """
+    return bool(getattr(user, "permissions", Permission.NONE) & permission)
+
+
+def is_teacher_plus(user) -> bool:
+    """Check if the current user is a teacher, super teacher, or admin."""
+    return has_permission(user, TEACHER_PLUS)
+
+
+def is_super_teacher_plus(user) -> bool:
+    """Check if the current user is a super teacher or admin."""
+    return has_permission(user, SUPER_TEACHER_PLUS)
+
+
+def is_admin(user) -> bool:
+    """Check if the current user is an admin."""
+    return has_permission(user, Permission.ADMIN)
@@ -0,0 +1,197 @@
+"""
+Compare the database profiles under a mixed read/write load like grading.
+
+Worker threads mark random submissions (crud.update_item) while others read
+result pages (crud.get_assignment_results), as when a class submits while the
+teacher watches the results. Run
+
+    python bench_db.py
+
+to compare SQLite with its default rollback journal against the WAL profile,
+and with BENCH_POSTGRES_URL set also Postgres. The Postgres database must be a
+scratch database, its tables are dropped and created again.
+"""
+
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_THREADS = int(os.getenv("BENCH_THREADS", 8))
+BENCH_SECONDS = float(os.getenv("BENCH_SECONDS", 10))
+BENCH_STUDENTS = int(os.getenv("BENCH_STUDENTS", 2000))
+# share of the operations that are writes
+BENCH_WRITE_RATIO = float(os.getenv("BENCH_WRITE_RATIO", 0.2))
+
+# SQLite as it was configured before the WAL profile
+SQLITE_ROLLBACK_JOURNAL = {
+    "SQLITE_JOURNAL_MODE": "DELETE",
+    "SQLITE_SYNCHRONOUS": "FULL",
+    "SQLITE_BUSY_TIMEOUT": "5000",
+    "SQLITE_MMAP_SIZE": "0",
+    "SQLITE_CACHE_SIZE": "-2000",
+}
+
+
+def seed(db, students: int) -> list:
+    """Create a class with one assignment and a submission of every student."""
+    from sqlalchemy import insert
+
+    import gradebook, models
+
+    db.add(models.Role(id=1, name="Teacher", slug="teacher"))
+    db.add(models.User(id=1, username="teacher", email="t@example.com", role_id=1))
+    db.add(models.Classroom(id=1, name="Bench", owner_id=1))
+    db.add(models.Assignment(id=1, name="Bench", owner_id=1, classroom_id=1))
+    db.flush()
+    user_ids = range(2, students + 2)
+    db.execute(
+        insert(models.User),
+        [
+            {"id": i, "username": f"s{i}", "email": f"s{i}@example.com", "role_id": 1}
+            for i in user_ids
+        ],
+    )
+    db.execute(
+        insert(models.UserClassroom),
+        [{"user_id": i, "classroom_id": 1} for i in user_ids],
+    )
+    db.execute(
+        insert(models.Item),
+        [
+            {"id": i, "filename": f"HW_1_{i}", "owner_id": i, "assignment_id": 1}
+            for i in user_ids
+        ],
+    )
+    gradebook.rebuild(db)
+    db.commit()
+    return list(user_ids)
+
+
+def worker(deadline: float, item_ids: list, stats: dict, lock: threading.Lock):
+    from sqlalchemy.exc import OperationalError
+
+    import crud
+    from database import SessionLocal
+
+    db = SessionLocal()
+    rng = random.Random()
+    reads, writes, errors = [], [], 0
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            if rng.random() < BENCH_WRITE_RATIO:
+                crud.update_item(
+                    db,
+                    item_id=rng.choice(item_ids),
+                    tested=True,
+                    passed=rng.random() < 0.5,
+                    mark=rng.randint(0, 100),
+                )
+                writes.append(time.perf_counter() - start)
+            else:
+                crud.get_assignment_results(db, 1, 1, sort="mark", limit=100)
+                reads.append(time.perf_counter() - start)
+        except OperationalError:
+            # "database is locked"
+            db.rollback()
+            errors += 1
+    db.close()
+    with lock:
+        stats["reads"] += reads
+        stats["writes"] += writes
+        stats["errors"] += errors
+
+
+def run() -> dict:
+    """Benchmark the database configured by the environment."""
+    import database, migrations, models
+
+    models.Base.metadata.drop_all(database.engine)
+    migrations.upgrade(database.engine)
+    db = database.SessionLocal()
+    item_ids = seed(db, BENCH_STUDENTS)
+    db.close()
+
+    stats = {"reads": [], "writes": [], "errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + BENCH_SECONDS
+    threads = [
+        threading.Thread(target=worker, args=(deadline, item_ids, stats, lock))
+        for _ in range(BENCH_THREADS)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    database.engine.dispose()
+
+    def p95(values):
+        return statistics.quantiles(values, n=20)[-1] * 1000 if len(values) > 1 else 0
+
+    return {
+        "ops/s": (len(stats["reads"]) + len(stats["writes"])) / BENCH_SECONDS,
+        "reads": len(stats["reads"]),
+        "writes": len(stats["writes"]),
+        "locked": stats["errors"],
+        "read p95 ms": p95(stats["reads"]),
+        "write p95 ms": p95(stats["writes"]),
+    }
+
+
+def main():
+    profiles = []
+    with tempfile.TemporaryDirectory() as tmp:
+        profiles.append(
+            (
+                "sqlite rollback journal",
+                {
+                    "DATABASE_URL": f"sqlite:///{tmp}/journal.db",
+                    **SQLITE_ROLLBACK_JOURNAL,
+                },
+            )
+        )
+        profiles.append(("sqlite WAL", {"DATABASE_URL": f"sqlite:///{tmp}/wal.db"}))
+        if os.getenv("BENCH_POSTGRES_URL"):
+            profiles.append(
+                ("postgres", {"DATABASE_URL": os.getenv("BENCH_POSTGRES_URL")})
+            )
+
+        print(
+            f"{BENCH_THREADS} threads, {BENCH_SECONDS:g} s, {BENCH_STUDENTS} students, "
+            f"{BENCH_WRITE_RATIO:.0%} writes"
+        )
+        for name, env in profiles:
+            # database.py reads the configuration at import, so every profile
+            # runs in a new process
+            output = subprocess.run(
+                [sys.executable, __file__, "--run"],
+                env={**os.environ, **env},
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            result = json.loads(output.splitlines()[-1])
+            print(
+                f"{name:<24}"
+                + "  ".join(
+                    (
+                        f"{key} {value:.1f}"
+                        if isinstance(value, float)
+                        else f"{key} {value}"
+                    )
+                    for key, value in result.items()
+                )
+            )
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--run"]:
+        print(json.dumps(run()))
+    else:
+        main()
@@ -0,0 +1,147 @@
+"""
+Compare sending welcome emails one connection per email against the outbox sender.
+
+Both run against a local SMTP stand-in server that accepts every message and
+waits BENCH_CONNECT_DELAY seconds on every new connection, standing in for
+the TLS handshake of a real server. Run
+
+    python bench_mail.py
+
+for the comparison, or
+
+    python bench_mail.py --serve
+
+to run only the stand-in server on port 8025, for trying the server with
+MAIL_SERVER=localhost MAIL_PORT=8025 MAIL_SSL_TLS=false.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+BENCH_EMAILS = int(os.getenv("BENCH_EMAILS", 300))
+BENCH_CONNECT_DELAY = float(os.getenv("BENCH_CONNECT_DELAY", 0.05))
+STAND_IN_PORT = 8025
+
+
+class StandInSMTP:
+    """
+    A local SMTP server that accepts every message, except for recipients
+    starting with "refused", which get a permanent 550 error, and recipients
+    starting with "busy", which get a temporary 451 error.
+
+    Attributes:
+        connections (int): The number of connections accepted.
+        messages (list): The received messages as bytes.
+    """
+
+    def __init__(self, connect_delay: float = 0.0):
+        self.connect_delay = connect_delay
+        self.connections = 0
+        self.messages = []
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        await asyncio.sleep(self.connect_delay)
+        writer.write(b"220 stand-in ESMTP\r\n")
+        while line := await reader.readline():
+            command = line[:4].upper()
+            if command == b"EHLO":
+                writer.write(b"250-stand-in\r\n250 8BITMIME\r\n")
+            elif command == b"RCPT" and b"<refused" in line.lower():
+                writer.write(b"550 no such user\r\n")
+            elif command == b"RCPT" and b"<busy" in line.lower():
+                writer.write(b"451 try again later\r\n")
+            elif command == b"DATA":
+                writer.write(b"354 end with .\r\n")
+                await writer.drain()
+                data = []
+                while (line := await reader.readline()) not in (b".\r\n", b""):
+                    data.append(line)
+                self.messages.append(b"".join(data))
+                writer.write(b"250 queued\r\n")
+            elif command == b"QUIT":
+                writer.write(b"221 bye\r\n")
+                await writer.drain()
+                break
+            elif command in (b"HELO", b"MAIL", b"RCPT", b"RSET", b"NOOP"):
+                writer.write(b"250 ok\r\n")
+            else:
+                writer.write(b"502 not implemented\r\n")
+            await writer.drain()
+        writer.close()
+
+    async def start(self, port: int = 0):
+        """Listen on localhost, on a free port by default, and return the port."""
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", port)
+        return self.server.sockets[0].getsockname()[1]
+
+
+async def run(port: int, stand_in: StandInSMTP) -> list:
+    import database, mailer, migrations, models
+
+    migrations.upgrade(database.engine)
+    emails = [
+        mailer.welcome_email(f"s{i}@example.com", f"s{i}", "temporary")
+        for i in range(BENCH_EMAILS)
+    ]
+    results = []
+
+    # every email on its own connection, like the inline sending before the outbox
+    start = time.perf_counter()
+    for values in emails:
+        connection = mailer.SMTPConnection("127.0.0.1", port)
+        await connection.send(mailer.render(models.OutboxEmail(**values)))
+        await connection.close()
+    results.append(("connection per email", time.perf_counter() - start))
+
+    async with database.AsyncSessionLocal() as db:
+        await db.execute(models.OutboxEmail.__table__.insert(), emails)
+        await db.commit()
+    connections = stand_in.connections
+    connection = mailer.SMTPConnection("127.0.0.1", port)
+    start = time.perf_counter()
+    await mailer.send_pending(connection)
+    results.append(("outbox sender", time.perf_counter() - start))
+    await connection.close()
+    print(f"outbox sender opened {stand_in.connections - connections} connection(s)")
+    return results
+
+
+async def main():
+    stand_in = StandInSMTP(BENCH_CONNECT_DELAY)
+    port = await stand_in.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        # mailer and database read the configuration at import
+        os.environ.update(
+            {
+                "DATABASE_URL": f"sqlite:///{tmp}/mail.db",
+                "MAIL_SERVER": "127.0.0.1",
+                "MAIL_PORT": str(port),
+                "MAIL_SSL_TLS": "false",
+                "MAIL_STARTTLS": "false",
+                "MAIL_USERNAME": "",
+                "MAIL_FROM": "autograder@example.com",
+                "MAIL_RATE": "0",
+            }
+        )
+        print(
+            f"{BENCH_EMAILS} emails, {BENCH_CONNECT_DELAY * 1000:g} ms per new connection"
+        )
+        for name, seconds in await run(port, stand_in):
+            print(f"{name:<22}{seconds:.2f} s  {BENCH_EMAILS / seconds:.0f} emails/s")
+    stand_in.server.close()
+    await stand_in.server.wait_closed()
+
+
+async def serve():
+    stand_in = StandInSMTP()
+    await stand_in.start(STAND_IN_PORT)
+    print(f"SMTP stand-in listening on 127.0.0.1:{STAND_IN_PORT}")
+    await stand_in.server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve() if sys.argv[1:] == ["--serve"] else main())
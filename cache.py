@@ -0,0 +1,332 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CACHE_DIR = Path(os.getenv("CACHE_DIR", Path(__file__).parent / "cache"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", 10000))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", 60))
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", 10000))
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", 600))
+# the invalidation log is started over when it grows over this size
+MAX_LOG_SIZE = 1024 * 1024
+
+# stores a value only if the generation of the cache is still the one read
+# before loading it, see RedisCache.set
+SET_IF_CURRENT = """
+if (redis.call('GET', KEYS[1]) or '0') == ARGV[1] then
+    redis.call('SET', KEYS[2], ARGV[2], 'PX', ARGV[3])
+end
+"""
+
+_missing = object()
+
+
+class InvalidationLog:
+    """
+    Append-only file of invalidated keys shared by all workers on a host.
+
+    Every worker remembers how far it has read the log and evicts the keys
+    appended by other workers since. When the log is started over (replaced
+    by a new file), readers clear their whole cache.
+
+    Attributes:
+        path (Path): The path of the log file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.touch()
+        stat = self.path.stat()
+        self._inode, self._offset = stat.st_ino, stat.st_size
+
+    def publish(self, key: str):
+        """Append a key to the log, small appends are atomic between processes."""
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(f"{key}\n")
+            if f.tell() > MAX_LOG_SIZE:
+                tmp_path = self.path.with_suffix(".tmp")
+                tmp_path.touch()
+                os.replace(tmp_path, self.path)
+
+    def poll(self) -> list | None:
+        """
+        Return the keys invalidated since the last poll.
+
+        Returns:
+            list: The keys, or None if the log was started over and everything
+                has to be invalidated.
+        """
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            self.path.touch()
+            return None
+        if stat.st_ino != self._inode:
+            self._inode, self._offset = stat.st_ino, stat.st_size
+            return None
+        if stat.st_size == self._offset:
+            return []
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(stat.st_size - self._offset)
+        # a line that is still being written is read on the next poll
+        data = data[: data.rfind(b"\n") + 1]
+        self._offset += len(data)
+        return data.decode("utf-8").splitlines()
+
+
+class LRUCache:
+    """
+    Bounded in-process cache with a time to live and least recently used eviction.
+
+    With a name the invalidations are also published to the other workers
+    through an InvalidationLog in CACHE_DIR.
+
+    Attributes:
+        maxsize (int): The maximum number of entries.
+        ttl (float): The number of seconds an entry is valid.
+        hits (int): The number of lookups served from the cache.
+        misses (int): The number of lookups not found in the cache.
+        generation (int): Incremented by every invalidation, see set.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, name: str | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._log = InvalidationLog(CACHE_DIR / f"{name}.log") if name else None
+
+    def _sync(self):
+        if self._log is None:
+            return
+        keys = self._log.poll()
+        if keys is None:
+            self._entries.clear()
+        else:
+            for key in keys:
+                self._entries.pop(key, None)
+        if keys is None or keys:
+            self.generation += 1
+
+    def get(self, key: str, default=None):
+        """
+        Return the cached value of a key.
+
+        Args:
+            key (str): The key.
+            default (optional): Returned when the key is not cached. Defaults to None.
+
+        Returns:
+            The cached value or default.
+        """
+        with self._lock:
+            self._sync()
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def version(self) -> int:
+        """Return the generation to pass to set for a value that is loaded now."""
+        with self._lock:
+            self._sync()
+            return self.generation
+
+    def set(self, key: str, value, generation: int | None = None):
+        """
+        Cache a value, evicting the least recently used entry when full.
+
+        Args:
+            key (str): The key.
+            value: The value.
+            generation (int | None, optional): The version read before the value
+                was loaded. If anything was invalidated since, the value may be
+                stale and is not cached. Defaults to caching it anyway.
+        """
+        with self._lock:
+            self._sync()
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        """Drop a key from this cache and from the caches of all other workers."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self.generation += 1
+            if self._log is not None:
+                self._log.publish(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def stats(self) -> dict:
+        """Return the number of entries, hits and misses of this worker."""
+        with self._lock:
+            return {
+                "backend": "local",
+                "entries": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class RedisCache:
+    """
+    Cache in a Redis server, shared by the workers of all hosts.
+
+    Values are stored as JSON with a time to live, Redis evicts by its own
+    maxmemory policy. Invalidations delete the key and increment a generation
+    counter in Redis, which makes set skip values loaded before.
+
+    Attributes:
+        ttl (float): The number of seconds an entry is valid.
+        hits (int): The number of lookups of this worker served from the cache.
+        misses (int): The number of lookups of this worker not found in the cache.
+    """
+
+    def __init__(self, url: str, ttl: float, name: str):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("The redis cache requires redis, run: pip install redis")
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.prefix = f"cache:{name}:"
+        self._generation_key = f"cache:{name}#generation"
+        self._set_if_current = self.client.register_script(SET_IF_CURRENT)
+
+    def get(self, key: str, default=None):
+        """Return the cached value of a key, or default."""
+        data = self.client.get(self.prefix + key)
+        if data is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return json.loads(data)
+
+    def version(self) -> int:
+        """Return the generation to pass to set for a value that is loaded now."""
+        return int(self.client.get(self._generation_key) or 0)
+
+    def set(self, key: str, value, generation: int | None = None):
+        """Cache a JSON serializable value, unless invalidated since generation."""
+        data = json.dumps(value, default=str)
+        ttl = int(self.ttl * 1000)
+        if generation is None:
+            self.client.set(self.prefix + key, data, px=ttl)
+        else:
+            self._set_if_current(
+                keys=[self._generation_key, self.prefix + key],
+                args=[generation, data, ttl],
+            )
+
+    def invalidate(self, key: str):
+        """Drop a key for all workers."""
+        with self.client.pipeline() as pipeline:
+            pipeline.delete(self.prefix + key)
+            pipeline.incr(self._generation_key)
+            pipeline.execute()
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+        self.client.incr(self._generation_key)
+
+    def stats(self) -> dict:
+        """Return the hits and misses of this worker."""
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses}
+
+
+def read_through(store, key: str, load):
+    """
+    Return the cached value of a key, loading and caching it on a miss.
+
+    None is not cached, so creating a row does not need an invalidation.
+
+    Args:
+        store (LRUCache | RedisCache): The cache.
+        key (str): The key.
+        load: Function without arguments returning the current value or None.
+
+    Returns:
+        The value, or None.
+    """
+    value = store.get(key, _missing)
+    if value is not _missing:
+        return value
+    generation = store.version()
+    value = load()
+    if value is not None:
+        store.set(key, value, generation)
+    return value
+
+
+async def read_through_async(store, key: str, load):
+    """Like read_through, for a load function returning an awaitable."""
+    value = store.get(key, _missing)
+    if value is not _missing:
+        return value
+    generation = store.version()
+    value = await load()
+    if value is not None:
+        store.set(key, value, generation)
+    return value
+
+
+def get_catalog_cache(name: str):
+    """
+    Create a cache of catalog rows configured in .env.
+
+    CACHE_BACKEND is either "local" (default, a LRUCache of CATALOG_CACHE_SIZE
+    entries in every worker) or "redis" (a RedisCache at REDIS_URL, shared by
+    all hosts). Entries expire after CATALOG_CACHE_TTL seconds.
+
+    Args:
+        name (str): The name of the cache.
+
+    Returns:
+        LRUCache | RedisCache: The cache.
+    """
+    backend = os.getenv("CACHE_BACKEND", "local")
+    if backend == "local":
+        return LRUCache(CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL, name=name)
+    elif backend == "redis":
+        return RedisCache(
+            os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+            CATALOG_CACHE_TTL,
+            name=name,
+        )
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+
+# principals resolved from access tokens by auth.get_current_user, by username
+principals = LRUCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL, name="principals")
+# column values of classrooms and assignments by ID, see crud.get_classroom_by_id
+# and crud.get_assignment_by_id
+classrooms = get_catalog_cache("classrooms")
+assignments = get_catalog_cache("assignments")
@@ -1,26 +1,129 @@
-from sqlalchemy.orm import Session
+from datetime import datetime
 
-import models, schemas
-from passlib.context import CryptContext
+from sqlalchemy import case, func, insert, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
 
+import cache, gradebook, grading, hashing, models, schemas, search, similarity, versions
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# the columns of a user shown by the API, the role name is joined as "roles"
+USER_COLUMNS = (
+    models.User.id,
+    models.User.username,
+    models.User.email,
+    models.User.role_id,
+    models.Role.name.label("roles"),
+    models.User.is_active,
+    models.User.is_first_login,
+)
+ITEM_COLUMNS = tuple(models.Item.__table__.c)
+ASSIGNMENT_COLUMNS = tuple(models.Assignment.__table__.c)
+CLASSROOM_COLUMNS = tuple(models.Classroom.__table__.c)
+# tries to number a new item version when concurrent uploads take the number
+VERSION_ATTEMPTS = 5
 
 
-def add_role_hide_password(db: Session, user):
+def is_unique_violation(error: IntegrityError) -> bool:
     """
-    Adds role to the user and hides the password.
+    Return whether an IntegrityError is a duplicate key, not e.g. a missing foreign key.
 
     Args:
-        db (Session): The database session.
-        user: The user object.
+        error (IntegrityError): The error raised by the database.
+
+    Returns:
+        bool: True for a unique or primary key constraint violation.
+    """
+    # SQLSTATE of Postgres, psycopg2 and asyncpg name the attribute differently
+    code = getattr(error.orig, "pgcode", None) or getattr(error.orig, "sqlstate", None)
+    if code is not None:
+        return code == "23505"
+    return "UNIQUE constraint failed" in str(error.orig)
+
+
+def user_rows_statement():
+    """
+    Return a select of the USER_COLUMNS of users, without the password hash.
+
+    The rows are read-only tuples, nothing is loaded into the session, so
+    nothing can be flushed back by accident.
+    """
+    return select(*USER_COLUMNS).outerjoin(
+        models.Role, models.Role.id == models.User.role_id
+    )
+
+
+def item_rows_statement():
+    """Return a select of the ITEM_COLUMNS of items."""
+    return select(*ITEM_COLUMNS)
+
+
+def assignment_rows_statement():
+    """Return a select of the ASSIGNMENT_COLUMNS of assignments."""
+    return select(*ASSIGNMENT_COLUMNS)
+
+
+def classroom_rows_statement():
+    """Return a select of the CLASSROOM_COLUMNS of classrooms."""
+    return select(*CLASSROOM_COLUMNS)
+
+
+def as_dict(row) -> dict | None:
+    """Return the column values of a row as a dictionary, the form cached in cache."""
+    return None if row is None else row._asdict()
+
+
+def class_users_statement(class_id: int):
+    """Return a select of the USER_COLUMNS of the users enrolled in a class."""
+    return (
+        user_rows_statement()
+        .join(models.UserClassroom, models.User.id == models.UserClassroom.user_id)
+        .where(models.UserClassroom.classroom_id == class_id)
+    )
+
+
+def keyset(statement, key, after: int | None = None, limit: int | None = None):
+    """
+    Page a select by a unique key column instead of OFFSET.
+
+    The page starts right after the key of the last row of the previous page,
+    so it is found through the index however deep it is.
+
+    Args:
+        statement (Select): The select.
+        key (Column): The unique key column, usually the primary key.
+        after (int | None, optional): The key of the last row of the previous page.
+            Defaults to the first page.
+        limit (int | None, optional): Maximum number of rows. Defaults to all rows.
 
     Returns:
-        The updated user object.
+        Select: The select of the page, ordered by the key.
+    """
+    if after is not None:
+        statement = statement.where(key > after)
+    statement = statement.order_by(key)
+    return statement if limit is None else statement.limit(limit)
+
+
+def iter_keyset(db: Session, statement, key, batch_size: int = 1000):
+    """
+    Yield all rows of a select, fetched in keyset pages of batch_size rows.
+
+    Args:
+        db (Session): The database session.
+        statement (Select): The select, it has to return the key column.
+        key (Column): The unique key column, usually the primary key.
+        batch_size (int, optional): The rows fetched at once. Defaults to 1000.
+
+    Yields:
+        Row: The rows ordered by the key.
     """
-    user.roles = get_user_role(db, user.id)
-    user.hashed_password = None
-    return user
+    after = None
+    while True:
+        rows = db.execute(keyset(statement, key, after, batch_size)).all()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        after = getattr(rows[-1], key.key)
 
 
 def get_user(db: Session, user_id: int):
@@ -32,11 +135,9 @@ def get_user(db: Session, user_id: int):
         user_id (int): The ID of the user.
 
     Returns:
-        User: The user with the specified ID, or None if not found.
+        Row: The USER_COLUMNS of the user, or None if not found.
     """
-    return add_role_hide_password(
-        db, db.query(models.User).filter(models.User.id == user_id).first()
-    )
+    return db.execute(user_rows_statement().where(models.User.id == user_id)).first()
 
 
 def get_user_by_username(db: Session, username: str):
@@ -67,22 +168,48 @@ def get_user_by_email(db: Session, email: str) -> models.User:
     return db.query(models.User).filter(models.User.email == email).first()
 
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
+def get_users(db: Session, after: int | None = None, limit: int = 100):
     """
-    Return a list of users with a given offset and limit
+    Return a page of users ordered by ID
 
     Args:
         db (Session): The database session.
-        skip (int, optional): Number of users to skip. Defaults to 0.
+        after (int | None, optional): The ID of the last user of the previous page.
+            Defaults to the first page.
         limit (int, optional): Maximum number of users to retrieve. Defaults to 100.
 
     Returns:
-        List[User]: List of users retrieved from the database.
+        list[Row]: The USER_COLUMNS of the users.
     """
-    users = db.query(models.User).offset(skip).limit(limit).all()
-    for user in users:
-        user = add_role_hide_password(db, user)
-    return users
+    return db.execute(keyset(user_rows_statement(), models.User.id, after, limit)).all()
+
+
+def search_users(db: Session, q: str, limit: int = 50):
+    """
+    Return the users whose username or email contain words starting with the typed words.
+
+    Args:
+        db (Session): The database session.
+        q (str): The query as typed.
+        limit (int, optional): Maximum number of users. Defaults to 50.
+
+    Returns:
+        list[Row]: The USER_COLUMNS of the users, best matches first.
+    """
+    sqlite = db.get_bind().dialect.name == "sqlite"
+    query = search.match_query(q, sqlite)
+    if query is None:
+        return []
+    hits = (
+        search.hits_statement(["user"], sqlite)
+        .bindparams(q=query, limit=limit)
+        .subquery()
+    )
+    return db.execute(
+        user_rows_statement()
+        .join(hits, hits.c.id == models.User.id)
+        .order_by(hits.c.rank)
+    ).all()
 
 
 def get_user_by_role(db: Session, role: str):
@@ -134,21 +261,26 @@ def get_password_hash(password):
     Returns:
         str: The hashed password.
     """
-    return pwd_context.hash(password)
+    return hashing.hash_password_sync(password)
 
 
-def create_user(db: Session, user: schemas.UserCreate):
+def create_user(
+    db: Session, user: schemas.UserCreate, hashed_password: str | None = None
+):
     """
     Create a new user with the given user details
 
     Args:
         db (Session): The database session.
         user (UserCreate): The user data to be created.
+        hashed_password (str, optional): The password hashed with
+            hashing.hash_password. Defaults to hashing the password here.
 
     Returns:
         User: The created user.
     """
-    hashed_password = get_password_hash(user.password)
+    if hashed_password is None:
+        hashed_password = get_password_hash(user.password)
     db_user = models.User(
         email=user.email,
         hashed_password=hashed_password,
@@ -176,24 +308,28 @@ def change_user_role(db: Session, email: str, role_id: int):
 
     db_user = db.query(models.User).filter(models.User.email == email).first()
     db_user.role_id = role_id
+    # tokens issued with the old role are no longer accepted
+    db_user.role_version = (db_user.role_version or 0) + 1
     db.commit()
+    cache.principals.invalidate(db_user.username)
     db.refresh(db_user)
     return db_user
 
 
-def get_items(db: Session, skip: int = 0, limit: int = 100):
+def get_items(db: Session, after: int | None = None, limit: int = 100):
     """
-    Retrieve all items from the database.
+    Retrieve a page of items ordered by ID from the database.
 
     Args:
         db (Session): The database session.
-        skip (int, optional): Number of items to skip. Defaults to 0.
+        after (int | None, optional): The ID of the last item of the previous page.
+            Defaults to the first page.
         limit (int, optional): Maximum number of items to retrieve. Defaults to 100.
 
     Returns:
-        List[Item]: List of items retrieved from the database.
+        list[Row]: The columns of the items.
     """
-    return db.query(models.Item).offset(skip).limit(limit).all()
+    return db.execute(keyset(item_rows_statement(), models.Item.id, after, limit)).all()
 
 
 def get_item(db: Session, filename: str):
@@ -238,6 +374,47 @@ def get_user_item(db: Session, user_id: int):
     return db.query(models.Item).filter(models.Item.owner_id == user_id).all()
 
 
+def user_progress_statement(user_id: int):
+    """Build the query of get_user_progress, shared with async_crud."""
+    progress = models.StudentProgress
+    return (
+        select(
+            progress.item_id.label("id"),
+            progress.user_id.label("owner_id"),
+            progress.assignment_id,
+            progress.mark,
+            (progress.status >= gradebook.FAILED).label("tested"),
+            (progress.status == gradebook.PASSED).label("passed"),
+            models.Assignment.name.label("assignment_name"),
+            models.Classroom.id.label("classroom_id"),
+            models.Classroom.name.label("classroom_name"),
+        )
+        .join(models.Assignment, models.Assignment.id == progress.assignment_id)
+        .join(models.Classroom, models.Classroom.id == progress.classroom_id)
+        .where(progress.user_id == user_id)
+        .order_by(progress.classroom_id, progress.assignment_id)
+    )
+
+
+def get_user_progress(db: Session, user_id: int):
+    """
+    Retrieve the status of a student in every assignment of their classes.
+
+    The rows are read from the progress table kept by gradebook.sync, one per
+    assignment, also for assignments nothing was turned in for yet.
+
+    Args:
+        db (Session): The database session.
+        user_id (int): The ID of the user.
+
+    Returns:
+        list[Row]: The item id (None if nothing was turned in), owner_id,
+            assignment_id, mark, tested, passed, assignment_name, classroom_id
+            and classroom_name.
+    """
+    return db.execute(user_progress_statement(user_id)).all()
+
+
 def create_user_item(
     db: Session,
     item: schemas.ItemCreate,
@@ -264,11 +441,42 @@ def create_user_item(
     db_item.owner_id = user_id
     db_item.assignment_id = ass_id
     db.add(db_item)
+    gradebook.sync(db, [ass_id], [user_id])
     db.commit()
     db.refresh(db_item)
     return db_item
 
 
+def set_item_content_hash(db: Session, user_id: int, ass_id: int, content_hash: str):
+    """
+    Store the content hash of an uploaded file on the user's item.
+
+    The item is created when the upload arrives before the item itself.
+
+    Args:
+        db (Session): The database session.
+        user_id (int): The ID of the user.
+        ass_id (int): The ID of the assignment.
+        content_hash (str): The sha256 hex digest of the uploaded file.
+
+    Returns:
+        Item: The updated item.
+    """
+    db_item = get_item(db, f"HW_{ass_id}_{user_id}")
+    if db_item is None:
+        try:
+            db_item = create_user_item(
+                db, schemas.ItemCreate(assignment_id=ass_id), user_id, ass_id
+            )
+        except IntegrityError as error:
+            db.rollback()
+            if not is_unique_violation(error):
+                raise
+            # created concurrently by /create_item
+            db_item = get_item(db, f"HW_{ass_id}_{user_id}")
+    return update_item(db=db, item_id=db_item.id, content_hash=content_hash)
+
+
 def is_teacher(db: Session, user_id: int):
     """
     Check if a user is a teacher based on their role.
@@ -374,6 +582,7 @@ def update_item(
     pass_point: int | None = None,
     fail_point: int | None = None,
     description: str | None = None,
+    content_hash: str | None = None,
 ):
     """
     Update an item in the database with the provided information.
@@ -387,6 +596,7 @@ def update_item(
         pass_point (int): The passing point for the item.
         fail_point (int): The failing point for the item.
         description (str): The description of the item.
+        content_hash (str): The sha256 hex digest of the uploaded file.
 
     Returns:
         Item: The updated item.
@@ -404,6 +614,10 @@ def update_item(
         db_item.pass_point = pass_point
     if fail_point is not None:
         db_item.fail_point = fail_point
+    if content_hash is not None:
+        db_item.content_hash = content_hash
+    if tested is not None or passed is not None or mark is not None:
+        gradebook.sync(db, [db_item.assignment_id], [db_item.owner_id])
 
     db.commit()
     db.refresh(db_item)
@@ -423,11 +637,13 @@ def update_user(db: Session, user_id: int, user: schemas.User):
         User: The updated user.
     """
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    cache.principals.invalidate(db_user.username)
     db_user.email = user.email
     db_user.username = user.username
     db_user.role = user.role
     db_user.hashed_password = get_password_hash(user.password)
     db.commit()
+    cache.principals.invalidate(db_user.username)
     db.refresh(db_user)
     return db_user
 
@@ -447,6 +663,8 @@ def update_password(db: Session, user_id: int, password: str):
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
     db_user.hashed_password = get_password_hash(password)
     db.commit()
+    revoke_refresh_tokens(db, user_id=user_id)
+    cache.principals.invalidate(db_user.username)
     db.refresh(db_user)
     return db_user
 
@@ -462,7 +680,10 @@ def delete_item(db: Session, item_id: int):
     Returns:
         dict: A dictionary with a message indicating the success of the deletion.
     """
+    db_item = db.query(models.Item).filter(models.Item.id == item_id).first()
     db.query(models.Item).filter(models.Item.id == item_id).delete()
+    if db_item is not None:
+        gradebook.sync(db, [db_item.assignment_id], [db_item.owner_id])
     db.commit()
     return {"message": "Item deleted successfully"}
 
@@ -478,8 +699,37 @@ def delete_user(db: Session, user_id: int):
     Returns:
         dict: A dictionary with a message indicating the success of the deletion.
     """
+    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    # the progress rows of the user cascade, the stats of their assignments
+    # are recomputed below
+    enrolled = db.scalars(
+        select(models.StudentProgress.assignment_id).where(
+            models.StudentProgress.user_id == user_id
+        )
+    ).all()
+    # the classes and assignments of a teacher stay with the work of their
+    # students, only their owner is cleared
+    own_assignments = db.scalars(
+        update(models.Assignment)
+        .where(models.Assignment.owner_id == user_id)
+        .values(owner_id=None)
+        .returning(models.Assignment.id)
+    ).all()
+    own_classrooms = db.scalars(
+        update(models.Classroom)
+        .where(models.Classroom.owner_id == user_id)
+        .values(owner_id=None)
+        .returning(models.Classroom.id)
+    ).all()
     db.query(models.User).filter(models.User.id == user_id).delete()
+    gradebook.sync_stats(db, enrolled)
     db.commit()
+    if db_user is not None:
+        cache.principals.invalidate(db_user.username)
+    for classroom_id in own_classrooms:
+        cache.classrooms.invalidate(str(classroom_id))
+    for assignment_id in own_assignments:
+        cache.assignments.invalidate(str(assignment_id))
     return {"message": "User deleted successfully"}
 
 
@@ -506,6 +756,8 @@ def create_assignment(
     db_assignment.owner_id = user_id
     db_assignment.classroom_id = classroom_id
     db.add(db_assignment)
+    db.flush()
+    gradebook.sync(db, [db_assignment.id])
     db.commit()
     db.refresh(db_assignment)
     return update_assignment(
@@ -513,19 +765,22 @@ def create_assignment(
     )
 
 
-def get_assignments(db: Session, skip: int = 0, limit: int = 100):
+def get_assignments(db: Session, after: int | None = None, limit: int = 100):
     """
-    Retrieve all assignments from the database.
+    Retrieve a page of assignments ordered by ID from the database.
 
     Args:
         db (Session): The database session.
-        skip (int, optional): Number of assignments to skip. Defaults to 0.
+        after (int | None, optional): The ID of the last assignment of the previous
+            page. Defaults to the first page.
         limit (int, optional): Maximum number of assignments to retrieve. Defaults to 100.
 
     Returns:
-        List[Assignment]: List of assignments retrieved from the database.
+        list[Row]: The columns of the assignments, without their items.
     """
-    return db.query(models.Assignment).offset(skip).limit(limit).all()
+    return db.execute(
+        keyset(assignment_rows_statement(), models.Assignment.id, after, limit)
+    ).all()
 
 
 def get_assignment_by_id(db: Session, assignment_id: int):
@@ -536,15 +791,22 @@ def get_assignment_by_id(db: Session, assignment_id: int):
         db (Session): The database session.
         assignment_id (int): The ID of the assignment to retrieve.
 
-    Returns:
-        Assignment: The assignment with the specified ID, or None if not found.
-    """
+    The columns are served from cache.assignments, the writes below
+    invalidate them after their commit.
 
-    return (
-        db.query(models.Assignment)
-        .filter(models.Assignment.id == assignment_id)
-        .first()
+    Returns:
+        AssignmentRow: The assignment with the specified ID, or None if not found.
+    """
+    values = cache.read_through(
+        cache.assignments,
+        str(assignment_id),
+        lambda: as_dict(
+            db.execute(
+                assignment_rows_statement().where(models.Assignment.id == assignment_id)
+            ).first()
+        ),
     )
+    return None if values is None else schemas.AssignmentRow(**values)
 
 
 def get_my_assignments(db: Session, user_id: int):
@@ -569,6 +831,7 @@ def update_assignment(
     description: str | None = None,
     github_url: str | None = None,
     filename: str | None = None,
+    test_hash: str | None = None,
 ):
     """
     Update an assignment in the database with the provided information.
@@ -579,6 +842,7 @@ def update_assignment(
         description (str): The updated description of the assignment.
         github_url (str): The updated GitHub URL of the assignment.
         filename (str): The updated filename of the assignment.
+        test_hash (str): The sha256 hex digest of the test file.
 
     Returns:
         Assignment: The updated assignment.
@@ -594,7 +858,10 @@ def update_assignment(
         db_assignment.github_url = github_url
     if filename is not None:
         db_assignment.filename = filename
+    if test_hash is not None:
+        db_assignment.test_hash = test_hash
     db.commit()
+    cache.assignments.invalidate(str(assignment_id))
     db.refresh(db_assignment)
     return db_assignment
 
@@ -623,19 +890,22 @@ def create_classroom(db: Session, classroom: schemas.ClassroomCreate, user_id: i
     return db_classroom
 
 
-def get_classrooms(db: Session, skip: int = 0, limit: int = 100):
+def get_classrooms(db: Session, after: int | None = None, limit: int = 100):
     """
-    Retrieve all classrooms from the database.
+    Retrieve a page of classrooms ordered by ID from the database.
 
     Args:
         db (Session): The database session.
-        skip (int, optional): Number of classrooms to skip. Defaults to 0.
+        after (int | None, optional): The ID of the last classroom of the previous
+            page. Defaults to the first page.
         limit (int, optional): Maximum number of classrooms to retrieve. Defaults to 100.
 
     Returns:
         List[Classroom]: List of classrooms retrieved from the database.
     """
-    return db.query(models.Classroom).offset(skip).limit(limit).all()
+    return db.scalars(
+        keyset(select(models.Classroom), models.Classroom.id, after, limit)
+    ).all()
 
 
 def get_classroom_by_id(db: Session, classroom_id: int):
@@ -646,12 +916,21 @@ def get_classroom_by_id(db: Session, classroom_id: int):
         db (Session): The database session.
         classroom_id (int): The ID of the classroom to retrieve.
 
+    The columns are served from cache.classrooms, like get_assignment_by_id.
+
     Returns:
-        Classroom: The classroom with the specified ID, or None if not found.
-    """
-    return (
-        db.query(models.Classroom).filter(models.Classroom.id == classroom_id).first()
+        ClassroomRow: The classroom with the specified ID, or None if not found.
+    """
+    values = cache.read_through(
+        cache.classrooms,
+        str(classroom_id),
+        lambda: as_dict(
+            db.execute(
+                classroom_rows_statement().where(models.Classroom.id == classroom_id)
+            ).first()
+        ),
     )
+    return None if values is None else schemas.ClassroomRow(**values)
 
 
 def is_student_in_db(db: Session, student_id: int):
@@ -731,6 +1010,7 @@ def enroll_student(db: Session, classroom_id: int, user_id: int):
     )
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
     db_classroom.students.append(db_user)
+    gradebook.sync(db, user_ids=[user_id])
     db.commit()
     db.refresh(db_classroom)
     return db_classroom
@@ -765,34 +1045,100 @@ def get_item_pass(db: Session, user_id: int, ass_id: int):
         return False
 
 
-def get_users_in_class(db: Session, class_id: int):
+def get_items_pass(db: Session, user_id: int, ass_ids: list) -> dict:
     """
-    Return users in given class
+    Return whether the items of a user for the given assignments are passed.
+
+    Args:
+        db (Session): The database session.
+        user_id (int): The ID of the user.
+        ass_ids (list): The IDs of the assignments.
+
+    Returns:
+        dict: The passed flag by assignment ID, False for assignments without an item.
     """
-    users = (
-        db.query(models.User)
-        .join(models.UserClassroom, models.User.id == models.UserClassroom.user_id)
-        .filter(models.UserClassroom.classroom_id == class_id)
-        .all()
+    return dict.fromkeys(ass_ids, False) | {
+        ass_id: status == gradebook.PASSED
+        for ass_id, status in db.execute(items_pass_statement(user_id, ass_ids))
+    }
+
+
+def items_pass_statement(user_id: int, ass_ids: list):
+    """Build the query of get_items_pass, shared with async_crud."""
+    return (
+        select(models.StudentProgress.assignment_id, models.StudentProgress.status)
+        .where(models.StudentProgress.user_id == user_id)
+        .where(models.StudentProgress.assignment_id.in_(ass_ids))
+    )
+
+
+def get_classroom_with_assignments(db: Session, classroom_id: int):
+    """
+    Retrieve a classroom with its assignments loaded in the same round trip.
+
+    Args:
+        db (Session): The database session.
+        classroom_id (int): The ID of the classroom to retrieve.
+
+    Returns:
+        Classroom: The classroom with the specified ID, or None if not found.
+    """
+    return (
+        db.query(models.Classroom)
+        .options(selectinload(models.Classroom.assignments))
+        .filter(models.Classroom.id == classroom_id)
+        .first()
     )
-    for user in users:
-        user = add_role_hide_password(db, user)
-    return users
+
+
+def get_users_in_class(
+    db: Session, class_id: int, after: int | None = None, limit: int | None = None
+):
+    """
+    Return users in given class ordered by ID
+
+    Args:
+        db (Session): The database session.
+        class_id (int): The ID of the classroom.
+        after (int | None, optional): The ID of the last user of the previous page.
+            Defaults to the first page.
+        limit (int | None, optional): Maximum number of users. Defaults to all users.
+
+    Returns:
+        list[Row]: The USER_COLUMNS of the users.
+    """
+    return db.execute(
+        keyset(class_users_statement(class_id), models.User.id, after, limit)
+    ).all()
 
 
 def delete_assignment(db: Session, ass_id: int):
-    """Delete an assignment from the database by its ID."""
+    """Delete an assignment and its submissions from the database by its ID."""
 
+    db.query(models.Item).filter(models.Item.assignment_id == ass_id).delete()
     db.query(models.Assignment).filter(models.Assignment.id == ass_id).delete()
+    gradebook.sync(db, [ass_id])
     db.commit()
+    cache.assignments.invalidate(str(ass_id))
     return {"message": "Assignment deleted successfully"}
 
 
 def delete_classroom(db: Session, ass_id: int):
-    """Delete a classroom from the database by its ID."""
+    """Delete a classroom with its assignments and submissions by its ID."""
 
+    assignments = select(models.Assignment.id).where(
+        models.Assignment.classroom_id == ass_id
+    )
+    assignment_ids = db.scalars(assignments).all()
+    db.query(models.Item).filter(models.Item.assignment_id.in_(assignments)).delete(
+        synchronize_session=False
+    )
     db.query(models.Classroom).filter(models.Classroom.id == ass_id).delete()
+    gradebook.sync(db, assignment_ids)
     db.commit()
+    cache.classrooms.invalidate(str(ass_id))
+    for assignment_id in assignment_ids:
+        cache.assignments.invalidate(str(assignment_id))
     return {"message": "Class deleted successfully"}
 
 
@@ -811,19 +1157,115 @@ def pop_user_from_class(db: Session, user_id: int, class_id: int):
     db.query(models.UserClassroom).filter(
         models.UserClassroom.user_id == user_id
     ).filter(models.UserClassroom.classroom_id == class_id).delete()
+    gradebook.sync(db, user_ids=[user_id])
     db.commit()
     return {"message": "User removed successfully"}
 
 
-def update_user_password(db: Session, user_id: int, new_password: str):
-    """Update user password"""
+def update_user_password(
+    db: Session, user_id: int, new_password: str, hashed_password: str | None = None
+):
+    """Update user password, hashed_password can be precomputed by hashing.hash_password"""
     user = db.query(models.User).filter(models.User.id == user_id).first()
-    user.hashed_password = get_password_hash(new_password)
+    user.hashed_password = hashed_password or get_password_hash(new_password)
     db.commit()
+    revoke_refresh_tokens(db, user_id=user_id)
+    cache.principals.invalidate(user.username)
     db.refresh(user)
     return {"message": "Password changed successfully!"}
 
 
+def create_refresh_token(
+    db: Session, user_id: int, token_hash: str, family: str, expires_at: datetime
+):
+    """
+    Store the hash of a new refresh token.
+
+    Args:
+        db (Session): The database session.
+        user_id (int): The ID of the user.
+        token_hash (str): The sha256 hex digest of the token.
+        family (str): The family of the token.
+        expires_at (datetime): The expiration time in UTC.
+
+    Returns:
+        RefreshToken: The stored token.
+    """
+    db_token = models.RefreshToken(
+        user_id=user_id, token_hash=token_hash, family=family, expires_at=expires_at
+    )
+    db.add(db_token)
+    db.commit()
+    return db_token
+
+
+def get_refresh_token(db: Session, token_hash: str) -> models.RefreshToken:
+    """Retrieve a refresh token by the sha256 of the token."""
+    return (
+        db.query(models.RefreshToken)
+        .filter(models.RefreshToken.token_hash == token_hash)
+        .first()
+    )
+
+
+def use_refresh_token(db: Session, token_id: int, now: datetime) -> bool:
+    """
+    Mark a refresh token as used.
+
+    Args:
+        db (Session): The database session.
+        token_id (int): The ID of the token.
+        now (datetime): The current time in UTC.
+
+    Returns:
+        bool: False if the token was already used by a concurrent request.
+    """
+    used = (
+        db.query(models.RefreshToken)
+        .filter(models.RefreshToken.id == token_id)
+        .filter(models.RefreshToken.revoked_at.is_(None))
+        .update({models.RefreshToken.revoked_at: now})
+    )
+    db.commit()
+    return used == 1
+
+
+def revoke_refresh_tokens(
+    db: Session, family: str | None = None, user_id: int | None = None
+):
+    """
+    Revoke all valid refresh tokens of a family or of a user.
+
+    Args:
+        db (Session): The database session.
+        family (str, optional): The family of the tokens.
+        user_id (int, optional): The ID of the user.
+    """
+    query = db.query(models.RefreshToken).filter(
+        models.RefreshToken.revoked_at.is_(None)
+    )
+    if family is not None:
+        query = query.filter(models.RefreshToken.family == family)
+    if user_id is not None:
+        query = query.filter(models.RefreshToken.user_id == user_id)
+    query.update({models.RefreshToken.revoked_at: datetime.utcnow()})
+    db.commit()
+
+
+def delete_expired_refresh_tokens(db: Session, now: datetime):
+    """Delete refresh tokens that expired before now."""
+    db.query(models.RefreshToken).filter(models.RefreshToken.expires_at < now).delete()
+    db.commit()
+
+
+def set_password_hash(db: Session, user_id: int, hashed_password: str):
+    """Replace the password hash of a user, e.g. after a change of the cost factor."""
+    db.query(models.User).filter(models.User.id == user_id).update(
+        {models.User.hashed_password: hashed_password}
+    )
+    db.commit()
+
+
 def is_first_login(db: Session, user_id: int):
     return (
         db.query(models.User).filter(models.User.id == user_id).first().is_first_login
@@ -836,6 +1278,7 @@ def first_password_changed(db: Session, user_id: int):
     user = db.query(models.User).filter(models.User.id == user_id).first()
     user.is_first_login = False
     db.commit()
+    cache.principals.invalidate(user.username)
     return {"message": "First login password changed successfully!"}
 
 
@@ -847,3 +1290,566 @@ def get_item_by_user_assignment(db: Session, user_id: int, assignment_id: int):
         .filter(models.Item.assignment_id == assignment_id)
         .first()
     )
+
+
+RESULT_STATUS = case(
+    (models.StudentProgress.status == gradebook.PASSED, "passed"),
+    (models.StudentProgress.status == gradebook.FAILED, "tested"),
+    else_="not turned over",
+)
+# columns the results of an assignment can be sorted by, ties are broken by user ID
+RESULT_SORT_KEYS = {
+    "name": models.User.username,
+    "mark": models.StudentProgress.mark,
+    "status": models.StudentProgress.status,
+}
+RESULT_FILTERS = {
+    "not_turned_in": models.StudentProgress.status == gradebook.NOT_TESTED,
+    "failed": models.StudentProgress.status == gradebook.FAILED,
+    "passed": models.StudentProgress.status == gradebook.PASSED,
+}
+
+
+def assignment_results_statement(
+    assignment_id: int,
+    class_id: int,
+    sort: str = "name",
+    descending: bool = False,
+    status: str | None = None,
+    after: list | None = None,
+    limit: int = 100,
+):
+    """Build the query of get_assignment_results, shared with async_crud."""
+    sort_key = RESULT_SORT_KEYS[sort]
+    progress = models.StudentProgress
+    statement = (
+        select(
+            models.User.id,
+            models.User.username,
+            RESULT_STATUS,
+            progress.mark,
+            sort_key,
+        )
+        .select_from(progress)
+        .join(models.User, models.User.id == progress.user_id)
+        .where(progress.assignment_id == assignment_id)
+        .where(progress.classroom_id == class_id)
+    )
+    if status is not None:
+        statement = statement.where(RESULT_FILTERS[status])
+    if after is not None:
+        key = tuple_(sort_key, models.User.id)
+        statement = statement.where(
+            key < tuple(after) if descending else key > tuple(after)
+        )
+    if descending:
+        statement = statement.order_by(sort_key.desc(), models.User.id.desc())
+    else:
+        statement = statement.order_by(sort_key, models.User.id)
+    return statement.limit(limit)
+
+
+def assignment_results_rows(rows) -> list:
+    """Turn the rows of assignment_results_statement into dictionaries."""
+    return [
+        {
+            "user_id": user_id,
+            "username": username,
+            "status": result,
+            "mark": mark,
+            "sort_key": [key, user_id],
+        }
+        for user_id, username, result, mark, key in rows
+    ]
+
+
+def get_assignment_results(
+    db: Session,
+    assignment_id: int,
+    class_id: int,
+    sort: str = "name",
+    descending: bool = False,
+    status: str | None = None,
+    after: list | None = None,
+    limit: int = 100,
+):
+    """
+    Retrieve one page of the results of all students of a class for an assignment.
+
+    The page is read from the progress rows of the assignment kept by
+    gradebook.sync, sorted and filtered in the database. Pages are addressed by the sort key of the
+    last row of the previous page (keyset pagination), so every page costs the
+    same regardless of its position.
+
+    Args:
+        db (Session): The database session.
+        assignment_id (int): The ID of the assignment.
+        class_id (int): The ID of the class.
+        sort (str, optional): One of RESULT_SORT_KEYS. Defaults to "name".
+        descending (bool, optional): Sort in descending order. Defaults to False.
+        status (str, optional): One of RESULT_FILTERS. Defaults to None.
+        after (list, optional): The sort key and user ID of the last row of the
+            previous page. Defaults to None.
+        limit (int, optional): Maximum number of rows. Defaults to 100.
+
+    Returns:
+        list: Dictionaries with user_id, username, status, mark and sort_key.
+    """
+    statement = assignment_results_statement(
+        assignment_id, class_id, sort, descending, status, after, limit
+    )
+    return assignment_results_rows(db.execute(statement).all())
+
+
+def get_last_item_version(db: Session, item_id: int) -> models.ItemVersion:
+    """Retrieve the latest version of an item from the database."""
+    return (
+        db.query(models.ItemVersion)
+        .filter(models.ItemVersion.item_id == item_id)
+        .order_by(models.ItemVersion.number.desc())
+        .first()
+    )
+
+
+def get_item_versions(db: Session, item_id: int):
+    """
+    Retrieve all versions of an item ordered by version number.
+
+    Args:
+        db (Session): The database session.
+        item_id (int): The ID of the item.
+
+    Returns:
+        List[ItemVersion]: The versions of the item.
+    """
+    return (
+        db.query(models.ItemVersion)
+        .filter(models.ItemVersion.item_id == item_id)
+        .order_by(models.ItemVersion.number)
+        .all()
+    )
+
+
+def get_item_version_content(db: Session, item_id: int, number: int) -> bytes | None:
+    """
+    Rebuild the file of an item version from its keyframe and deltas.
+
+    Args:
+        db (Session): The database session.
+        item_id (int): The ID of the item.
+        number (int): The number of the version.
+
+    Returns:
+        bytes: The content of the version, or None if not found.
+    """
+    chain = (
+        db.query(models.ItemVersion)
+        .filter(models.ItemVersion.item_id == item_id)
+        .filter(models.ItemVersion.number >= versions.keyframe_number(number))
+        .filter(models.ItemVersion.number <= number)
+        .order_by(models.ItemVersion.number)
+        .all()
+    )
+    if not chain or chain[-1].number != number:
+        return None
+    return versions.rebuild(chain)
+
+
+def create_item_version(db: Session, item_id: int, content: bytes, content_hash: str):
+    """
+    Store an uploaded file as a new version of an item.
+
+    Keyframe versions are stored compressed, the others as a delta against the
+    previous version. Uploading the same file again does not create a version.
+    When a concurrent upload takes the next number first, the version is
+    computed again against that one.
+
+    Args:
+        db (Session): The database session.
+        item_id (int): The ID of the item.
+        content (bytes): The uploaded file.
+        content_hash (str): The sha256 hex digest of the file.
+
+    Returns:
+        ItemVersion: The new (or unchanged latest) version.
+    """
+    for attempt in range(VERSION_ATTEMPTS):
+        last = get_last_item_version(db, item_id)
+        if last is not None and last.content_hash == content_hash:
+            return last
+        number = 1 if last is None else last.number + 1
+        if versions.is_keyframe(number):
+            data = versions.compress(content)
+        else:
+            previous = get_item_version_content(db, item_id, last.number)
+            data = versions.encode_delta(previous, content)
+        db_version = models.ItemVersion(
+            item_id=item_id,
+            number=number,
+            content_hash=content_hash,
+            size=len(content),
+            data=data,
+        )
+        db.add(db_version)
+        try:
+            db.commit()
+        except IntegrityError as error:
+            db.rollback()
+            if not is_unique_violation(error) or attempt == VERSION_ATTEMPTS - 1:
+                raise
+            continue
+        db.refresh(db_version)
+        return db_version
+
+
+def update_item_version_result(
+    db: Session,
+    item_id: int,
+    content_hash: str,
+    passed: bool,
+    mark: int,
+    pass_point: int,
+    fail_point: int,
+):
+    """
+    Store the grading result on the latest version of an item with the given file.
+
+    Args:
+        db (Session): The database session.
+        item_id (int): The ID of the item.
+        content_hash (str): The sha256 hex digest of the graded file.
+        passed (bool): Whether the version has passed the test.
+        mark (int): The mark assigned to the version.
+        pass_point (int): The passing point for the version.
+        fail_point (int): The failing point for the version.
+
+    Returns:
+        ItemVersion: The updated version, or None if not found.
+    """
+    db_version = (
+        db.query(models.ItemVersion)
+        .filter(models.ItemVersion.item_id == item_id)
+        .filter(models.ItemVersion.content_hash == content_hash)
+        .order_by(models.ItemVersion.number.desc())
+        .first()
+    )
+    if db_version is None:
+        return None
+    db_version.tested = True
+    db_version.passed = passed
+    db_version.mark = mark
+    db_version.pass_point = pass_point
+    db_version.fail_point = fail_point
+    db.commit()
+    db.refresh(db_version)
+    return db_version
+
+
+def get_referenced_blobs(db: Session) -> set:
+    """
+    Return the stored files that are the current file of an item or assignment.
+
+    Args:
+        db (Session): The database session.
+
+    Returns:
+        set: The sha256 hex digests of the files.
+    """
+    items = select(models.Item.content_hash).where(
+        models.Item.content_hash.is_not(None)
+    )
+    tests = select(models.Assignment.test_hash).where(
+        models.Assignment.test_hash.is_not(None)
+    )
+    return set(db.scalars(items.union(tests)).all())
+
+
+def index_submission(db: Session, item: models.Item, content: bytes):
+    """
+    Add the current file of an item to the similarity index of its assignment.
+
+    The previous signature and LSH buckets of the item are replaced.
+
+    Args:
+        db (Session): The database session.
+        item (Item): The item.
+        content (bytes): The current file of the item.
+    """
+    signature = similarity.minhash(content)
+    db.query(models.LshBucket).filter(models.LshBucket.item_id == item.id).delete()
+    db.merge(
+        models.SubmissionSignature(
+            item_id=item.id,
+            assignment_id=item.assignment_id,
+            content_hash=item.content_hash,
+            signature=similarity.pack(signature),
+        )
+    )
+    db.execute(
+        insert(models.LshBucket),
+        [
+            {
+                "assignment_id": item.assignment_id,
+                "band": band,
+                "bucket": bucket,
+                "item_id": item.id,
+            }
+            for band, bucket in enumerate(similarity.band_buckets(signature))
+        ],
+    )
+    db.commit()
+
+
+def get_similar_submissions(
+    db: Session, assignment_id: int, threshold: float = 0.8, limit: int = 100
+):
+    """
+    Find pairs of similar submissions of an assignment.
+
+    Candidate pairs come from the LSH index (items sharing a bucket in some
+    band), only the candidates are compared by their MinHash signatures.
+
+    Args:
+        db (Session): The database session.
+        assignment_id (int): The ID of the assignment.
+        threshold (float, optional): Minimal estimated similarity. Defaults to 0.8.
+        limit (int, optional): Maximum number of pairs. Defaults to 100.
+
+    Returns:
+        list: Dictionaries with the items, owners and similarity, most similar first.
+    """
+    buckets = (
+        db.query(
+            models.LshBucket.band, models.LshBucket.bucket, models.LshBucket.item_id
+        )
+        .filter(models.LshBucket.assignment_id == assignment_id)
+        .all()
+    )
+    rows = (
+        db.query(
+            models.SubmissionSignature.item_id,
+            models.SubmissionSignature.signature,
+            models.User.id,
+            models.User.username,
+        )
+        .join(models.Item, models.Item.id == models.SubmissionSignature.item_id)
+        .join(models.User, models.User.id == models.Item.owner_id)
+        .filter(models.SubmissionSignature.assignment_id == assignment_id)
+        .all()
+    )
+    index = {row[0]: position for position, row in enumerate(rows)}
+    pairs = similarity.most_similar(
+        [row[1] for row in rows],
+        (
+            (band, bucket, index[item_id])
+            for band, bucket, item_id in buckets
+            if item_id in index
+        ),
+        threshold,
+        limit,
+    )
+    return [
+        {
+            "item_ids": [rows[a][0], rows[b][0]],
+            "user_ids": [rows[a][2], rows[b][2]],
+            "usernames": [rows[a][3], rows[b][3]],
+            "similarity": score,
+        }
+        for a, b, score in pairs
+    ]
+
+
+def save_test_results(db: Session, item_id: int, assignment_id: int, tests: list):
+    """
+    Replace the per-test results of an item with the results of its latest run.
+
+    Args:
+        db (Session): The database session.
+        item_id (int): The ID of the item.
+        assignment_id (int): The ID of the assignment.
+        tests (list): Dictionaries with test_id, outcome, duration, points and message.
+    """
+    db.query(models.TestResult).filter(models.TestResult.item_id == item_id).delete()
+    if tests:
+        db.execute(
+            insert(models.TestResult),
+            [
+                dict(test, item_id=item_id, assignment_id=assignment_id)
+                for test in tests
+            ],
+        )
+    db.commit()
+
+
+def get_item_test_results(db: Session, item_id: int):
+    """Retrieve the per-test results of the latest run of an item."""
+    return (
+        db.query(models.TestResult)
+        .filter(models.TestResult.item_id == item_id)
+        .order_by(models.TestResult.id)
+        .all()
+    )
+
+
+def get_test_summary(db: Session, assignment_id: int):
+    """
+    Count the outcomes of each test of an assignment over all students.
+
+    Args:
+        db (Session): The database session.
+        assignment_id (int): The ID of the assignment.
+
+    Returns:
+        list: Dictionaries with test_id, outcome, count and mean duration.
+    """
+    rows = (
+        db.query(
+            models.TestResult.test_id,
+            models.TestResult.outcome,
+            func.count(models.TestResult.id),
+            func.avg(models.TestResult.duration),
+        )
+        .filter(models.TestResult.assignment_id == assignment_id)
+        .group_by(models.TestResult.test_id, models.TestResult.outcome)
+        .order_by(models.TestResult.test_id)
+        .all()
+    )
+    return [
+        {"test_id": test_id, "outcome": outcome, "count": count, "duration": duration}
+        for test_id, outcome, count, duration in rows
+    ]
+
+
+def get_users_by_test_outcome(
+    db: Session, assignment_id: int, test_id: str, outcome: str = "failed"
+):
+    """
+    Retrieve the students whose latest run of a test had the given outcome.
+
+    Args:
+        db (Session): The database session.
+        assignment_id (int): The ID of the assignment.
+        test_id (str): The name of the test function.
+        outcome (str, optional): The outcome. Defaults to "failed".
+
+    Returns:
+        list: Dictionaries with user_id, username, item_id and message.
+    """
+    rows = (
+        db.query(
+            models.User.id,
+            models.User.username,
+            models.TestResult.item_id,
+            models.TestResult.message,
+        )
+        .join(models.Item, models.Item.id == models.TestResult.item_id)
+        .join(models.User, models.User.id == models.Item.owner_id)
+        .filter(models.TestResult.assignment_id == assignment_id)
+        .filter(models.TestResult.test_id == test_id)
+        .filter(models.TestResult.outcome == outcome)
+        .order_by(models.User.username)
+        .all()
+    )
+    return [
+        {
+            "user_id": user_id,
+            "username": username,
+            "item_id": item_id,
+            "message": message,
+        }
+        for user_id, username, item_id, message in rows
+    ]
+
+
+def get_grading_policy(db: Session, assignment_id: int) -> schemas.GradingPolicyBase:
+    """
+    Retrieve the grading policy of an assignment.
+
+    Args:
+        db (Session): The database session.
+        assignment_id (int): The ID of the assignment.
+
+    Returns:
+        GradingPolicyBase: The stored policy, or the default policy.
+    """
+    db_policy = db.get(models.GradingPolicy, assignment_id)
+    if db_policy is None:
+        return schemas.GradingPolicyBase()
+    return schemas.GradingPolicy.model_validate(db_policy)
+
+
+def set_grading_policy(
+    db: Session, assignment_id: int, policy: schemas.GradingPolicyBase
+):
+    """
+    Create or replace the grading policy of an assignment.
+
+    Args:
+        db (Session): The database session.
+        assignment_id (int): The ID of the assignment.
+        policy (GradingPolicyBase): The new policy.
+
+    Returns:
+        GradingPolicy: The stored policy.
+    """
+    db_policy = db.merge(
+        models.GradingPolicy(assignment_id=assignment_id, **policy.model_dump())
+    )
+    db.commit()
+    db.refresh(db_policy)
+    return db_policy
+
+
+def regrade_items(db: Session, assignment_id: int, item_ids: list | None = None):
+    """
+    Re-mark items of an assignment from their stored per-test results.
+
+    The grading policy is applied to all items at once and the marks are
+    written back in one bulk update, no tests are run.
+
+    Args:
+        db (Session): The database session.
+        assignment_id (int): The ID of the assignment.
+        item_ids (list, optional): The IDs of the items to re-mark. Defaults to
+            all tested items of the assignment.
+
+    Returns:
+        list: Dictionaries with item_id, mark, passed and letter of each item.
+    """
+    policy = get_grading_policy(db, assignment_id)
+    query = db.query(
+        models.TestResult.item_id,
+        models.TestResult.test_id,
+        models.TestResult.outcome,
+        models.TestResult.points,
+    ).filter(models.TestResult.assignment_id == assignment_id)
+    if item_ids is not None:
+        query = query.filter(models.TestResult.item_id.in_(item_ids))
+    results = query.all()
+
+    submitted = None
+    if policy.deadline is not None and policy.late_penalty:
+        query = db.query(
+            models.ItemVersion.item_id, func.max(models.ItemVersion.created_at)
+        ).join(models.Item, models.Item.id == models.ItemVersion.item_id)
+        query = query.filter(models.Item.assignment_id == assignment_id)
+        if item_ids is not None:
+            query = query.filter(models.ItemVersion.item_id.in_(item_ids))
+        submitted = dict(query.group_by(models.ItemVersion.item_id).all())
+
+    grades = grading.grade(results, policy, submitted)
+    if grades:
+        db.execute(
+            update(models.Item),
+            [
+                {
+                    "id": grade["item_id"],
+                    "mark": grade["mark"] or 0,
+                    "passed": grade["passed"],
+                }
+                for grade in grades
+            ],
+        )
+        gradebook.sync(db, [assignment_id])
+        db.commit()
+    return grades
@@ -0,0 +1,197 @@
+"""
+Bulk enrollment of students into a class.
+
+The addresses of a list or a CSV file are resolved with one query, the
+temporary passwords of the new accounts are hashed in parallel in the hashing
+pool at the lower TEMP_BCRYPT_ROUNDS cost, and the new accounts and all
+enrollments are inserted in one transaction together with the welcome emails
+for the outbox of mailer. Every input row gets a line in the report.
+"""
+
+import csv
+import io
+
+import regex as re
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import async_crud, auth, hashing, mailer
+
+re_mail = re.compile(r"[\w.-]+@[\w.-]+\.[a-zA-Z]{2,}")
+re_separator = re.compile(r"[,;\s]+")
+
+# statuses of a row in the report
+ENROLLED = "enrolled"
+CREATED = "created"
+ALREADY_ENROLLED = "already_enrolled"
+INVALID_EMAIL = "invalid_email"
+DUPLICATE = "duplicate"
+USERNAME_TAKEN = "username_taken"
+
+# CSV header names of the columns
+EMAIL_COLUMNS = {"email", "e-mail", "mail"}
+USERNAME_COLUMNS = {"username", "login"}
+
+
+def match_email(email: str):
+    """
+    Check if the email is valid.
+
+    Args:
+        email (str): The email to check.
+
+    Returns:
+        bool: True if the email is valid, False otherwise.
+    """
+    return re_mail.match(email)
+
+
+def is_email(email: str):
+    """
+    Check if the email is valid.
+
+    Args:
+        email (str): The email to check.
+
+    Returns:
+        bool: True if the email is valid, False otherwise.
+    """
+    return match_email(email) is not None
+
+
+def parse_list(email_list: str) -> list:
+    """
+    Split a list of emails separated by commas, semicolons or white space.
+
+    Args:
+        email_list (str): The list as typed.
+
+    Returns:
+        list: Tuples (row number, email, None), the username is derived from the email.
+    """
+    emails = [email for email in re_separator.split(email_list) if email]
+    return [(row, email, None) for row, email in enumerate(emails, start=1)]
+
+
+def parse_csv(data: bytes) -> list:
+    """
+    Read the students of a CSV file.
+
+    A header row naming an "email" column and optionally a "username" column
+    selects the columns, without one the email is the first column and the
+    username the second, if there is one.
+
+    Args:
+        data (bytes): The content of the file.
+
+    Returns:
+        list: Tuples (row number, email, username or None), empty rows are skipped.
+    """
+    text = data.decode("utf-8-sig", errors="replace")
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    lines = list(csv.reader(io.StringIO(text), dialect))
+    email_column, username_column = 0, 1
+    start = 1
+    if lines:
+        header = [cell.strip().lower() for cell in lines[0]]
+        if EMAIL_COLUMNS.intersection(header):
+            email_column = next(i for i, h in enumerate(header) if h in EMAIL_COLUMNS)
+            username_column = next(
+                (i for i, h in enumerate(header) if h in USERNAME_COLUMNS), None
+            )
+            start = 2
+    rows = []
+    for row, cells in enumerate(lines[start - 1 :], start=start):
+        cells = [cell.strip() for cell in cells]
+        if not any(cells):
+            continue
+        email = cells[email_column] if email_column < len(cells) else ""
+        username = None
+        if username_column is not None and username_column < len(cells):
+            username = cells[username_column] or None
+        rows.append((row, email, username))
+    return rows
+
+
+async def enroll(db: AsyncSession, classroom_id: int, rows: list):
+    """
+    Enroll the students of the rows into a class, creating the missing accounts.
+
+    Args:
+        db (AsyncSession): The async database session.
+        classroom_id (int): The ID of the class.
+        rows (list): Tuples (row number, email, username or None) of parse_list
+            or parse_csv.
+
+    Returns:
+        list: The report, dictionaries with row, email, username and status.
+
+    Raises:
+        HTTPException: If the hashing pool is busy.
+    """
+    report = []
+    seen = set()
+    valid = []
+    for row, email, username in rows:
+        line = {"row": row, "email": email, "username": username, "status": None}
+        report.append(line)
+        if not is_email(email):
+            line["status"] = INVALID_EMAIL
+        elif email in seen:
+            line["status"] = DUPLICATE
+        else:
+            seen.add(email)
+            valid.append(line)
+
+    users = await async_crud.get_user_ids_by_emails(
+        db, [line["email"] for line in valid]
+    )
+    enrolled = await async_crud.get_enrolled_user_ids(
+        db, classroom_id, list(users.values())
+    )
+
+    to_enroll = []
+    new_lines = []
+    for line in valid:
+        user_id = users.get(line["email"])
+        if user_id is None:
+            line["username"] = line["username"] or line["email"].split("@")[0]
+            new_lines.append(line)
+        elif user_id in enrolled:
+            line["status"] = ALREADY_ENROLLED
+        else:
+            line["status"] = ENROLLED
+            to_enroll.append(user_id)
+
+    taken = await async_crud.get_taken_usernames(
+        db, [line["username"] for line in new_lines]
+    )
+    new_accounts = []
+    for line in new_lines:
+        if line["username"] in taken:
+            line["status"] = USERNAME_TAKEN
+        else:
+            taken.add(line["username"])
+            line["status"] = CREATED
+            new_accounts.append(
+                (line["email"], line["username"], auth.get_random_password())
+            )
+
+    # the temporary passwords are random, a lower cost keeps big classes fast
+    # and the hash is replaced by a full cost one at the first login
+    hashes = await hashing.hash_passwords(
+        [account[2] for account in new_accounts], hashing.TEMP_BCRYPT_ROUNDS
+    )
+    await async_crud.enroll_students(
+        db,
+        classroom_id,
+        to_enroll,
+        [
+            {"email": email, "username": username, "hashed_password": hashed}
+            for (email, username, _), hashed in zip(new_accounts, hashes)
+        ],
+        [mailer.welcome_email(*account) for account in new_accounts],
+    )
+    return report
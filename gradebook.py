@@ -0,0 +1,202 @@
+"""
+Materialized gradebook: the status of every enrolled student in every
+assignment (student_progress) and the aggregated results of every assignment
+(assignment_stats).
+
+The crud functions that change submissions, enrollments, assignments or
+classes call sync before they commit, so the tables change in the same
+transaction as the rows they are computed from. Run
+
+    python gradebook.py
+
+to rebuild both tables from scratch.
+"""
+
+import statistics
+
+from sqlalchemy import and_, case, delete, func, insert, select
+from sqlalchemy.orm import Session
+
+import models
+
+# status of a student in an assignment, ordered from worst to best
+NOT_TESTED, FAILED, PASSED = 0, 1, 2
+STATUS = case(
+    (models.Item.passed, PASSED), (models.Item.tested, FAILED), else_=NOT_TESTED
+)
+
+
+def _progress_source():
+    """Select the progress rows from the enrollments, assignments and items."""
+    return (
+        select(
+            models.Assignment.id,
+            models.UserClassroom.user_id,
+            models.Assignment.classroom_id,
+            models.Item.id,
+            STATUS,
+            func.coalesce(models.Item.mark, 0),
+        )
+        .select_from(models.Assignment)
+        .join(
+            models.UserClassroom,
+            models.UserClassroom.classroom_id == models.Assignment.classroom_id,
+        )
+        .outerjoin(
+            models.Item,
+            and_(
+                models.Item.owner_id == models.UserClassroom.user_id,
+                models.Item.assignment_id == models.Assignment.id,
+            ),
+        )
+    )
+
+
+def sync(db: Session, assignment_ids=None, user_ids=None):
+    """
+    Recompute the progress rows of the given assignments and students and the
+    stats of the assignments they belong to, without committing.
+
+    Args:
+        db (Session): The database session.
+        assignment_ids (optional): The IDs of the assignments, a list or a select.
+            Defaults to all assignments.
+        user_ids (list, optional): The IDs of the students. Defaults to all students.
+    """
+    # the sessions do not autoflush, pending item and enrollment changes are
+    # written first so the queries below see them
+    db.flush()
+    progress = models.StudentProgress
+    affected = set()
+    if user_ids is not None and assignment_ids is None:
+        # the classes the students left lose their rows below
+        affected.update(
+            db.scalars(
+                select(progress.assignment_id).where(progress.user_id.in_(user_ids))
+            )
+        )
+
+    removed = delete(progress)
+    source = _progress_source()
+    if assignment_ids is not None:
+        removed = removed.where(progress.assignment_id.in_(assignment_ids))
+        source = source.where(models.Assignment.id.in_(assignment_ids))
+    if user_ids is not None:
+        removed = removed.where(progress.user_id.in_(user_ids))
+        source = source.where(models.UserClassroom.user_id.in_(user_ids))
+    db.execute(removed)
+    db.execute(
+        insert(progress).from_select(
+            [
+                progress.assignment_id,
+                progress.user_id,
+                progress.classroom_id,
+                progress.item_id,
+                progress.status,
+                progress.mark,
+            ],
+            source,
+        )
+    )
+
+    if user_ids is not None and assignment_ids is None:
+        affected.update(
+            db.scalars(
+                select(progress.assignment_id).where(progress.user_id.in_(user_ids))
+            )
+        )
+        assignment_ids = list(affected)
+    sync_stats(db, assignment_ids)
+
+
+def sync_stats(db: Session, assignment_ids=None):
+    """
+    Recompute the stats of the given assignments from their progress rows, without committing.
+
+    Args:
+        db (Session): The database session.
+        assignment_ids (optional): The IDs of the assignments, a list or a select.
+            Defaults to all assignments.
+    """
+    progress = models.StudentProgress
+    tested = progress.status >= FAILED
+    counts = select(
+        progress.assignment_id,
+        func.count(),
+        func.count(progress.item_id),
+        func.count().filter(tested),
+        func.count().filter(progress.status == PASSED),
+    ).group_by(progress.assignment_id)
+    marks = select(progress.assignment_id, progress.mark).where(tested)
+    existing = select(models.Assignment.id)
+    removed = delete(models.AssignmentStats)
+    if assignment_ids is not None:
+        counts = counts.where(progress.assignment_id.in_(assignment_ids))
+        marks = marks.where(progress.assignment_id.in_(assignment_ids))
+        existing = existing.where(models.Assignment.id.in_(assignment_ids))
+        removed = removed.where(
+            models.AssignmentStats.assignment_id.in_(assignment_ids)
+        )
+
+    stats = {
+        assignment_id: {"assignment_id": assignment_id}
+        for assignment_id in db.scalars(existing)
+    }
+    for assignment_id, enrolled, submitted, tested_count, passed in db.execute(counts):
+        if assignment_id in stats:
+            stats[assignment_id].update(
+                enrolled=enrolled,
+                submitted=submitted,
+                tested=tested_count,
+                passed=passed,
+            )
+    marks_by_assignment = {}
+    for assignment_id, mark in db.execute(marks):
+        marks_by_assignment.setdefault(assignment_id, []).append(mark)
+    for assignment_id, values in marks_by_assignment.items():
+        if assignment_id in stats:
+            stats[assignment_id].update(
+                mean_mark=statistics.fmean(values),
+                median_mark=statistics.median(values),
+            )
+
+    db.execute(removed)
+    if stats:
+        db.execute(
+            insert(models.AssignmentStats),
+            [
+                {
+                    "enrolled": 0,
+                    "submitted": 0,
+                    "tested": 0,
+                    "passed": 0,
+                    "mean_mark": None,
+                    "median_mark": None,
+                    **row,
+                }
+                for row in stats.values()
+            ],
+        )
+
+
+def rebuild(db: Session):
+    """
+    Recompute the whole gradebook, without committing.
+
+    Args:
+        db (Session): The database session.
+    """
+    sync(db)
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    db = SessionLocal()
+    rebuild(db)
+    db.commit()
+    print(
+        f"{db.query(models.StudentProgress).count()} progress rows, "
+        f"{db.query(models.AssignmentStats).count()} assignments"
+    )
+    db.close()
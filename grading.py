@@ -0,0 +1,117 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+# minimal mark in percent for each letter, marks below every threshold get no letter
+DEFAULT_LETTER_SCALE = {"A": 90, "B": 80, "C": 70, "D": 60, "E": 51, "F": 0}
+DEFAULT_PASS_THRESHOLD = 50
+# outcomes that count into the total points, like in run_tests.get_test_points
+COUNTED_OUTCOMES = ("passed", "failed")
+
+
+def letter(mark: float | None, letter_scale: dict = DEFAULT_LETTER_SCALE) -> str | None:
+    """
+    Return the letter of a mark.
+
+    Args:
+        mark (float): The mark in percent.
+        letter_scale (dict, optional): Minimal mark of each letter. Defaults to DEFAULT_LETTER_SCALE.
+
+    Returns:
+        str: The letter, or None if the mark is None or below every threshold.
+    """
+    if mark is None:
+        return None
+    for name, threshold in sorted(letter_scale.items(), key=lambda x: -x[1]):
+        if mark >= threshold:
+            return name
+    return None
+
+
+def _naive_utc(moment: datetime) -> datetime:
+    # the database stores naive UTC times
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def grade(results, policy, submitted: dict | None = None) -> list:
+    """
+    Compute the marks of many submissions from their per-test results at once.
+
+    The results are laid out as students x tests matrices of weights and
+    outcomes, so a whole class is marked with a few array operations. The mark
+    is the weighted share of passed tests in percent minus the late penalty.
+
+    Args:
+        results: Tuples (item_id, test_id, outcome, points) from the test_results table.
+        policy: The grading policy, see schemas.GradingPolicyBase. Tests without
+            a weight in the policy are weighted by their points.
+        submitted (dict, optional): The submission time of each item, used with
+            the deadline of the policy. Defaults to None.
+
+    Returns:
+        list: Dictionaries with item_id, mark, passed and letter of each item.
+    """
+    if not results:
+        return []
+    item_ids, test_ids, outcomes, points = zip(*results)
+    items, rows = np.unique(np.array(item_ids), return_inverse=True)
+    tests, cols = np.unique(np.array(test_ids), return_inverse=True)
+    shape = (len(items), len(tests))
+
+    overrides = np.array(
+        [policy.weights.get(test_id, np.nan) for test_id in tests], dtype=float
+    )[cols]
+    weights = np.zeros(shape)
+    weights[rows, cols] = np.where(
+        np.isnan(overrides), np.array(points, dtype=float), overrides
+    )
+    outcomes = np.array(outcomes)
+    passed = np.zeros(shape, dtype=bool)
+    passed[rows, cols] = outcomes == "passed"
+    counted = np.zeros(shape, dtype=bool)
+    counted[rows, cols] = np.isin(outcomes, COUNTED_OUTCOMES)
+
+    earned = (weights * passed).sum(axis=1)
+    total = (weights * counted).sum(axis=1)
+    marks = np.full(len(items), np.nan)
+    np.divide(earned * 100, total, out=marks, where=total > 0)
+
+    if policy.deadline is not None and policy.late_penalty and submitted:
+        deadline = _naive_utc(policy.deadline)
+        late = np.array(
+            [
+                (
+                    (_naive_utc(submitted[item]) - deadline).total_seconds()
+                    if submitted.get(item) is not None
+                    else 0
+                )
+                for item in items.tolist()
+            ]
+        )
+        # every started day after the deadline costs late_penalty percent
+        days = np.ceil(np.maximum(late, 0) / 86400)
+        penalty = np.minimum(days * policy.late_penalty, policy.max_late_penalty)
+        marks = np.maximum(marks - penalty, 0)
+
+    marks = np.round(marks, 2)
+    passes = marks >= policy.pass_threshold
+
+    scale = sorted(policy.letter_scale.items(), key=lambda x: x[1])
+    names = [name for name, _ in scale]
+    letters = (
+        np.searchsorted([threshold for _, threshold in scale], marks, side="right") - 1
+    )
+
+    return [
+        {
+            "item_id": item,
+            "mark": None if np.isnan(mark) else mark,
+            "passed": is_passed,
+            "letter": names[index] if index >= 0 and not np.isnan(mark) else None,
+        }
+        for item, mark, is_passed, index in zip(
+            items.tolist(), marks.tolist(), passes.tolist(), letters.tolist()
+        )
+    ]
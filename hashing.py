@@ -0,0 +1,157 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+load_dotenv()
+
+# bcrypt cost factor, hashes with a different cost are replaced on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+# cost factor of the random temporary passwords of accounts created in bulk,
+# raised to BCRYPT_ROUNDS when the password is first used
+TEMP_BCRYPT_ROUNDS = int(os.getenv("TEMP_BCRYPT_ROUNDS", 8))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", min(4, os.cpu_count() or 1)))
+# hashing jobs waiting for or running in the pool, further requests get 503
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", 64))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+_pool = None
+_pool_lock = threading.Lock()
+_queue = threading.BoundedSemaphore(HASH_QUEUE_SIZE)
+
+
+def hash_password_sync(password: str) -> str:
+    """
+    Hash a password in the current thread, for scripts and startup code.
+
+    Args:
+        password (str): The password to hash.
+
+    Returns:
+        str: The bcrypt hash.
+    """
+    return pwd_context.hash(password)
+
+
+def hash_passwords_sync(passwords: list, rounds: int = BCRYPT_ROUNDS) -> list:
+    """
+    Hash several passwords in the current thread.
+
+    Args:
+        passwords (list): The passwords to hash.
+        rounds (int, optional): The cost factor. Defaults to BCRYPT_ROUNDS.
+
+    Returns:
+        list: The bcrypt hashes in the same order.
+    """
+    handler = pwd_context.handler().using(rounds=rounds)
+    return [handler.hash(password) for password in passwords]
+
+
+def verify_and_update_sync(password: str, hashed_password: str):
+    """
+    Verify a password in the current thread.
+
+    Args:
+        password (str): The plain password.
+        hashed_password (str): The stored hash.
+
+    Returns:
+        tuple: Whether the password matches and a new hash if the stored one
+            uses a different cost factor, otherwise None.
+    """
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+        return _pool
+
+
+async def _run(function, *args):
+    if not _queue.acquire(blocking=False):
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, try again later",
+            headers={"Retry-After": "1"},
+        )
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_pool(), function, *args)
+    finally:
+        _queue.release()
+
+
+async def hash_password(password: str) -> str:
+    """
+    Hash a password in the hashing process pool without blocking the event loop.
+
+    Args:
+        password (str): The password to hash.
+
+    Returns:
+        str: The bcrypt hash.
+
+    Raises:
+        HTTPException: If HASH_QUEUE_SIZE jobs are already waiting.
+    """
+    return await _run(hash_password_sync, password)
+
+
+async def hash_passwords(passwords: list, rounds: int = BCRYPT_ROUNDS) -> list:
+    """
+    Hash many passwords in parallel in the hashing process pool.
+
+    The passwords are split into one batch per worker, so a bulk job takes
+    HASH_WORKERS places in the queue however many passwords it hashes.
+
+    Args:
+        passwords (list): The passwords to hash.
+        rounds (int, optional): The cost factor. Defaults to BCRYPT_ROUNDS.
+
+    Returns:
+        list: The bcrypt hashes in the same order.
+
+    Raises:
+        HTTPException: If the queue has no room for the batches.
+    """
+    if not passwords:
+        return []
+    size = -(-len(passwords) // HASH_WORKERS)
+    batches = [passwords[i : i + size] for i in range(0, len(passwords), size)]
+    hashed = await asyncio.gather(
+        *(_run(hash_passwords_sync, batch, rounds) for batch in batches)
+    )
+    return [hashed_password for batch in hashed for hashed_password in batch]
+
+
+async def verify_and_update(password: str, hashed_password: str):
+    """
+    Verify a password in the hashing process pool without blocking the event loop.
+
+    Args:
+        password (str): The plain password.
+        hashed_password (str): The stored hash.
+
+    Returns:
+        tuple: Whether the password matches and a new hash if the stored one
+            uses a different cost factor, otherwise None.
+
+    Raises:
+        HTTPException: If HASH_QUEUE_SIZE jobs are already waiting.
+    """
+    return await _run(verify_and_update_sync, password, hashed_password)
@@ -0,0 +1,376 @@
+"""
+Outgoing email through a persistent outbox.
+
+Emails are queued as rows of the outbox table, in the transaction of the
+change they announce, and delivered by a background sender running in every
+server worker. The sender keeps one SMTP connection open while there is mail
+to send, claims due emails in batches of MAIL_BATCH_SIZE, sends at most
+MAIL_RATE emails per second and retries failed emails with exponential
+backoff until MAIL_MAX_ATTEMPTS. Every row records its status, attempts and
+last error. Run
+
+    python mailer.py
+
+to send the pending emails once, for example from cron when no server runs.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from pathlib import Path
+
+import aiosmtplib
+from dotenv import load_dotenv
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from sqlalchemy import or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from database import AsyncSessionLocal
+
+load_dotenv()
+
+MAIL_SERVER = os.getenv("MAIL_SERVER")
+MAIL_PORT = int(os.getenv("MAIL_PORT", 465))
+MAIL_USERNAME = os.getenv("MAIL_USERNAME")
+MAIL_PASSWORD = os.getenv("MAIL_PASSWORD")
+MAIL_FROM = os.getenv("MAIL_FROM")
+# implicit TLS on MAIL_PORT, otherwise STARTTLS when MAIL_STARTTLS is set
+MAIL_SSL_TLS = os.getenv("MAIL_SSL_TLS", "true").lower() == "true"
+MAIL_STARTTLS = os.getenv("MAIL_STARTTLS", "false").lower() == "true"
+MAIL_TIMEOUT = float(os.getenv("MAIL_TIMEOUT", 30))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", 50))
+# emails per second of each worker, 0 for no limit
+MAIL_RATE = float(os.getenv("MAIL_RATE", 10))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", 6))
+# seconds before the first retry, doubled for every further attempt
+MAIL_RETRY_DELAY = float(os.getenv("MAIL_RETRY_DELAY", 30))
+# seconds the sender waits for new emails, the connection is closed meanwhile
+MAIL_POLL_INTERVAL = float(os.getenv("MAIL_POLL_INTERVAL", 30))
+# seconds a batch is reserved for the worker that claimed it
+MAIL_LEASE = float(os.getenv("MAIL_LEASE", 300))
+
+PENDING, SENT, FAILED = "pending", "sent", "failed"
+
+logger = logging.getLogger(__name__)
+
+templates = Environment(
+    loader=FileSystemLoader(Path(__file__).parent / "templates"),
+    autoescape=select_autoescape(),
+)
+
+# the sender of this worker, see start
+_task = None
+_wakeup = None
+
+
+def welcome_email(recipient: str, login: str, password: str) -> dict:
+    """
+    Return the outbox row of the welcome email of a new account.
+
+    Args:
+        recipient (str): The email of the user.
+        login (str): The username.
+        password (str): The temporary password.
+
+    Returns:
+        dict: The column values of the OutboxEmail.
+    """
+    return {
+        "recipient": recipient,
+        "subject": "Welcome to autograder",
+        "template": "email_template.html",
+        "template_body": {"login": login, "temp_password": password},
+    }
+
+
+def render(email: models.OutboxEmail) -> EmailMessage:
+    """
+    Build the message of a queued email from its template.
+
+    Args:
+        email (OutboxEmail): The queued email.
+
+    Returns:
+        EmailMessage: The message.
+    """
+    message = EmailMessage()
+    message["From"] = MAIL_FROM
+    message["To"] = email.recipient
+    message["Subject"] = email.subject
+    html = templates.get_template(email.template).render(**email.template_body)
+    message.set_content(html, subtype="html")
+    return message
+
+
+def is_permanent(error: Exception) -> bool:
+    """Return whether an SMTP error will not go away by retrying, like an unknown recipient."""
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return all(500 <= e.code < 600 for e in error.recipients)
+    if isinstance(error, aiosmtplib.SMTPResponseException):
+        return 500 <= error.code < 600
+    return False
+
+
+def is_connection_error(error: Exception) -> bool:
+    """Return whether an error means the SMTP server cannot be reached."""
+    return isinstance(
+        error,
+        (
+            OSError,
+            aiosmtplib.SMTPConnectError,
+            aiosmtplib.SMTPServerDisconnected,
+            aiosmtplib.SMTPTimeoutError,
+        ),
+    )
+
+
+class SMTPConnection:
+    """
+    One SMTP connection, opened on first use and reused for the following emails.
+
+    Attributes:
+        opened (int): The number of connections opened so far.
+    """
+
+    def __init__(self, hostname: str = None, port: int = None):
+        self.hostname = hostname or MAIL_SERVER
+        self.port = port or MAIL_PORT
+        self.opened = 0
+        self._smtp = None
+
+    async def _connect(self):
+        self._smtp = aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            username=MAIL_USERNAME or None,
+            password=MAIL_PASSWORD or None,
+            use_tls=MAIL_SSL_TLS,
+            start_tls=MAIL_STARTTLS,
+            timeout=MAIL_TIMEOUT,
+        )
+        await self._smtp.connect()
+        self.opened += 1
+
+    async def send(self, message: EmailMessage):
+        """
+        Send a message, connecting again when the server closed the connection.
+
+        Args:
+            message (EmailMessage): The message.
+
+        Raises:
+            SMTPException: If the server refuses the message.
+            OSError: If the server cannot be reached.
+        """
+        if self._smtp is None or not self._smtp.is_connected:
+            await self._connect()
+            await self._smtp.send_message(message)
+            return
+        try:
+            await self._smtp.send_message(message)
+        except aiosmtplib.SMTPServerDisconnected:
+            # dropped while idle, one new connection is tried
+            await self._connect()
+            await self._smtp.send_message(message)
+
+    async def close(self):
+        """Close the connection if it is open."""
+        if self._smtp is not None and self._smtp.is_connected:
+            try:
+                await self._smtp.quit()
+            except aiosmtplib.SMTPException:
+                self._smtp.close()
+        self._smtp = None
+
+
+async def claim(db: AsyncSession, limit: int = MAIL_BATCH_SIZE) -> list:
+    """
+    Reserve the due emails for this worker for MAIL_LEASE seconds.
+
+    An email claimed by another worker in the meantime is skipped, its lock
+    makes the conditional update miss it.
+
+    Args:
+        db (AsyncSession): The async database session.
+        limit (int, optional): Maximum number of emails. Defaults to MAIL_BATCH_SIZE.
+
+    Returns:
+        list[OutboxEmail]: The claimed emails, oldest first.
+    """
+    outbox = models.OutboxEmail
+    now = datetime.utcnow()
+    free = or_(outbox.locked_until.is_(None), outbox.locked_until < now)
+    due = (
+        select(outbox.id)
+        .where(outbox.status == PENDING)
+        .where(outbox.next_attempt_at <= now)
+        .where(free)
+        .order_by(outbox.next_attempt_at, outbox.id)
+        .limit(limit)
+    )
+    ids = (await db.scalars(due)).all()
+    if not ids:
+        return []
+    claimed = await db.scalars(
+        update(outbox)
+        .where(outbox.id.in_(ids))
+        .where(free)
+        .values(locked_until=now + timedelta(seconds=MAIL_LEASE))
+        .returning(outbox.id)
+    )
+    claimed = claimed.all()
+    await db.commit()
+    emails = await db.scalars(
+        select(outbox).where(outbox.id.in_(claimed)).order_by(outbox.id)
+    )
+    return emails.all()
+
+
+def record_failure(
+    email: models.OutboxEmail, error: Exception, permanent: bool = False
+):
+    """
+    Schedule the retry of an email or give it up, without committing.
+
+    Args:
+        email (OutboxEmail): The email that could not be sent.
+        error (Exception): The error of the attempt.
+        permanent (bool, optional): Give the email up even if the error is not
+            a permanent SMTP error. Defaults to False.
+    """
+    email.attempts += 1
+    email.last_error = f"{type(error).__name__}: {error}"[:1000]
+    email.locked_until = None
+    if permanent or is_permanent(error) or email.attempts >= MAIL_MAX_ATTEMPTS:
+        email.status = FAILED
+        email.template_body = None
+    else:
+        delay = MAIL_RETRY_DELAY * 2 ** (email.attempts - 1)
+        email.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+
+
+async def send_batch(connection: SMTPConnection) -> int:
+    """
+    Claim and send one batch of due emails.
+
+    Every email is committed as soon as it is sent, so a crash does not send
+    it again. When the server cannot be reached the batch stops, the rest of
+    it is retried when its lease expires.
+
+    Args:
+        connection (SMTPConnection): The connection to send through.
+
+    Returns:
+        int: The number of claimed emails.
+    """
+    async with AsyncSessionLocal() as db:
+        emails = await claim(db)
+        for email in emails:
+            started = time.monotonic()
+            try:
+                message = render(email)
+            except Exception as error:
+                # a broken template or template_body fails on every attempt
+                logger.exception("Rendering email %s failed", email.id)
+                record_failure(email, error, permanent=True)
+                await db.commit()
+                continue
+            try:
+                await connection.send(message)
+            except Exception as error:
+                record_failure(email, error)
+                await db.commit()
+                if is_connection_error(error):
+                    await connection.close()
+                    break
+            else:
+                email.status = SENT
+                email.sent_at = datetime.utcnow()
+                email.locked_until = None
+                # the variables may hold a temporary password
+                email.template_body = None
+                await db.commit()
+            if MAIL_RATE > 0:
+                await asyncio.sleep(
+                    max(0, 1 / MAIL_RATE - (time.monotonic() - started))
+                )
+        return len(emails)
+
+
+async def send_pending(connection: SMTPConnection = None) -> int:
+    """
+    Send batches until no email is due.
+
+    Args:
+        connection (SMTPConnection, optional): The connection to send through.
+            Defaults to a new one, closed at the end.
+
+    Returns:
+        int: The number of emails that were claimed.
+    """
+    own = connection is None
+    connection = connection or SMTPConnection()
+    total = 0
+    try:
+        while True:
+            claimed = await send_batch(connection)
+            total += claimed
+            if claimed < MAIL_BATCH_SIZE:
+                return total
+    finally:
+        if own:
+            await connection.close()
+
+
+async def run():
+    """Send the outbox in the background until cancelled, woken up by notify."""
+    connection = SMTPConnection()
+    try:
+        while True:
+            _wakeup.clear()
+            try:
+                await send_pending(connection)
+            except Exception:
+                # the sender must outlive database errors
+                logger.exception("Sending the outbox failed")
+            try:
+                await asyncio.wait_for(_wakeup.wait(), MAIL_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                # nothing queued meanwhile, servers drop idle connections anyway
+                await connection.close()
+    finally:
+        await connection.close()
+
+
+def notify():
+    """Wake up the sender of this worker after emails were queued."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+def start():
+    """Start the sender of this worker, unless no MAIL_SERVER is configured."""
+    global _task, _wakeup
+    if _task is None and MAIL_SERVER:
+        _wakeup = asyncio.Event()
+        _task = asyncio.create_task(run())
+
+
+async def stop():
+    """Stop the sender of this worker."""
+    global _task, _wakeup
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task, _wakeup = None, None
+
+
+if __name__ == "__main__":
+    print(f"claimed {asyncio.run(send_pending())} emails")
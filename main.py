@@ -1,84 +1,177 @@
+from contextlib import asynccontextmanager
 from datetime import timedelta
-from typing import Annotated
-
-
-from fastapi import Depends, FastAPI, HTTPException, status, UploadFile, File, Request
+from typing import Annotated, Literal
+
+
+from fastapi import (
+    Depends,
+    FastAPI,
+    HTTPException,
+    Query,
+    status,
+    UploadFile,
+    File,
+    Request,
+)
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi_mail import ConnectionConfig, FastMail, MessageSchema, MessageType
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import (
+    HTMLResponse,
+    FileResponse,
+    ORJSONResponse,
+    StreamingResponse,
+)
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import JSONResponse, Response
-from pathlib import Path
-import os
 
 from dotenv import load_dotenv
 
-import regex as re
+import orjson
 
 
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-import crud, models, schemas, auth
-from database import engine, get_db
-
-models.Base.metadata.create_all(bind=engine)
-
-from run_tests import run_tests
-
 load_dotenv()
 
+import async_crud, cache, crud, enrollment, mailer, models, schemas, auth, hashing, migrations, pagination, report_archive, versions
+from uploads import MAX_UPLOAD_SIZE, store_upload_file, too_large_exception
+from database import AsyncSessionLocal, SessionLocal, engine, get_async_db, get_db
+from storage import storage
 
-# email configuration
-conf = ConnectionConfig(
-    MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
-    MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
-    MAIL_FROM=os.getenv("MAIL_FROM"),
-    MAIL_PORT=465,
-    MAIL_SERVER=os.getenv("MAIL_SERVER"),
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(__file__).parent,
-)
+migrations.upgrade(engine)
 
+from run_tests import report_path, run_tests
 
-re_mail = re.compile("[\w.-]+@[\w.-]+\.[a-zA-Z]{2,}")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the outbox sender of mailer while the worker serves requests."""
+    mailer.start()
+    yield
+    await mailer.stop()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 # Jinja2templates
 templates = Jinja2Templates(directory="templates")
+app.mount("/static", StaticFiles(directory="static"), name="static")
+
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """
+    Reject oversized uploads from the Content-Length header before the body is read.
+
+    Args:
+        request (Request): The incoming request.
+        call_next: The next request handler.
+
+    Returns:
+        Response: 413 response for an oversized upload, the handler response otherwise.
+    """
+    if request.url.path.startswith("/uploadfile/"):
+        content_length = request.headers.get("content-length", "")
+        # multipart boundaries and headers add a few hundred bytes to the file
+        if content_length.isdigit() and int(content_length) > MAX_UPLOAD_SIZE + 4096:
+            exception = too_large_exception()
+            return JSONResponse(
+                status_code=exception.status_code,
+                content={"detail": exception.detail},
+            )
+    return await call_next(request)
+
+
+# list endpoints return the cursor of the next page in this header
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+ListFormat = Literal["json", "ndjson"]
+
+
+def rows_response(rows, next_cursor: str | None = None) -> ORJSONResponse:
+    """
+    Serialize the rows of a column-projected query with orjson.
+
+    The rows are plain tuples, they skip the validation and jsonable_encoder
+    pass FastAPI makes over returned objects.
+
+    Args:
+        rows: The rows, None entries stay null.
+        next_cursor (str | None, optional): The cursor of the next page, sent in
+            the X-Next-Cursor header. Defaults to None on the last page.
+
+    Returns:
+        ORJSONResponse: The rows as a JSON list of objects.
+    """
+    response = ORJSONResponse(
+        [row._asdict() if row is not None else None for row in rows]
+    )
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response
+
+
+def cursor_id(after: str | None) -> int | None:
+    """
+    Decode the cursor of a list endpoint into the ID of the last row of the previous page.
+
+    Args:
+        after (str | None): The cursor, None for the first page.
+
+    Returns:
+        int | None: The ID, None for the first page.
+
+    Raises:
+        HTTPException: If the cursor is not valid.
+    """
+    if not after:
+        return None
+    (last_id,) = pagination.decode_cursor(after, (int,))
+    return last_id
 
 
-def match_email(email: str):
+def keyset_page(rows: list, limit: int) -> tuple:
     """
-    Check if the email is valid.
+    Split rows fetched with limit + 1 into the page and the cursor of the next page.
 
     Args:
-        email (str): The email to check.
+        rows (list): The rows ordered by ID.
+        limit (int): The page size.
 
     Returns:
-        bool: True if the email is valid, False otherwise.
+        tuple: The rows of the page and the cursor of the next page, None on the last page.
     """
-    return re_mail.match(email)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, pagination.encode_cursor([rows[-1].id])
 
 
-def is_email(email: str):
+def ndjson_response(statement, key) -> StreamingResponse:
     """
-    Check if the email is valid.
+    Stream all rows of a select as newline delimited JSON.
+
+    The rows are read in keyset batches with their own session while the
+    response is sent, so memory stays flat however big the table is.
 
     Args:
-        email (str): The email to check.
+        statement (Select): The column-projected select.
+        key (Column): The unique key column to page by.
 
     Returns:
-        bool: True if the email is valid, False otherwise.
+        StreamingResponse: One JSON object per line.
     """
-    return match_email(email) is not None
+
+    def lines():
+        with SessionLocal() as db:
+            for row in crud.iter_keyset(db, statement, key):
+                yield orjson.dumps(row._asdict()) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 @app.post("/token")
@@ -99,7 +192,7 @@ async def login_for_access_token(
     Raises:
         HTTPException: If the username or password is incorrect.
     """
-    user = auth.authenticate_user(form_data.username, form_data.password, db)
+    user = await auth.authenticate_user(form_data.username, form_data.password, db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -107,17 +200,76 @@ async def login_for_access_token(
             headers={"WWW-Authenticate": "Bearer"},
         )
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
+    # the role of the user is loaded by a query, kept off the event loop
+    claims = await run_in_threadpool(auth.get_token_claims, user)
+    access_token = auth.create_access_token(
+        data=claims, expires_delta=access_token_expires
+    )
+    return schemas.Token(
+        access_token=access_token,
+        token_type="bearer",
+        refresh_token=await run_in_threadpool(auth.issue_refresh_token, db, user.id),
+    )
+
+
+@app.post("/token/refresh")
+def refresh_access_token(
+    request: schemas.RefreshRequest,
+    db: Session = Depends(get_db),
+) -> schemas.Token:
+    """
+    Exchange a refresh token for a new access token and a new refresh token.
+
+    The password is not checked again, the used refresh token is revoked.
+
+    Args:
+        request (RefreshRequest): The refresh token.
+        db (Session, optional): The database session. Defaults to Depends(get_db).
+
+    Returns:
+        Token: The new access and refresh tokens.
+
+    Raises:
+        HTTPException: If the refresh token is not valid.
+    """
+    user, refresh_token = auth.rotate_refresh_token(db, request.refresh_token)
     access_token = auth.create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data=auth.get_token_claims(user),
+        expires_delta=timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES),
+    )
+    return schemas.Token(
+        access_token=access_token, token_type="bearer", refresh_token=refresh_token
+    )
+
+
+@app.post("/token/revoke")
+def revoke_refresh_token(
+    request: schemas.RefreshRequest,
+    db: Session = Depends(get_db),
+):
+    """
+    Log out by revoking a refresh token and all tokens rotated from the same login.
+
+    Args:
+        request (RefreshRequest): The refresh token.
+        db (Session, optional): The database session. Defaults to Depends(get_db).
+
+    Returns:
+        dict: A message.
+    """
+    db_token = crud.get_refresh_token(
+        db, auth.hash_refresh_token(request.refresh_token)
     )
-    return schemas.Token(access_token=access_token, token_type="bearer")
+    if db_token is not None:
+        crud.revoke_refresh_tokens(db, family=db_token.family)
+    return {"message": "Logged out"}
 
 
-@app.get("/users/me")
+@app.get("/users/me", response_model=schemas.UserRow)
 async def read_users_me(
     request: Request,
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Get the current authenticated user.
@@ -128,25 +280,61 @@ async def read_users_me(
     Returns:
         User: The current authenticated user.
     """
-    return crud.get_user(db, user_id=current_user.id)
+    user = await async_crud.get_user(db, user_id=current_user.id)
+    return ORJSONResponse(user._asdict())
+
+
+@app.get("/session", response_model=schemas.UserSession)
+async def read_session(
+    response: Response,
+    current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Get the user, role, permissions, first login state and classes in one response.
+
+    The pages load this once instead of calling /logincheck, /users/teacherplus/,
+    /users/admin/, /users/me and /class/my one after another.
+
+    Args:
+        response (Response): The response, used to set the cache headers.
+        current_user (User): The current authenticated user.
+        db (AsyncSession, optional): The async database session. Defaults to Depends(get_async_db).
+
+    Returns:
+        UserSession: The session of the current user.
+    """
+    response.headers["Cache-Control"] = "private, max-age=30"
+    response.headers["Vary"] = "Authorization"
+    return schemas.UserSession(
+        id=current_user.id,
+        username=current_user.username,
+        email=current_user.email,
+        role=await async_crud.get_user_role(db, current_user.id),
+        is_first_login=current_user.is_first_login,
+        teacher_plus=auth.is_teacher_plus(current_user),
+        super_teacher_plus=auth.is_super_teacher_plus(current_user),
+        admin=auth.is_admin(current_user),
+        classes=await async_crud.get_my_classrooms(db, user_id=current_user.id),
+    )
 
 
 @app.get("/users/me/items/")
 async def read_own_items(
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Get the items owned by the current authenticated user.
 
     Args:
         current_user (User): The current authenticated user.
-        db (Session, optional): The database session. Defaults to Depends(get_db).
+        db (AsyncSession, optional): The async database session. Defaults to Depends(get_async_db).
 
     Returns:
         List[Item]: The items owned by the current authenticated user.
     """
-    return crud.get_user_item(db, user_id=current_user.id)
+    return await async_crud.get_user_item(db, user_id=current_user.id)
 
 
 """Database operations"""
@@ -178,37 +366,83 @@ def create_user(
     return templates.TemplateResponse("create_user.html", {"request": request})
 
 
-@app.get("/all_users")
+@app.get("/all_users", response_model=list[schemas.UserRow])
 def read_users(
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
-    skip: int = 0,
-    limit: int = 1000,
+    after: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    format: ListFormat = "json",
+    q: str | None = Query(None, max_length=100),
     db: Session = Depends(get_db),
 ):
     """
-    Get a list of users.
+    Get a page of users ordered by ID.
 
     Args:
         current_user (User): The current authenticated user.
-        skip (int, optional): The number of users to skip. Defaults to 0.
+        after (str, optional): The cursor of the page. Defaults to the first page.
         limit (int, optional): The maximum number of users to return. Defaults to 100.
+        format (str, optional): "ndjson" streams all users instead. Defaults to "json".
+        q (str, optional): Return only the best `limit` users matching this search
+            in their username or email, without a cursor. Defaults to None.
         db (Session, optional): The database session. Defaults to Depends(get_db).
 
     Returns:
-        List[User]: The list of users.
+        List[User]: The list of users, the cursor of the next page is in X-Next-Cursor.
 
     Raises:
         HTTPException: If the current user is not a teacher.
     """
 
-    if crud.is_teacher_plus(db, current_user.id):
-        return crud.get_users(db, skip=skip, limit=limit)
+    if auth.is_teacher_plus(current_user):
+        if q:
+            return rows_response(crud.search_users(db, q, limit=limit))
+        if format == "ndjson":
+            return ndjson_response(crud.user_rows_statement(), models.User.id)
+        users = crud.get_users(db, after=cursor_id(after), limit=limit + 1)
+        return rows_response(*keyset_page(users, limit))
 
     else:
         raise HTTPException(status_code=403, detail="You are not a teacher")
 
 
-@app.get("/users/{user_id}", response_model=schemas.User)
+SearchKind = Literal["user", "classroom", "assignment"]
+
+
+@app.get("/search", response_model=list[schemas.SearchHit])
+async def search_records(
+    current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+    q: str = Query(..., min_length=1, max_length=100),
+    kind: list[SearchKind] = Query(["user", "classroom", "assignment"]),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Search users, classes and assignments by the start of the words in their names.
+
+    Users are matched by username and email, classes and assignments by name
+    and description. "stud exa" finds student1@example.com.
+
+    Args:
+        current_user (User): The current authenticated user.
+        q (str): The words to search for.
+        kind (list[str], optional): Search only "user", "classroom" and/or
+            "assignment" records. Defaults to all.
+        limit (int, optional): The maximum number of records. Defaults to 20.
+        db (AsyncSession, optional): The async database session. Defaults to Depends(get_async_db).
+
+    Returns:
+        List[SearchHit]: The records, best matches first.
+
+    Raises:
+        HTTPException: If the current user is not a teacher.
+    """
+    if not auth.is_teacher_plus(current_user):
+        raise HTTPException(status_code=403, detail="You are not a teacher")
+    return rows_response(await async_crud.search_records(db, q, kind, limit=limit))
+
+
+@app.get("/users/{user_id}", response_model=schemas.UserRow)
 def read_user_id(
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
     user_id: int,
@@ -228,11 +462,11 @@ def read_user_id(
     Raises:
         HTTPException: If the current user is not a teacher or the user is not found.
     """
-    if crud.is_teacher_plus(db, current_user.id):
+    if auth.is_teacher_plus(current_user):
         db_user = crud.get_user(db, user_id=user_id)
         if db_user is None:
             raise HTTPException(status_code=404, detail="User not found")
-        return db_user
+        return ORJSONResponse(db_user._asdict())
     else:
         raise HTTPException(status_code=401, detail="You are not a teacher")
 
@@ -257,7 +491,7 @@ def read_user_username(
     Raises:
         HTTPException: If the current user is not a teacher or the user is not found.
     """
-    if crud.is_teacher_plus(db, current_user.id):
+    if auth.is_teacher_plus(current_user):
         db_user = crud.get_user_by_username(db, username=username)
         if db_user is None:
             raise HTTPException(status_code=404, detail="User not found")
@@ -286,7 +520,7 @@ def read_user_email(
     Raises:
         HTTPException: If the current user is not a teacher or the user is not found.
     """
-    if crud.is_teacher_plus(db, current_user.id):
+    if auth.is_teacher_plus(current_user):
         db_user = crud.get_user_by_email(db, email=email)
         if db_user is None:
             raise HTTPException(status_code=404, detail="User not found")
@@ -350,7 +584,7 @@ def is_teacher_or_higher(
     Returns:
         str: The role of the current authenticated user.
     """
-    query = crud.is_teacher_plus(db, current_user.id)
+    query = auth.is_teacher_plus(current_user)
     if query:
         return HTMLResponse(status_code=200, content="You are a super teacher")
     else:
@@ -374,9 +608,7 @@ def is_superteacher_or_higher(
     Returns:
         str: The role of the current authenticated user.
     """
-    query = crud.is_admin(db, current_user.id) or crud.is_super_teacher(
-        db, current_user.id
-    )
+    query = auth.is_super_teacher_plus(current_user)
     if query:
         return HTMLResponse(status_code=200, content="You are a super teacher")
     else:
@@ -400,7 +632,7 @@ def is_admin(
     Returns:
         str: The role of the current authenticated user.
     """
-    query = crud.is_admin(db, current_user.id)
+    query = auth.is_admin(current_user)
     if query:
         return HTMLResponse(status_code=200, content="You are a admin")
     else:
@@ -408,20 +640,24 @@ def is_admin(
 
 
 @app.get("/items/", response_model=list[schemas.Item])
-def read_items(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_items(
+    after: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+):
     """
-    Get a list of items.
+    Get a page of items ordered by ID.
 
     Args:
-        skip (int, optional): The number of items to skip. Defaults to 0.
+        after (str, optional): The cursor of the page. Defaults to the first page.
         limit (int, optional): The maximum number of items to return. Defaults to 100.
         db (Session, optional): The database session. Defaults to Depends(get_db).
 
     Returns:
-        List[Item]: The list of items.
+        List[Item]: The list of items, the cursor of the next page is in X-Next-Cursor.
     """
-    items = crud.get_items(db, skip=skip, limit=limit)
-    return items
+    items = crud.get_items(db, after=cursor_id(after), limit=limit + 1)
+    return rows_response(*keyset_page(items, limit))
 
 
 @app.delete("/users/{user_id}")
@@ -444,7 +680,7 @@ def delete_user(
     Raises:
         HTTPException: If the current user does not have enough permissions.
     """
-    if not crud.is_teacher_plus(db, current_user.id):
+    if not auth.is_teacher_plus(current_user):
         raise HTTPException(status_code=401, detail="Not enough permissions")
     if user_id == current_user.id:
         raise HTTPException(
@@ -455,7 +691,7 @@ def delete_user(
 
 
 @app.post("/update_role/")
-async def update_user_role(
+def update_user_role(
     role_id: int,
     email: str,
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
@@ -474,7 +710,7 @@ async def update_user_role(
         User: The updated user.
 
     """
-    if crud.is_admin(db, current_user.id):
+    if auth.is_admin(current_user):
         crud.change_user_role(db=db, email=email, role_id=role_id)
         return {"message": "Role updated"}
 
@@ -483,7 +719,7 @@ async def update_user_role(
 
 
 @app.post("/class/{class_id}/assignment/create")
-async def create_assignment(
+def create_assignment(
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
     assignment: schemas.AssignmentCreate,
     class_id: int,
@@ -501,32 +737,44 @@ async def create_assignment(
         Assignment: The created assignment.
 
     Raises:
-        HTTPException: If the current user does not have enough permissions.
+        HTTPException: If the current user does not have enough permissions or
+            the class does not exist.
     """
-    if crud.is_teacher_plus(db, user_id=current_user.id):
-        return crud.create_assignment(
-            db=db, assignment=assignment, user_id=current_user.id, classroom_id=class_id
-        ).id
-    else:
+    if not auth.is_teacher_plus(current_user):
         raise HTTPException(status_code=401, detail="Not enough permissions")
+    # checked here, the foreign key would fail the insert with a 500
+    if crud.get_classroom_by_id(db, class_id) is None:
+        raise HTTPException(status_code=404, detail="Class not found")
+    return crud.create_assignment(
+        db=db, assignment=assignment, user_id=current_user.id, classroom_id=class_id
+    ).id
 
 
-@app.get("/assignments/", response_model=list[schemas.Assignment])
+@app.get("/assignments/", response_model=list[schemas.AssignmentRow])
 def read_assignments(
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+    after: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    format: ListFormat = "json",
     db: Session = Depends(get_db),
 ):
     """
-    Get a list of assignments.
+    Get a page of assignments ordered by ID.
 
     Args:
         current_user (User): The current authenticated user.
+        after (str, optional): The cursor of the page. Defaults to the first page.
+        limit (int, optional): The maximum number of assignments to return. Defaults to 100.
+        format (str, optional): "ndjson" streams all assignments instead. Defaults to "json".
         db (Session, optional): The database session. Defaults to Depends(get_db).
 
     Returns:
-        List[Assignment]: The list of assignments.
+        List[Assignment]: The list of assignments, the cursor of the next page is in X-Next-Cursor.
     """
-    return crud.get_assignments(db=db)
+    if format == "ndjson":
+        return ndjson_response(crud.assignment_rows_statement(), models.Assignment.id)
+    assignments = crud.get_assignments(db, after=cursor_id(after), limit=limit + 1)
+    return rows_response(*keyset_page(assignments, limit))
 
 
 @app.get("/users/me/assignments/", response_model=list[schemas.Assignment])
@@ -551,7 +799,7 @@ def read_own_assignments(
 
 
 @app.post("/create_item")
-async def create_upload_file(
+def create_upload_file(
     ass_id: int,
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
     item: schemas.ItemCreate,
@@ -569,10 +817,25 @@ async def create_upload_file(
     Returns:
     - The created item.
 
+    Raises:
+    - HTTPException: If the assignment does not exist.
+
     """
+    if crud.get_assignment_by_id(db, ass_id) is None:
+        raise HTTPException(status_code=404, detail="Assignment not found")
     item_in_DB = crud.get_item(db, f"HW_{ass_id}_{current_user.id}")
     if item_in_DB is None:
-        return crud.create_user_item(db, item, current_user.id, ass_id)
+        try:
+            return crud.create_user_item(db, item, current_user.id, ass_id)
+        except IntegrityError as error:
+            db.rollback()
+            if not crud.is_unique_violation(error):
+                raise
+            # the file upload created the item in the meantime
+            item_in_DB = crud.get_item(db, f"HW_{ass_id}_{current_user.id}")
+        return crud.update_item(
+            db=db, item_id=item_in_DB.id, description=item.description
+        )
     else:
         return crud.update_item(
             db=db, item_id=item_in_DB.id, description=item.description
@@ -584,32 +847,59 @@ async def create_upload_file(
     ass_id: int,
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
     file: UploadFile = File(...),
+    db: Session = Depends(get_db),
 ):
     """
     Creates and upload file with the given assignment ID, current user, and file.
 
+    The file is streamed into the blob storage, its content hash is stored on the item,
+    the file is recorded as a new version of the item and added to the similarity index.
+
     Parameters:
         ass_id (int): The ID of the assignment.
         current_user (schemas.User): The current authenticated user.
         file (UploadFile): The file to be uploaded.
+        db (Session, optional): The database session. Defaults to Depends(get_db).
 
     Returns:
         dict: A dictionary containing the message indicating the success of the upload.
+
+    Raises:
+        HTTPException: If the assignment does not exist.
     """
 
     if not file:
         return {"message": "No upload file sent"}
+    # checked before the file is stored, so no blob is left without an item
+    if await run_in_threadpool(crud.get_assignment_by_id, db, ass_id) is None:
+        raise HTTPException(status_code=404, detail="Assignment not found")
     else:
-        folder = "HW"
-        prefix = f"HW_{ass_id}_{current_user.id}"
-        file_extension = file.filename.split(".").pop()
-        file_name = f"{prefix}.{file_extension}"
-        file_name = os.path.join(folder, file_name)
-        os.makedirs(os.path.dirname(file_name), exist_ok=True)
-        with open(file_name, "wb") as f:
-            content = await file.read()
-            f.write(content)
-        return {"message": f"{file_name} has been uploaded successfully!"}
+        content_hash, _ = await store_upload_file(file)
+        await run_in_threadpool(
+            record_submission, db, current_user.id, ass_id, content_hash
+        )
+        return {"message": f"{file.filename} has been uploaded successfully!"}
+
+
+def record_submission(db: Session, user_id: int, ass_id: int, content_hash: str):
+    """
+    Make a stored file the current solution of a student and record it as a new version.
+
+    The version delta and the similarity signature are computed here, so the
+    upload endpoint runs this in the threadpool.
+
+    Args:
+        db (Session): The database session.
+        user_id (int): The ID of the student.
+        ass_id (int): The ID of the assignment.
+        content_hash (str): The content hash of the stored file.
+    """
+    item = crud.set_item_content_hash(db, user_id, ass_id, content_hash)
+    content = storage.get_bytes(content_hash)
+    crud.create_item_version(db, item.id, content, content_hash)
+    crud.index_submission(db, item, content)
+    # older files live on as versions, the replaced blob is deleted later by
+    # the garbage collection of storage, another upload may be reusing it now
 
 
 @app.post("/uploadfile/assignment/{ass_id}")
@@ -617,56 +907,84 @@ async def upload_file_ass(
     ass_id: int,
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
     file: UploadFile = File(...),
+    db: Session = Depends(get_db),
 ):
     """
     Creates and upload file with the given assignment ID, current user, and file.
 
+    The test file is streamed into the blob storage and referenced by the assignment.
+
     Parameters:
         ass_id (int): The ID of the assignment.
         current_user (schemas.User): The current authenticated user.
         file (UploadFile): The file to be uploaded.
+        db (Session, optional): The database session. Defaults to Depends(get_db).
 
     Returns:
         dict: A dictionary containing the message indicating the success of the upload.
+
+    Raises:
+        HTTPException: If the current user does not have enough permissions or
+            the assignment does not exist.
     """
-    prefix = f"test_HW_{ass_id}"
     if not file:
         return {"message": "No upload file sent"}
+    if not auth.is_teacher_plus(current_user):
+        raise HTTPException(status_code=401, detail="Not enough permissions")
+    # checked before the file is stored, so no blob is left without an assignment
+    if await run_in_threadpool(crud.get_assignment_by_id, db, ass_id) is None:
+        raise HTTPException(status_code=404, detail="Assignment not found")
     else:
-        folder = "TESTS"
-        file_extension = file.filename.split(".").pop()
-        file_name = f"{prefix}.{file_extension}"
-        file_name = os.path.join(folder, file_name)
-        os.makedirs(os.path.dirname(file_name), exist_ok=True)
-        with open(file_name, "wb") as f:
-            content = await file.read()
-            f.write(content)
-        return {"message": f"{file_name} has been uploaded successfully!"}
+        test_hash, _ = await store_upload_file(file)
+        await run_in_threadpool(
+            crud.update_assignment, db=db, assignment_id=ass_id, test_hash=test_hash
+        )
+        return {"message": f"{file.filename} has been uploaded successfully!"}
 
 
 """Run tests"""
 
 
 @app.post("/test/{ass_id}")
-async def run(
+def run(
     ass_id: int,
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
     db: Session = Depends(get_db),
 ):
     # print("main: run endpoint called")
-    resultfunc = run_tests(ass_id, current_user.id)
+    item = crud.get_item(db, f"HW_{ass_id}_{current_user.id}")
+    assignment = crud.get_assignment_by_id(db, ass_id)
+    resultfunc = run_tests(
+        ass_id, current_user.id, item.content_hash, assignment.test_hash
+    )
+    crud.save_test_results(db, item.id, ass_id, resultfunc.pop("tests", []))
+    report_archive.archive_report(
+        db, report_path(ass_id, current_user.id), ass_id, current_user.id
+    )
     # print(f"main: resultfunc {resultfunc}")
     if type(resultfunc["mark"]) == int or float:
-        passed = True if resultfunc["mark"] >= 50 else False
+        grades = crud.regrade_items(db, ass_id, [item.id])
+        if grades:
+            resultfunc["mark"] = grades[0]["mark"]
+        passed = bool(grades) and grades[0]["passed"]
         crud.update_item(
             db=db,
-            item_id=crud.get_item(db, f"HW_{ass_id}_{current_user.id}").id,
+            item_id=item.id,
             tested=True,
             passed=passed,
             mark=resultfunc["mark"],
             pass_point=resultfunc["pass_points"],
             fail_point=resultfunc["failed_points"],
         ),
+        crud.update_item_version_result(
+            db=db,
+            item_id=item.id,
+            content_hash=item.content_hash,
+            passed=passed,
+            mark=resultfunc["mark"],
+            pass_point=resultfunc["pass_points"],
+            fail_point=resultfunc["failed_points"],
+        )
         return {"result": resultfunc}
     else:
         return {
@@ -679,194 +997,617 @@ async def run(
         }
 
 
-""" email sending, class enrolling"""
-
-
-async def send_email(email: list, login: str, password: str) -> dict:
-    message = MessageSchema(
-        subject="Welcome to autograder",
-        recipients=email,
-        template_body={"login": login, "temp_password": password},
-        subtype=MessageType.html,
-    )
-
-    fm = FastMail(conf)
-    try:
-        await fm.send_message(message, template_name="./templates/email_template.html")
-        return {"message": "email has been sent"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to send email: {str(e)}")
-
-
-@app.post("/send_email")
-async def simple_send(
-    email: schemas.EmailSchema, login: str, password: str
-) -> JSONResponse:
+@app.get("/assignment/{id}/similarity")
+def get_similar_submissions(
+    id: int,
+    current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+    threshold: float = 0.8,
+    limit: int = 100,
+    db: Session = Depends(get_db),
+):
     """
-    Sends an email using the provided email schema, login, and password.
+    Get pairs of suspiciously similar submissions of an assignment.
 
     Args:
-        email (schemas.EmailSchema): The email schema containing the email details.
-        login (str): The login for the email service.
-        password (str): The password for the email service.
+        id (int): The ID of the assignment.
+        current_user (User): The current authenticated user.
+        threshold (float, optional): Minimal similarity between 0 and 1. Defaults to 0.8.
+        limit (int, optional): Maximum number of pairs. Defaults to 100.
+        db (Session, optional): The database session. Defaults to Depends(get_db).
 
     Returns:
-        JSONResponse: The response containing the status code and response data.
+        list: The pairs of submissions with their similarity, most similar first.
+
+    Raises:
+        HTTPException: If the current user is not a teacher.
     """
-    response_data = await send_email(email.model_dump().get("email"), login, password)
-    return JSONResponse(status_code=200, content=jsonable_encoder(response_data))
+    if not auth.is_teacher_plus(current_user):
+        raise HTTPException(status_code=403, detail="You are not a teacher")
+    return crud.get_similar_submissions(
+        db, assignment_id=id, threshold=threshold, limit=limit
+    )
 
 
-@app.post("/create_classroom")
-async def create_classroom(
-    classroom: schemas.ClassroomCreate,
+@app.get("/assignment/{id}/tests")
+def get_assignment_test_summary(
+    id: int,
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
     db: Session = Depends(get_db),
 ):
     """
-    Create a classroom.
+    Get the number of students with each outcome of each test of an assignment.
 
     Args:
-        classroom (schemas.ClassroomCreate): The classroom data to be created.
-        current_user (schemas.User): The current user creating the classroom.
+        id (int): The ID of the assignment.
+        current_user (User): The current authenticated user.
         db (Session, optional): The database session. Defaults to Depends(get_db).
 
     Returns:
-        schemas.Classroom: The created classroom.
+        list: The outcome counts and mean durations per test.
 
     Raises:
-        HTTPException: If the current user does not have enough permissions.
+        HTTPException: If the current user is not a teacher.
     """
-
-    if crud.is_admin(db, current_user.id):
-        return crud.create_classroom(
-            db=db, classroom=classroom, user_id=current_user.id
-        )
-    else:
-        raise HTTPException(status_code=401, detail="Not enough permissions")
+    if not auth.is_teacher_plus(current_user):
+        raise HTTPException(status_code=403, detail="You are not a teacher")
+    return crud.get_test_summary(db, id)
 
 
-@app.get("/class/my")
-async def get_my_classes(
+@app.get("/assignment/{id}/tests/{test_id}")
+def get_users_by_test_outcome(
+    id: int,
+    test_id: str,
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+    outcome: str = "failed",
     db: Session = Depends(get_db),
 ):
     """
-    Get a list of classes.
+    Get the students whose latest run of a test had the given outcome.
 
     Args:
+        id (int): The ID of the assignment.
+        test_id (str): The name of the test function.
         current_user (User): The current authenticated user.
+        outcome (str, optional): The outcome of the test. Defaults to "failed".
         db (Session, optional): The database session. Defaults to Depends(get_db).
 
     Returns:
-        List[Classrooms]: The list of classrooms.
+        list: The students with their items and error messages.
+
+    Raises:
+        HTTPException: If the current user is not a teacher.
     """
-    return crud.get_my_classrooms(db=db, user_id=current_user.id)
+    if not auth.is_teacher_plus(current_user):
+        raise HTTPException(status_code=403, detail="You are not a teacher")
+    return crud.get_users_by_test_outcome(db, id, test_id, outcome)
 
 
-@app.post("/class/{class_id}/enroll/")
-async def enroll_classroom(
-    class_id: int,
-    email_list: str,
+@app.get("/assignment/{id}/policy", response_model=schemas.GradingPolicyBase)
+def read_grading_policy(
+    id: int,
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
     db: Session = Depends(get_db),
 ):
     """
-    Enrolls students into a classroom.
+    Get the grading policy of an assignment.
 
     Args:
-        class_id (int): The ID of the classroom.
-        email_list (str): A comma-separated string of student emails.
-        current_user (schemas.User): The current user making the request.
+        id (int): The ID of the assignment.
+        current_user (User): The current authenticated user.
         db (Session, optional): The database session. Defaults to Depends(get_db).
 
     Returns:
-        JSONResponse: A JSON response containing the enrolled users, new users, and incorrect emails.
-    """
-    incorrect_emails = []
-    new_users = []
-    enrolled_users = []
-    email_list = email_list.split(",")
-    for email in email_list:
-        if is_email(email):
-            if crud.is_teacher_plus(db, current_user.id):
-                if crud.is_user_in_db(db, email):
-                    if not crud.is_student_in_classroom(db, class_id, email):
-                        enrolled_users.append(email)
-                        return crud.enroll_student(
-                            db=db,
-                            user_id=crud.get_user_by_email(db=db, email=email).id,
-                            classroom_id=class_id,
-                        )
-
-                else:
-                    username = email.split("@")[0]
-                    password = auth.get_random_password()
-                    user = crud.create_user(
-                        db=db,
-                        user=schemas.UserCreate(
-                            username=username, email=email, password=password
-                        ),
-                    )
-                    crud.enroll_student(
-                        db=db,
-                        user_id=crud.get_user_by_email(db=db, email=email).id,
-                        classroom_id=class_id,
-                    )
-                    await send_email([email], username, password)
-                    new_users.append(email)
-            else:
-                raise HTTPException(status_code=401, detail="Not enough permissions")
-        else:
-            incorrect_emails.append(email)
-    if len(enrolled_users) == 0 and len(new_users) == 0 and len(incorrect_emails) == 0:
-        return JSONResponse(
-            status_code=400,
-            content=jsonable_encoder({"message": "All students are already enrolled"}),
-        )
-    return JSONResponse(
-        status_code=200,
-        content=jsonable_encoder(
-            {
-                "message": "Students enrolled successfully",
-                "enrolled_users": enrolled_users,
-                "new_users": new_users,
-                "incorrect_emails": incorrect_emails,
-            }
-        ),
-    )
-
-
-@app.get("/logincheck")
-async def loginCheck(
-    current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)]
-):
-    """
-    Checks if the user is logged in.
-
-    Parameters:
-    - current_user: The current logged-in user.
+        GradingPolicyBase: The grading policy, the default one if none was set.
 
-    Returns:
-    - An HTMLResponse with a status code of 200 and a content message indicating that the user is logged in.
+    Raises:
+        HTTPException: If the current user is not a teacher or the assignment is not found.
     """
-    return HTMLResponse(status_code=200, content="You are logged in")
+    if not auth.is_teacher_plus(current_user):
+        raise HTTPException(status_code=403, detail="You are not a teacher")
+    if crud.get_assignment_by_id(db, id) is None:
+        raise HTTPException(status_code=404, detail="Assignment not found")
+    return crud.get_grading_policy(db, id)
 
 
-@app.get("/assignment/{id}")
-async def get_assignments_by_id(
+@app.put("/assignment/{id}/policy", response_model=list[schemas.Grade])
+def update_grading_policy(
     id: int,
+    policy: schemas.GradingPolicyBase,
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
     db: Session = Depends(get_db),
 ):
     """
-    Retrieve an assignment by its ID.
+    Set the grading policy of an assignment and re-mark all its tested submissions.
 
     Args:
-        id (int): The ID of the assignment to retrieve.
+        id (int): The ID of the assignment.
+        policy (GradingPolicyBase): The new grading policy.
+        current_user (User): The current authenticated user.
+        db (Session, optional): The database session. Defaults to Depends(get_db).
+
+    Returns:
+        list: The new marks of the submissions.
+
+    Raises:
+        HTTPException: If the current user is not a teacher or the assignment is not found.
+    """
+    if not auth.is_teacher_plus(current_user):
+        raise HTTPException(status_code=403, detail="You are not a teacher")
+    if crud.get_assignment_by_id(db, id) is None:
+        raise HTTPException(status_code=404, detail="Assignment not found")
+    crud.set_grading_policy(db, id, policy)
+    return crud.regrade_items(db, id)
+
+
+@app.post("/assignment/{id}/regrade", response_model=list[schemas.Grade])
+def regrade_assignment(
+    id: int,
+    current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+    db: Session = Depends(get_db),
+):
+    """
+    Re-mark all tested submissions of an assignment from their stored test results.
+
+    Args:
+        id (int): The ID of the assignment.
+        current_user (User): The current authenticated user.
+        db (Session, optional): The database session. Defaults to Depends(get_db).
+
+    Returns:
+        list: The new marks of the submissions.
+
+    Raises:
+        HTTPException: If the current user is not a teacher or the assignment is not found.
+    """
+    if not auth.is_teacher_plus(current_user):
+        raise HTTPException(status_code=403, detail="You are not a teacher")
+    if crud.get_assignment_by_id(db, id) is None:
+        raise HTTPException(status_code=404, detail="Assignment not found")
+    return crud.regrade_items(db, id)
+
+
+@app.get("/items/{item_id}/tests", response_model=list[schemas.TestResult])
+def read_item_test_results(
+    item_id: int,
+    current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+    db: Session = Depends(get_db),
+):
+    """
+    Get the outcome of each test in the latest run of an item.
+
+    Args:
+        item_id (int): The ID of the item.
+        current_user (User): The current authenticated user.
+        db (Session, optional): The database session. Defaults to Depends(get_db).
+
+    Returns:
+        List[TestResult]: The per-test results.
+    """
+    get_item_for_viewer(db, item_id, current_user)
+    return crud.get_item_test_results(db, item_id)
+
+
+@app.get("/items/{item_id}/report")
+def read_item_report(
+    item_id: int,
+    current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+    db: Session = Depends(get_db),
+):
+    """
+    Get the full pytest report of the latest run of an item from the archive.
+
+    Args:
+        item_id (int): The ID of the item.
+        current_user (User): The current authenticated user.
+        db (Session, optional): The database session. Defaults to Depends(get_db).
+
+    Returns:
+        Response: The JSON report.
+
+    Raises:
+        HTTPException: If there is no archived report.
+    """
+    item = get_item_for_viewer(db, item_id, current_user)
+    report = report_archive.read_report(db, item.assignment_id, item.owner_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return Response(content=report, media_type="application/json")
+
+
+"""Submission versions"""
+
+
+def get_item_for_viewer(db: Session, item_id: int, current_user: schemas.User):
+    """
+    Return the item if the current user may see it.
+
+    Args:
+        db (Session): The database session.
+        item_id (int): The ID of the item.
         current_user (schemas.User): The current authenticated user.
+
+    Returns:
+        Item: The item.
+
+    Raises:
+        HTTPException: If the item is not found or belongs to another student.
+    """
+    item = crud.get_item_by_id(db, item_id)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    if item.owner_id != current_user.id and not auth.is_teacher_plus(current_user):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    return item
+
+
+@app.get("/items/{item_id}/versions", response_model=list[schemas.ItemVersion])
+def read_item_versions(
+    item_id: int,
+    current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+    db: Session = Depends(get_db),
+):
+    """
+    Get all uploaded versions of an item with their grading results.
+
+    Args:
+        item_id (int): The ID of the item.
+        current_user (User): The current authenticated user.
+        db (Session, optional): The database session. Defaults to Depends(get_db).
+
+    Returns:
+        List[ItemVersion]: The versions of the item.
+    """
+    get_item_for_viewer(db, item_id, current_user)
+    return crud.get_item_versions(db, item_id)
+
+
+@app.get("/items/{item_id}/versions/diff")
+def diff_item_versions(
+    item_id: int,
+    old: int,
+    new: int,
+    current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+    db: Session = Depends(get_db),
+):
+    """
+    Get the unified diff of two versions of an item.
+
+    Args:
+        item_id (int): The ID of the item.
+        old (int): The number of the first version.
+        new (int): The number of the second version.
+        current_user (User): The current authenticated user.
+        db (Session, optional): The database session. Defaults to Depends(get_db).
+
+    Returns:
+        dict: The diff of the two versions.
+
+    Raises:
+        HTTPException: If one of the versions is not found.
+    """
+    get_item_for_viewer(db, item_id, current_user)
+    old_content = crud.get_item_version_content(db, item_id, old)
+    new_content = crud.get_item_version_content(db, item_id, new)
+    if old_content is None or new_content is None:
+        raise HTTPException(status_code=404, detail="Version not found")
+    return {
+        "old": old,
+        "new": new,
+        "diff": versions.unified_diff(
+            old_content, new_content, f"version {old}", f"version {new}"
+        ),
+    }
+
+
+@app.get("/items/{item_id}/versions/{number}")
+def read_item_version(
+    item_id: int,
+    number: int,
+    current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+    db: Session = Depends(get_db),
+):
+    """
+    Get the file of one version of an item.
+
+    Args:
+        item_id (int): The ID of the item.
+        number (int): The number of the version.
+        current_user (User): The current authenticated user.
         db (Session, optional): The database session. Defaults to Depends(get_db).
 
+    Returns:
+        Response: The file of the version.
+
+    Raises:
+        HTTPException: If the version is not found.
+    """
+    get_item_for_viewer(db, item_id, current_user)
+    content = crud.get_item_version_content(db, item_id, number)
+    if content is None:
+        raise HTTPException(status_code=404, detail="Version not found")
+    return Response(content=content, media_type="text/x-python")
+
+
+""" email sending, class enrolling"""
+
+
+async def send_email(email: list, login: str, password: str) -> dict:
+    """
+    Queue the welcome email of an account in the outbox of mailer.
+
+    Args:
+        email (list): The recipients.
+        login (str): The username.
+        password (str): The temporary password.
+
+    Returns:
+        dict: A message that the email is queued.
+    """
+    async with AsyncSessionLocal() as db:
+        await async_crud.queue_emails(
+            db,
+            [mailer.welcome_email(recipient, login, password) for recipient in email],
+        )
+    mailer.notify()
+    return {"message": "email has been queued"}
+
+
+@app.get("/outbox")
+async def read_outbox(
+    current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Get the delivery status of the outgoing emails.
+
+    Args:
+        current_user (User): The current authenticated user.
+        db (AsyncSession, optional): The async database session. Defaults to Depends(get_async_db).
+
+    Returns:
+        dict: The number of emails by status and the failed and retried emails,
+            see async_crud.get_outbox_summary.
+
+    Raises:
+        HTTPException: If the current user is not an admin.
+    """
+    if not auth.is_admin(current_user):
+        raise HTTPException(status_code=403, detail="You are not an admin")
+    return await async_crud.get_outbox_summary(db)
+
+
+@app.get("/cache")
+async def read_cache_stats(
+    current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+):
+    """
+    Get the hits and misses of the caches of this worker.
+
+    Args:
+        current_user (User): The current authenticated user.
+
+    Returns:
+        dict: The stats of the principal, classroom and assignment caches.
+
+    Raises:
+        HTTPException: If the current user is not an admin.
+    """
+    if not auth.is_admin(current_user):
+        raise HTTPException(status_code=403, detail="You are not an admin")
+    return {
+        "principals": cache.principals.stats(),
+        "classrooms": cache.classrooms.stats(),
+        "assignments": cache.assignments.stats(),
+    }
+
+
+@app.post("/send_email")
+async def simple_send(
+    email: schemas.EmailSchema, login: str, password: str
+) -> JSONResponse:
+    """
+    Sends an email using the provided email schema, login, and password.
+
+    Args:
+        email (schemas.EmailSchema): The email schema containing the email details.
+        login (str): The login for the email service.
+        password (str): The password for the email service.
+
+    Returns:
+        JSONResponse: The response containing the status code and response data.
+    """
+    response_data = await send_email(email.model_dump().get("email"), login, password)
+    return JSONResponse(status_code=200, content=jsonable_encoder(response_data))
+
+
+@app.post("/create_classroom")
+def create_classroom(
+    classroom: schemas.ClassroomCreate,
+    current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+    db: Session = Depends(get_db),
+):
+    """
+    Create a classroom.
+
+    Args:
+        classroom (schemas.ClassroomCreate): The classroom data to be created.
+        current_user (schemas.User): The current user creating the classroom.
+        db (Session, optional): The database session. Defaults to Depends(get_db).
+
+    Returns:
+        schemas.Classroom: The created classroom.
+
+    Raises:
+        HTTPException: If the current user does not have enough permissions.
+    """
+
+    if auth.is_admin(current_user):
+        return crud.create_classroom(
+            db=db, classroom=classroom, user_id=current_user.id
+        )
+    else:
+        raise HTTPException(status_code=401, detail="Not enough permissions")
+
+
+@app.get("/class/my")
+async def get_my_classes(
+    current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Get a list of classes.
+
+    Args:
+        current_user (User): The current authenticated user.
+        db (AsyncSession, optional): The async database session. Defaults to Depends(get_async_db).
+
+    Returns:
+        List[Classrooms]: The list of classrooms.
+    """
+    return await async_crud.get_my_classrooms(db=db, user_id=current_user.id)
+
+
+async def bulk_enroll(
+    db: AsyncSession,
+    class_id: int,
+    rows: list,
+    current_user: schemas.User,
+) -> JSONResponse:
+    """
+    Enroll the students of the rows into a classroom and report every row.
+
+    Args:
+        db (AsyncSession): The async database session.
+        class_id (int): The ID of the classroom.
+        rows (list): Tuples (row number, email, username or None).
+        current_user (schemas.User): The current user making the request.
+
+    Returns:
+        JSONResponse: The enrolled users, new users, incorrect emails and the
+            per-row report.
+
+    Raises:
+        HTTPException: If the user is not a teacher or the classroom does not exist.
+    """
+    if not auth.is_teacher_plus(current_user):
+        raise HTTPException(status_code=401, detail="Not enough permissions")
+    if await async_crud.get_classroom_by_id(db, class_id) is None:
+        raise HTTPException(status_code=404, detail="Classroom not found")
+    report = await enrollment.enroll(db, class_id, rows)
+    mailer.notify()
+
+    def emails(*statuses):
+        return [line["email"] for line in report if line["status"] in statuses]
+
+    enrolled_users = emails(enrollment.ENROLLED)
+    new_users = emails(enrollment.CREATED)
+    incorrect_emails = emails(enrollment.INVALID_EMAIL)
+    if len(enrolled_users) == 0 and len(new_users) == 0 and len(incorrect_emails) == 0:
+        return JSONResponse(
+            status_code=400,
+            content=jsonable_encoder(
+                {"message": "All students are already enrolled", "report": report}
+            ),
+        )
+    return JSONResponse(
+        status_code=200,
+        content=jsonable_encoder(
+            {
+                "message": "Students enrolled successfully",
+                "enrolled_users": enrolled_users,
+                "new_users": new_users,
+                "incorrect_emails": incorrect_emails,
+                "report": report,
+            }
+        ),
+    )
+
+
+@app.post("/class/{class_id}/enroll/")
+async def enroll_classroom(
+    class_id: int,
+    email_list: str,
+    current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Enrolls students into a classroom.
+
+    Args:
+        class_id (int): The ID of the classroom.
+        email_list (str): A comma-separated string of student emails.
+        current_user (schemas.User): The current user making the request.
+        db (AsyncSession, optional): The async database session. Defaults to Depends(get_async_db).
+
+    Returns:
+        JSONResponse: A JSON response containing the enrolled users, new users, incorrect emails and the per-row report.
+    """
+    rows = enrollment.parse_list(email_list)
+    return await bulk_enroll(db, class_id, rows, current_user)
+
+
+@app.post("/class/{class_id}/enroll/csv")
+async def enroll_classroom_csv(
+    class_id: int,
+    current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Enrolls the students of a CSV file into a classroom.
+
+    The file has an "email" and optionally a "username" column, see
+    enrollment.parse_csv.
+
+    Args:
+        class_id (int): The ID of the classroom.
+        current_user (schemas.User): The current user making the request.
+        file (UploadFile): The CSV file.
+        db (AsyncSession, optional): The async database session. Defaults to Depends(get_async_db).
+
+    Returns:
+        JSONResponse: A JSON response containing the enrolled users, new users, incorrect emails and the per-row report.
+
+    Raises:
+        HTTPException: If the file is larger than MAX_UPLOAD_SIZE.
+    """
+    data = await file.read(MAX_UPLOAD_SIZE + 1)
+    if len(data) > MAX_UPLOAD_SIZE:
+        raise too_large_exception()
+    rows = enrollment.parse_csv(data)
+    return await bulk_enroll(db, class_id, rows, current_user)
+
+
+@app.get("/logincheck")
+async def loginCheck(
+    current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)]
+):
+    """
+    Checks if the user is logged in.
+
+    Parameters:
+    - current_user: The current logged-in user.
+
+    Returns:
+    - An HTMLResponse with a status code of 200 and a content message indicating that the user is logged in.
+    """
+    return HTMLResponse(status_code=200, content="You are logged in")
+
+
+@app.get("/assignment/{id}")
+async def get_assignments_by_id(
+    id: int,
+    current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Retrieve an assignment by its ID.
+
+    Args:
+        id (int): The ID of the assignment to retrieve.
+        current_user (schemas.User): The current authenticated user.
+        db (AsyncSession, optional): The async database session. Defaults to Depends(get_async_db).
+
     Returns:
         schemas.Assignment: The retrieved assignment.
 
@@ -874,7 +1615,7 @@ async def get_assignments_by_id(
         HTTPException: If the assignment is not found.
     """
 
-    assignment = crud.get_assignment_by_id(db, id)
+    assignment = await async_crud.get_assignment_by_id(db, id)
     if assignment is None:
         raise HTTPException(status_code=404, detail="Assignment not found")
     else:
@@ -882,7 +1623,7 @@ async def get_assignments_by_id(
 
 
 @app.delete("/assignment/{id}")
-async def del_assignments_by_id(
+def del_assignments_by_id(
     id: int,
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
     db: Session = Depends(get_db),
@@ -902,7 +1643,7 @@ async def del_assignments_by_id(
         HTTPException: If the current user does not have enough permissions or if the assignment is not found.
     """
 
-    if not crud.is_super_teacher_plus(db, current_user.id):
+    if not auth.is_super_teacher_plus(current_user):
         raise HTTPException(status_code=401, detail="Not enough permissions")
     if crud.get_assignment_by_id(db, id) is None:
         raise HTTPException(status_code=404, detail="Assignment not found")
@@ -914,7 +1655,7 @@ async def del_assignments_by_id(
 async def get_class_by_id(
     id: int,
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Retrieve a classroom by its ID.
@@ -922,7 +1663,7 @@ async def get_class_by_id(
     Args:
         id (int): The ID of the classroom to retrieve.
         current_user (schemas.User): The current authenticated user.
-        db (Session, optional): The database session. Defaults to Depends(get_db).
+        db (AsyncSession, optional): The async database session. Defaults to Depends(get_async_db).
 
     Returns:
         schemas.Classroom: The retrieved classroom.
@@ -930,7 +1671,7 @@ async def get_class_by_id(
     Raises:
         HTTPException: If the classroom is not found.
     """
-    classroom = crud.get_classroom_by_id(db, id)
+    classroom = await async_crud.get_classroom_by_id(db, id)
     if classroom is None:
         raise HTTPException(status_code=404, detail="Assignment not found")
     else:
@@ -938,7 +1679,7 @@ async def get_class_by_id(
 
 
 @app.delete("/del_class/{id}")
-async def del_class_by_id(
+def del_class_by_id(
     id: int,
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
     db: Session = Depends(get_db),
@@ -957,7 +1698,7 @@ async def del_class_by_id(
     Returns:
         Any: The result of the delete operation.
     """
-    if not crud.is_super_teacher_plus(db, current_user.id):
+    if not auth.is_super_teacher_plus(current_user):
         raise HTTPException(status_code=401, detail="Not enough permissions")
     if crud.get_classroom_by_id(db, id) is None:
         raise HTTPException(status_code=404, detail="Class not found")
@@ -965,37 +1706,50 @@ async def del_class_by_id(
         return crud.delete_classroom(db=db, ass_id=id)
 
 
-@app.get("/class/{id}/enrolled_users_list")
-async def get_enrolled_users_list(
+@app.get("/class/{id}/enrolled_users_list", response_model=list[schemas.UserRow | None])
+def get_enrolled_users_list(
     id: int,
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+    after: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    format: ListFormat = "json",
     db: Session = Depends(get_db),
 ):
     """
-    Retrieve the list of enrolled users in a class.
+    Retrieve a page of the enrolled users in a class ordered by ID.
 
     Args:
         id (int): The ID of the class.
         current_user (schemas.User): The current authenticated user.
+        after (str, optional): The cursor of the page. Defaults to the first page.
+        limit (int, optional): The maximum number of users to return. Defaults to 100.
+        format (str, optional): "ndjson" streams all enrolled users to teachers instead.
+            Defaults to "json".
         db (Session, optional): The database session. Defaults to Depends(get_db).
 
     Returns:
         List[schemas.User]: The list of enrolled users, with redacted information for non-teacher users.
+            The cursor of the next page is in X-Next-Cursor.
     """
-    enrolled_users = crud.get_users_in_class(db, id)
-    if crud.is_teacher_plus(db, current_user.id):
-        return enrolled_users
+    if format == "ndjson" and auth.is_teacher_plus(current_user):
+        return ndjson_response(crud.class_users_statement(id), models.User.id)
+    enrolled_users, next_cursor = keyset_page(
+        crud.get_users_in_class(db, id, after=cursor_id(after), limit=limit + 1),
+        limit,
+    )
+    if auth.is_teacher_plus(current_user):
+        return rows_response(enrolled_users, next_cursor)
     else:
         redacted_list = []
         for user in enrolled_users:
             if user.id != current_user.id:
                 user = None
             redacted_list.append(user)
-        return redacted_list
+        return rows_response(redacted_list, next_cursor)
 
 
 @app.delete("/class/{class_id}/removeuser/{user_id}")
-async def remove_user_from_class(
+def remove_user_from_class(
     class_id: int,
     user_id: int,
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
@@ -1042,8 +1796,15 @@ async def change_password(
         HTMLResponse: A response indicating whether the password was changed successfully or not.
     """
 
-    if auth.verify_password(old_password, current_user.hashed_password):
-        if crud.update_user_password(db, current_user.id, new_password):
+    if await auth.authenticate_user(current_user.username, old_password, db):
+        hashed_password = await hashing.hash_password(new_password)
+        if await run_in_threadpool(
+            crud.update_user_password,
+            db,
+            current_user.id,
+            new_password,
+            hashed_password=hashed_password,
+        ):
             return HTMLResponse(status_code=200, content="Password changed")
         else:
             return HTMLResponse(status_code=500, content="Password not changed")
@@ -1067,16 +1828,23 @@ async def change_password(
         HTMLResponse: The response indicating whether the password was changed successfully or not.
     """
 
-    if crud.is_first_login(db, current_user.id):
-        if crud.update_user_password(db, current_user.id, new_password):
-            crud.first_password_changed(db, current_user.id)
+    if await run_in_threadpool(crud.is_first_login, db, current_user.id):
+        hashed_password = await hashing.hash_password(new_password)
+        if await run_in_threadpool(
+            crud.update_user_password,
+            db,
+            current_user.id,
+            new_password,
+            hashed_password=hashed_password,
+        ):
+            await run_in_threadpool(crud.first_password_changed, db, current_user.id)
             return HTMLResponse(status_code=200, content="Password changed")
         else:
             return HTMLResponse(status_code=500, content="Password not changed")
 
 
 @app.get("/login/is_first")
-async def is_first_login(
+def is_first_login(
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
     db: Session = Depends(get_db),
 ):
@@ -1096,42 +1864,56 @@ async def is_first_login(
         return HTMLResponse(status_code=200, content="Not first login")
 
 
+def progress_lists(rows) -> dict:
+    """
+    Split the progress rows of a student into the parallel lists of the pages.
+
+    Args:
+        rows (list[Row]): The rows of crud.get_user_progress.
+
+    Returns:
+        dict: The "items", "classes" ([id, name]) and "assignments" ([id, name]).
+    """
+    return {
+        "items": [
+            {
+                "id": row.id,
+                "owner_id": row.owner_id,
+                "assignment_id": row.assignment_id,
+                "mark": row.mark,
+                "tested": row.tested,
+                "passed": row.passed,
+            }
+            for row in rows
+        ],
+        "classes": [[row.classroom_id, row.classroom_name] for row in rows],
+        "assignments": [[row.assignment_id, row.assignment_name] for row in rows],
+    }
+
+
 @app.get("/users/me/all_items/")
 async def read_own_items(
     current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Get the items owned by the current authenticated user.
 
     Args:
         current_user (User): The current authenticated user.
-        db (Session, optional): The database session. Defaults to Depends(get_db).
+        db (AsyncSession, optional): The async database session. Defaults to Depends(get_async_db).
 
     Returns:
-        List[Item]: The items owned by the current authenticated user.
+        dict: The username, the user ID and the "items", "classes" and "assignments"
+            of progress_lists, one entry per assignment of the user's classes.
     """
-    items = crud.get_user_item(db, current_user.id)
-    user = crud.get_user(db, current_user.id)
-    assignments = []
-    classes = []
-    if items is not None:
-        for item in items:
-            assignment = crud.get_assignment_by_id(db, item.assignment_id)
-            assignment_info = [assignment.id, assignment.name]
-            assignments.append(assignment_info)
-
-            classroom = crud.get_classroom_by_id(db, assignment.classroom_id)
-            class_info = [classroom.id, classroom.name]
-            classes.append(class_info)
-
-        return {
-            "username": user.username,
-            "user_id": user.id,
-            "items": items,
-            "classes": classes,
-            "assignments": assignments,
-        }
+    user = await async_crud.get_user(db, current_user.id)
+    rows = await async_crud.get_user_progress(db, current_user.id)
+    return {
+        "username": user.username,
+        "user_id": user.id,
+        **progress_lists(rows),
+    }
 
 
 """
@@ -1163,11 +1945,22 @@ async def html_favicon():
 async def html_get_all_classes(
     # current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
     request: Request,
-    db: Session = Depends(get_db),
+    after: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    class_list = crud.get_classrooms(db=db)
+    class_list, next_cursor = keyset_page(
+        await async_crud.get_classrooms(db, after=cursor_id(after), limit=limit + 1),
+        limit,
+    )
     return templates.TemplateResponse(
-        "class_list.html", {"request": request, "class_list": class_list}
+        "class_list.html",
+        {
+            "request": request,
+            "class_list": class_list,
+            "limit": limit,
+            "next_cursor": next_cursor,
+        },
     )
 
 
@@ -1176,7 +1969,7 @@ async def html_get_class(
     class_id: int,
     request: Request,
     user_id: int | None = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Retrieve HTML template response for a specific class.
@@ -1185,16 +1978,20 @@ async def html_get_class(
         class_id (int): The ID of the class.
         request (Request): The request object.
         user_id (int | None, optional): The ID of the user. Defaults to None.
-        db (Session, optional): The database session. Defaults to Depends(get_db).
+        db (AsyncSession, optional): The async database session. Defaults to Depends(get_async_db).
 
     Returns:
         TemplateResponse: The HTML template response.
     """
-    ass_pass = []
-    class_info = crud.get_classroom_by_id(db=db, classroom_id=class_id)
+    class_info = await async_crud.get_classroom_with_assignments(
+        db=db, classroom_id=class_id
+    )
     if user_id is not None:
-        for ass in class_info.assignments:
-            ass_pass.append(crud.get_item_pass(db=db, user_id=user_id, ass_id=ass.id))
+        ass_ids = [ass.id for ass in class_info.assignments]
+        passed = await async_crud.get_items_pass(
+            db=db, user_id=user_id, ass_ids=ass_ids
+        )
+        ass_pass = [passed[ass_id] for ass_id in ass_ids]
         return templates.TemplateResponse(
             "class_info.html",
             {"request": request, "class_info": class_info, "ass_pass": ass_pass},
@@ -1211,9 +2008,11 @@ async def html_get_assignment(
     class_id: int,
     assignment_id: int,
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    assignment_info = crud.get_assignment_by_id(db=db, assignment_id=assignment_id)
+    assignment_info = await async_crud.get_assignment_by_id(
+        db=db, assignment_id=assignment_id
+    )
     return templates.TemplateResponse(
         "assignment_info.html", {"request": request, "assignment_info": assignment_info}
     )
@@ -1250,10 +2049,9 @@ async def html_change_role(request: Request):
 async def html_show_enrolled_users(
     request: Request,
     class_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    users = crud.get_users_in_class(db, class_id)
-    classroom = crud.get_classroom_by_id(db, class_id)
+    classroom = await async_crud.get_classroom_by_id(db, class_id)
     return templates.TemplateResponse(
         "student_list.html", {"request": request, "class": classroom}
     )
@@ -1301,12 +2099,83 @@ def html_change_password(request: Request):
     )
 
 
+ResultSort = Literal["name", "mark", "status"]
+ResultStatus = Literal["not_turned_in", "failed", "passed"]
+
+
+def result_cursor_types(sort: str) -> tuple:
+    """
+    Return the types of the values in a cursor of the results of an assignment.
+
+    Args:
+        sort (str): The column the results are sorted by.
+
+    Returns:
+        tuple: The type of the sort column and of the user ID.
+    """
+    return crud.RESULT_SORT_KEYS[sort].type.python_type, int
+
+
+async def get_results_page(
+    db: AsyncSession,
+    assignment_id: int,
+    class_id: int,
+    sort: str,
+    order: str,
+    status: str | None,
+    after: str | None,
+    limit: int,
+):
+    """
+    Get one page of the results of an assignment and the cursor of the next page.
+
+    Args:
+        db (AsyncSession): The async database session.
+        assignment_id (int): The ID of the assignment.
+        class_id (int): The ID of the class.
+        sort (str): The column to sort by.
+        order (str): "asc" or "desc".
+        status (str | None): Show only results with this status.
+        after (str | None): The cursor of the page.
+        limit (int): Maximum number of results.
+
+    Returns:
+        tuple: The results and the cursor of the next page, None on the last page.
+    """
+    results = await async_crud.get_assignment_results(
+        db,
+        assignment_id,
+        class_id,
+        sort=sort,
+        descending=order == "desc",
+        status=status,
+        after=(
+            pagination.decode_cursor(after, result_cursor_types(sort))
+            if after
+            else None
+        ),
+        limit=limit + 1,
+    )
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = pagination.encode_cursor(results[-1]["sort_key"])
+    for result in results:
+        del result["sort_key"]
+    return results, next_cursor
+
+
 @app.get("/class/{class_id}/assignment/{assignment_id}/results")
 async def html_show_ass_results(
     request: Request,
     class_id: int,
     assignment_id: int,
-    db: Session = Depends(get_db),
+    sort: ResultSort = "name",
+    order: Literal["asc", "desc"] = "asc",
+    status: ResultStatus | None = None,
+    after: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Display the results of an assignment in HTML format.
@@ -1315,52 +2184,92 @@ async def html_show_ass_results(
         request (Request): The HTTP request object.
         class_id (int): The ID of the class.
         assignment_id (int): The ID of the assignment.
-        db (Session, optional): The database session. Defaults to Depends(get_db).
+        sort (str, optional): Sort by "name", "mark" or "status". Defaults to "name".
+        order (str, optional): "asc" or "desc". Defaults to "asc".
+        status (str, optional): Show only "not_turned_in", "failed" or "passed" results.
+        after (str, optional): The cursor of the page. Defaults to the first page.
+        limit (int, optional): Maximum number of results per page. Defaults to 100.
+        db (AsyncSession, optional): The async database session. Defaults to Depends(get_async_db).
 
     Returns:
         TemplateResponse: The HTML template response containing the assignment results.
     """
 
-    assignment = crud.get_assignment_by_id(db, assignment_id)
-    users = crud.get_users_in_class(db, class_id)
-
-    outcome = []
-    for user in users:
-        item = crud.get_item_by_user_assignment(db, user.id, assignment_id)
-
-        if item is not None:
-            if item.passed:
-                result = "passed"
-            elif item.tested:
-                result = "tested"
-            else:
-                result = "not turned over"
-            mark = item.mark
-
-        else:
-            result = "not turned over"
-            mark = 0
-
-        user_outcome = [user.id, user.username, result, mark]
-
-        outcome.append(user_outcome)
+    assignment = await async_crud.get_assignment_by_id(db, assignment_id)
+    stats = await async_crud.get_assignment_stats(db, assignment_id)
+    outcome, next_cursor = await get_results_page(
+        db, assignment_id, class_id, sort, order, status, after, limit
+    )
 
     return templates.TemplateResponse(
         "show_ass_outcome.html",
         {
             "request": request,
             "ass_name": assignment.name,
+            "stats": stats,
             "outcome": outcome,
             "ass_id": assignment_id,
+            "sort": sort,
+            "order": order,
+            "status": status,
+            "limit": limit,
+            "next_cursor": next_cursor,
         },
     )
 
 
+@app.get("/assignment/{id}/results")
+async def read_assignment_results(
+    id: int,
+    current_user: Annotated[schemas.User, Depends(auth.get_current_active_user)],
+    sort: ResultSort = "name",
+    order: Literal["asc", "desc"] = "asc",
+    status: ResultStatus | None = None,
+    after: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Get one page of the results of all students of the class of an assignment.
+
+    Args:
+        id (int): The ID of the assignment.
+        current_user (User): The current authenticated user.
+        sort (str, optional): Sort by "name", "mark" or "status". Defaults to "name".
+        order (str, optional): "asc" or "desc". Defaults to "asc".
+        status (str, optional): Show only "not_turned_in", "failed" or "passed" results.
+        after (str, optional): The cursor of the page. Defaults to the first page.
+        limit (int, optional): Maximum number of results per page. Defaults to 100.
+        db (AsyncSession, optional): The async database session. Defaults to Depends(get_async_db).
+
+    Returns:
+        dict: The results, the cursor of the next page in "next" and the
+            aggregated results of the assignment in "stats".
+
+    Raises:
+        HTTPException: If the current user is not a teacher or the assignment is not found.
+    """
+    if not auth.is_teacher_plus(current_user):
+        raise HTTPException(status_code=403, detail="You are not a teacher")
+    assignment = await async_crud.get_assignment_by_id(db, id)
+    if assignment is None:
+        raise HTTPException(status_code=404, detail="Assignment not found")
+    stats = await async_crud.get_assignment_stats(db, id)
+    results, next_cursor = await get_results_page(
+        db, id, assignment.classroom_id, sort, order, status, after, limit
+    )
+    return {
+        "results": results,
+        "next": next_cursor,
+        "stats": schemas.AssignmentStats.model_validate(stats) if stats else None,
+    }
+
+
 @app.get("/users/{user_id}/assignments")
 async def html_users_ass_results(
     request: Request,
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     Retrieve HTML template response for displaying a user's assignment results.
@@ -1368,24 +2277,13 @@ async def html_users_ass_results(
     Args:
         request (Request): The incoming request.
         user_id (int): The ID of the user.
-        db (Session, optional): The database session. Defaults to Depends(get_db).
+        db (AsyncSession, optional): The async database session. Defaults to Depends(get_async_db).
 
     Returns:
         TemplateResponse: The HTML template response.
     """
-    items = crud.get_user_item(db, user_id)
-    user = crud.get_user(db, user_id)
-    assignments = []
-    classes = []
-    if items is not None:
-        for item in items:
-            assignment = crud.get_assignment_by_id(db, item.assignment_id)
-            assignment_info = [assignment.id, assignment.name]
-            assignments.append(assignment_info)
-
-            classroom = crud.get_classroom_by_id(db, assignment.classroom_id)
-            class_info = [classroom.id, classroom.name]
-            classes.append(class_info)
+    user = await async_crud.get_user(db, user_id)
+    rows = await async_crud.get_user_progress(db, user_id)
 
     return templates.TemplateResponse(
         "show_user_outcome.html",
@@ -1393,21 +2291,22 @@ async def html_users_ass_results(
             "request": request,
             "username": user.username,
             "user_id": user.id,
-            "items": items,
-            "classes": classes,
-            "assignments": assignments,
+            **progress_lists(rows),
         },
     )
 
 
 @app.get("/users/{user_id}/solution/{assignment_id}")
-async def html_show_file(request: Request, user_id: int, assignment_id: int):
-    folder = "HW"
-    filename = f"HW_{assignment_id}_{user_id}.py"
-    file_path = os.path.join(folder, filename)
-
-    with open(file_path, "r") as f:
-        python_code = f.read()
+def html_show_file(
+    request: Request,
+    user_id: int,
+    assignment_id: int,
+    db: Session = Depends(get_db),
+):
+    item = crud.get_item_by_user_assignment(db, user_id, assignment_id)
+    if item is None or item.content_hash is None:
+        raise HTTPException(status_code=404, detail="Solution not found")
+    python_code = storage.get_bytes(item.content_hash).decode(errors="replace")
 
     return templates.TemplateResponse(
         "show_code.html", {"request": request, "code": python_code}
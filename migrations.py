@@ -0,0 +1,340 @@
+"""
+Versioned schema migrations.
+
+Tables that do not exist yet are created from the models, changes to existing
+tables are applied by the numbered migrations below. Every applied migration
+is recorded in the schema_version table, so each runs once per database. The
+server applies pending migrations on startup, they can also be applied with
+
+    python migrations.py upgrade
+
+`python migrations.py current` prints the applied migrations and
+`python migrations.py explain` shows the query plans of the hot lookups and
+exits with 1 when one of them does not use its index.
+"""
+
+import sys
+from pathlib import Path
+
+from sqlalchemy import func, inspect, select, text, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from sqlalchemy.schema import CreateColumn
+
+import crud, gradebook, models, search
+from database import engine, is_sqlite
+from storage import storage
+
+MIGRATIONS = []
+
+# where the uploads were kept before the storage, named after the item filename
+# and the assignment filename with the extension of the uploaded file
+LEGACY_DIRS = {
+    "items": Path(__file__).parent / "HW",
+    "assignments": Path(__file__).parent / "TESTS",
+}
+
+
+def migration(version: int, name: str):
+    """Register a function taking a connection as the migration with the given number."""
+
+    def register(function):
+        MIGRATIONS.append((version, name, function))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return function
+
+    return register
+
+
+def add_column(conn: Connection, column):
+    """Add a column of a model to its existing table unless it is already there."""
+    table = column.table
+    if column.name in {c["name"] for c in inspect(conn).get_columns(table.name)}:
+        return
+    ddl = CreateColumn(column).compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+
+
+def create_index(conn: Connection, table, name: str):
+    """Create an index of a model by its name unless it is already there."""
+    index = next(index for index in table.indexes if index.name == name)
+    index.create(conn, checkfirst=True)
+
+
+@migration(1, "columns added to existing tables")
+def add_columns(conn: Connection):
+    add_column(conn, models.User.__table__.c.role_version)
+    add_column(conn, models.Item.__table__.c.content_hash)
+    create_index(conn, models.Item.__table__, "ix_items_content_hash")
+    add_column(conn, models.Assignment.__table__.c.test_hash)
+
+
+@migration(2, "indexes for hot lookups")
+def add_lookup_indexes(conn: Connection):
+    duplicates = conn.execute(
+        select(models.Item.owner_id, models.Item.assignment_id)
+        .group_by(models.Item.owner_id, models.Item.assignment_id)
+        .having(func.count() > 1)
+    ).all()
+    if duplicates:
+        raise RuntimeError(
+            "Students with more than one item for an assignment "
+            f"(owner_id, assignment_id): {duplicates}, merge them and upgrade again"
+        )
+    create_index(conn, models.Item.__table__, "ix_items_owner_assignment")
+    create_index(conn, models.UserClassroom.__table__, "ix_user_classroom_classroom_id")
+    create_index(conn, models.User.__table__, "ix_users_role_id")
+    create_index(conn, models.Classroom.__table__, "ix_classrooms_owner_id")
+
+
+@migration(3, "full-text search index")
+def add_search_index(conn: Connection):
+    search.create_index(conn)
+
+
+@migration(4, "materialized gradebook")
+def fill_gradebook(conn: Connection):
+    with Session(bind=conn) as db:
+        gradebook.rebuild(db)
+        db.flush()
+
+
+def legacy_file(folder: Path, name: str | None) -> Path | None:
+    """Return the file of an upload from before the storage, or None."""
+    if name is None:
+        return None
+    matches = sorted(folder.glob(f"{name}.*"))
+    return matches[0] if matches else None
+
+
+@migration(5, "uploads from before the storage")
+def store_legacy_files(conn: Connection):
+    # the files stay in place, they can be removed after the upgrade
+    for table, column in (
+        (models.Item.__table__, "content_hash"),
+        (models.Assignment.__table__, "test_hash"),
+    ):
+        rows = conn.execute(
+            select(table.c.id, table.c.filename).where(table.c[column].is_(None))
+        ).all()
+        for row_id, filename in rows:
+            path = legacy_file(LEGACY_DIRS[table.name], filename)
+            if path is None:
+                continue
+            digest = storage.put_bytes(path.read_bytes())
+            conn.execute(
+                update(table).where(table.c.id == row_id).values({column: digest})
+            )
+
+
+@migration(6, "unique item version numbers")
+def add_version_number_index(conn: Connection):
+    versions = models.ItemVersion
+    duplicates = conn.execute(
+        select(versions.item_id, versions.number)
+        .group_by(versions.item_id, versions.number)
+        .having(func.count() > 1)
+    ).all()
+    if duplicates:
+        raise RuntimeError(
+            "Item versions with the same number (item_id, number): "
+            f"{duplicates}, renumber them and upgrade again"
+        )
+    create_index(conn, models.ItemVersion.__table__, "ix_item_versions_item_number")
+
+
+def create_tables(bind: Engine):
+    """Create the missing tables, again when another worker created some meanwhile."""
+    # every failed attempt means another worker created a table
+    attempts = len(models.Base.metadata.tables)
+    for attempt in range(attempts):
+        try:
+            models.Base.metadata.create_all(bind=bind)
+            return
+        except (IntegrityError, OperationalError, ProgrammingError):
+            # "table already exists"
+            if attempt == attempts - 1:
+                raise
+
+
+def applied_versions(conn: Connection) -> dict:
+    """
+    Return the migrations applied to a database.
+
+    Args:
+        conn (Connection): The database connection.
+
+    Returns:
+        dict: The names of the applied migrations by their number.
+    """
+    if not inspect(conn).has_table(models.SchemaVersion.__tablename__):
+        return {}
+    rows = conn.execute(select(models.SchemaVersion.version, models.SchemaVersion.name))
+    return dict(rows.all())
+
+
+def record_version(conn: Connection, version: int, name: str) -> bool:
+    """
+    Record a migration in schema_version, unless another worker already has.
+
+    Only a unique violation of this insert means that the migration was
+    applied elsewhere, other errors are raised.
+
+    Args:
+        conn (Connection): The connection of the transaction of the migration.
+        version (int): The number of the migration.
+        name (str): The description of the migration.
+
+    Returns:
+        bool: True if the migration was recorded now and is to be applied.
+    """
+    try:
+        conn.execute(
+            models.SchemaVersion.__table__.insert().values(version=version, name=name)
+        )
+    except IntegrityError as error:
+        if not crud.is_unique_violation(error):
+            raise
+        return False
+    return True
+
+
+def upgrade(bind: Engine = engine) -> list:
+    """
+    Create missing tables and apply the pending migrations.
+
+    Every migration runs in its own transaction, which starts by recording it in
+    schema_version. When several workers start at once only the first applies
+    a migration, the others find it recorded and skip it. Errors of the
+    migration itself are raised.
+
+    Args:
+        bind (Engine, optional): The database engine. Defaults to database.engine.
+
+    Returns:
+        list: The numbers of the migrations applied now.
+    """
+    create_tables(bind)
+    with bind.connect() as conn:
+        done = applied_versions(conn)
+    applied = []
+    for version, name, function in MIGRATIONS:
+        if version in done:
+            continue
+        with bind.begin() as conn:
+            if not record_version(conn, version, name):
+                # applied by another worker in the meantime
+                continue
+            function(conn)
+        applied.append(version)
+    return applied
+
+
+def hot_queries() -> list:
+    """
+    Return the hot lookups with the index each of them should use.
+
+    Returns:
+        list: Tuples (description, statement, index name).
+    """
+    return [
+        (
+            "item of a student for an assignment (crud.get_item_by_user_assignment)",
+            select(models.Item)
+            .where(models.Item.owner_id == 1)
+            .where(models.Item.assignment_id == 1),
+            "ix_items_owner_assignment",
+        ),
+        (
+            "items of a student (crud.get_user_item)",
+            select(models.Item).where(models.Item.owner_id == 1),
+            "ix_items_owner_assignment",
+        ),
+        (
+            "students of a class (crud.get_users_in_class)",
+            select(models.User)
+            .join(models.UserClassroom, models.User.id == models.UserClassroom.user_id)
+            .where(models.UserClassroom.classroom_id == 1),
+            "ix_user_classroom_classroom_id",
+        ),
+        (
+            "results of an assignment by mark (crud.get_assignment_results)",
+            crud.assignment_results_statement(1, 1, sort="mark"),
+            "ix_student_progress_mark",
+        ),
+        (
+            "progress of a student (crud.get_user_progress)",
+            crud.user_progress_statement(1),
+            "ix_student_progress_user",
+        ),
+        (
+            "users with a role",
+            select(models.User.id).where(models.User.role_id == 4),
+            "ix_users_role_id",
+        ),
+        (
+            "classrooms of a teacher (crud.delete_user)",
+            select(models.Classroom.id).where(models.Classroom.owner_id == 1),
+            "ix_classrooms_owner_id",
+        ),
+    ]
+
+
+def explain(conn: Connection, statement) -> str:
+    """
+    Return the query plan of a statement.
+
+    Args:
+        conn (Connection): The database connection.
+        statement: The select statement.
+
+    Returns:
+        str: The plan, one step per line.
+    """
+    sql = statement.compile(
+        dialect=conn.dialect, compile_kwargs={"literal_binds": True}
+    )
+    if is_sqlite(str(conn.engine.url)):
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+        return "\n".join(row[-1] for row in rows)
+    return "\n".join(row[0] for row in conn.execute(text(f"EXPLAIN {sql}")).all())
+
+
+def check_indexes(bind: Engine = engine) -> bool:
+    """
+    Print the query plans of the hot lookups and whether they use their index.
+
+    Postgres prefers sequential scans on small tables, check it on a database
+    with production data.
+
+    Args:
+        bind (Engine, optional): The database engine. Defaults to database.engine.
+
+    Returns:
+        bool: True if every lookup uses its index.
+    """
+    ok = True
+    with bind.connect() as conn:
+        for description, statement, index in hot_queries():
+            plan = explain(conn, statement)
+            uses_index = index in plan
+            ok = ok and uses_index
+            print(f"{'ok' if uses_index else 'NO INDEX'}  {description}, {index}")
+            print("    " + plan.replace("\n", "\n    "))
+    return ok
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if command == "upgrade":
+        applied = upgrade()
+        print(f"applied {applied}" if applied else "up to date")
+    elif command == "current":
+        with engine.connect() as conn:
+            for version, name in sorted(applied_versions(conn).items()):
+                print(version, name)
+    elif command == "explain":
+        sys.exit(0 if check_indexes() else 1)
+    else:
+        sys.exit("usage: python migrations.py [upgrade|current|explain]")
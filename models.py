@@ -1,4 +1,20 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Table
+from datetime import datetime
+
+from sqlalchemy import (
+    Boolean,
+    BigInteger,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    JSON,
+    LargeBinary,
+    String,
+    Table,
+    func,
+)
 from sqlalchemy.orm import relationship
 
 from database import Base
@@ -21,6 +37,7 @@ class User(Base):
         own_classrooms (List[Classroom]): The classrooms owned by the user.
         classrooms (List[Classroom]): The classrooms the user is enrolled in.
         is_first_login (bool): Indicates whether it is the user's first login or not.
+        role_version (int): Incremented on every role change, invalidates older tokens.
     """
 
     __tablename__ = "users"
@@ -29,7 +46,7 @@ class User(Base):
     username = Column(String, unique=True, index=True)
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
-    role_id = Column(Integer, ForeignKey("roles.id"))  # one to many
+    role_id = Column(Integer, ForeignKey("roles.id"), index=True)  # one to many
     role = relationship("Role", back_populates="users")
     is_active = Column(Boolean, default=True)
     items = relationship("Item", back_populates="owner")
@@ -43,6 +60,7 @@ class User(Base):
         cascade="all,delete",
     )  # many to many
     is_first_login = Column(Boolean, default=True)
+    role_version = Column(Integer, default=0, server_default="0")
 
 
 class Item(Base):
@@ -62,9 +80,15 @@ class Item(Base):
         owner (User): The owner of the item.
         assignment_id (int): The ID of the assignment the item belongs to.
         assignment (Assignment): The assignment the item belongs to.
+        content_hash (str): The sha256 hex digest of the uploaded file in the storage.
+        versions (List[ItemVersion]): All uploaded versions of the item.
     """
 
     __tablename__ = "items"
+    # one submission per student and assignment, also serves lookups by owner
+    __table_args__ = (
+        Index("ix_items_owner_assignment", "owner_id", "assignment_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     filename = Column(String, index=True, unique=True, default=None)
@@ -80,6 +104,194 @@ class Item(Base):
         Integer, ForeignKey("assignments.id"), default=None, index=True
     )
     assignment = relationship("Assignment", back_populates="items")
+    content_hash = Column(String(64), index=True, default=None)
+    versions = relationship(
+        "ItemVersion",
+        back_populates="item",
+        order_by="ItemVersion.number",
+        passive_deletes=True,
+    )
+
+
+class ItemVersion(Base):
+    """
+    Represents one uploaded version of an item.
+
+    Keyframe versions store the whole compressed file, the others store a delta
+    against the previous version (see versions.py).
+
+    Attributes:
+        id (int): The unique identifier of the version.
+        item_id (int): The ID of the item the version belongs to.
+        item (Item): The item the version belongs to.
+        number (int): The number of the version within the item, starting at 1.
+        content_hash (str): The sha256 hex digest of the file.
+        size (int): The size of the file in bytes.
+        data (bytes): The compressed file or the delta.
+        created_at (datetime): The time of the upload.
+        tested (bool): Indicates whether the version has been tested.
+        passed (bool): Indicates whether the version has passed the test.
+        mark (int): The mark assigned to the version.
+        pass_point (int): The pass point for the version.
+        fail_point (int): The fail point for the version.
+    """
+
+    __tablename__ = "item_versions"
+    __table_args__ = (
+        Index("ix_item_versions_item_number", "item_id", "number", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    item_id = Column(Integer, ForeignKey("items.id", ondelete="CASCADE"), index=True)
+    item = relationship("Item", back_populates="versions")
+    number = Column(Integer)
+    content_hash = Column(String(64))
+    size = Column(Integer)
+    data = Column(LargeBinary)
+    created_at = Column(DateTime, server_default=func.now())
+    tested = Column(Boolean, default=False)
+    passed = Column(Boolean, default=False)
+    mark = Column(Integer, default=None)
+    pass_point = Column(Integer, default=None)
+    fail_point = Column(Integer, default=None)
+
+
+class TestResult(Base):
+    """
+    Represents the outcome of one test in the latest run of an item.
+
+    Attributes:
+        id (int): The unique identifier of the result.
+        item_id (int): The ID of the tested item.
+        assignment_id (int): The ID of the assignment of the item.
+        test_id (str): The name of the test function.
+        outcome (str): The pytest outcome, e.g. passed or failed.
+        duration (float): The duration of the test in seconds.
+        points (int): The number of points of the test.
+        message (str): The truncated error message of a failed test.
+    """
+
+    __tablename__ = "test_results"
+    __table_args__ = (
+        Index("ix_test_results_lookup", "assignment_id", "test_id", "outcome"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    item_id = Column(Integer, ForeignKey("items.id", ondelete="CASCADE"), index=True)
+    assignment_id = Column(Integer, ForeignKey("assignments.id", ondelete="CASCADE"))
+    test_id = Column(String)
+    outcome = Column(String(16))
+    duration = Column(Float, default=0)
+    points = Column(Integer, default=0)
+    message = Column(String, default=None)
+
+
+class ReportArchiveEntry(Base):
+    """
+    Represents the position of one pytest report in the packed archive of an assignment.
+
+    Attributes:
+        id (int): The unique identifier of the entry.
+        assignment_id (int): The ID of the assignment.
+        user_id (int): The ID of the student.
+        offset (int): The offset of the compressed report in the archive.
+        length (int): The length of the compressed report.
+        size (int): The size of the uncompressed report.
+        created_at (datetime): The time the report was archived.
+    """
+
+    __tablename__ = "report_archive"
+    __table_args__ = (Index("ix_report_archive_lookup", "assignment_id", "user_id"),)
+
+    id = Column(Integer, primary_key=True)
+    assignment_id = Column(Integer, ForeignKey("assignments.id", ondelete="CASCADE"))
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    offset = Column(BigInteger)
+    length = Column(Integer)
+    size = Column(Integer)
+    created_at = Column(DateTime, server_default=func.now())
+
+
+class SubmissionSignature(Base):
+    """
+    Represents the MinHash signature of the current file of an item.
+
+    Attributes:
+        item_id (int): The ID of the item.
+        assignment_id (int): The ID of the assignment the item belongs to.
+        content_hash (str): The sha256 hex digest of the signed file.
+        signature (bytes): The packed MinHash signature (see similarity.py).
+    """
+
+    __tablename__ = "submission_signatures"
+
+    item_id = Column(
+        Integer, ForeignKey("items.id", ondelete="CASCADE"), primary_key=True
+    )
+    assignment_id = Column(
+        Integer, ForeignKey("assignments.id", ondelete="CASCADE"), index=True
+    )
+    content_hash = Column(String(64))
+    signature = Column(LargeBinary)
+
+
+class LshBucket(Base):
+    """
+    Represents one band of a submission signature in the LSH index of an assignment.
+
+    Attributes:
+        assignment_id (int): The ID of the assignment.
+        band (int): The number of the band.
+        bucket (int): The hash of the band values.
+        item_id (int): The ID of the item.
+    """
+
+    __tablename__ = "lsh_buckets"
+    __table_args__ = (
+        Index("ix_lsh_buckets_lookup", "assignment_id", "band", "bucket"),
+    )
+
+    assignment_id = Column(
+        Integer, ForeignKey("assignments.id", ondelete="CASCADE"), primary_key=True
+    )
+    band = Column(Integer, primary_key=True)
+    bucket = Column(BigInteger)
+    item_id = Column(
+        Integer,
+        ForeignKey("items.id", ondelete="CASCADE"),
+        primary_key=True,
+        index=True,
+    )
+
+
+class RefreshToken(Base):
+    """
+    Represents a refresh token, only the sha256 of the token is stored.
+
+    Every use of a refresh token revokes it and issues a new one in the same
+    family. A revoked token used again revokes the whole family.
+
+    Attributes:
+        id (int): The unique identifier of the token.
+        user_id (int): The ID of the user.
+        user (User): The user.
+        token_hash (str): The sha256 hex digest of the token.
+        family (str): The ID shared by all tokens rotated from one login.
+        expires_at (datetime): The expiration time in UTC.
+        revoked_at (datetime): The time the token was used or revoked, None if valid.
+        created_at (datetime): The time the token was issued.
+    """
+
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    user = relationship("User")
+    token_hash = Column(String(64), unique=True, index=True)
+    family = Column(String(32), index=True)
+    expires_at = Column(DateTime, index=True)
+    revoked_at = Column(DateTime, default=None)
+    created_at = Column(DateTime, server_default=func.now())
 
 
 class Assignment(Base):
@@ -97,6 +309,7 @@ class Assignment(Base):
         items (List[Item]): The items associated with the assignment.
         classroom_id (int): The ID of the classroom the assignment belongs to.
         classroom (Classroom): The classroom the assignment belongs to.
+        test_hash (str): The sha256 hex digest of the test file in the storage.
     """
 
     __tablename__ = "assignments"
@@ -106,13 +319,45 @@ class Assignment(Base):
     filename = Column(String, index=True, default=None)
     description = Column(String, default=None)
     github_url = Column(String, default=None)
-    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"))
     owner = relationship("User", back_populates="own_assignments")
     items = relationship("Item", back_populates="assignment")
     classroom_id = Column(
         Integer, ForeignKey("classrooms.id", ondelete="CASCADE"), index=True
     )
     classroom = relationship("Classroom", back_populates="assignments")
+    test_hash = Column(String(64), default=None)
+
+
+class GradingPolicy(Base):
+    """
+    Represents the grading policy of an assignment.
+
+    The policy is applied to the stored per-test results (see grading.py), so
+    changing it re-marks the submissions without running the tests again.
+
+    Attributes:
+        assignment_id (int): The ID of the assignment.
+        weights (dict): The weight of each test by its name, other tests are
+            weighted by the points in their name.
+        pass_threshold (float): The minimal mark to pass.
+        letter_scale (dict): The minimal mark of each letter.
+        deadline (datetime): The deadline of the assignment in UTC.
+        late_penalty (float): The mark deducted for each started day after the deadline.
+        max_late_penalty (float): The maximal deducted mark.
+    """
+
+    __tablename__ = "grading_policies"
+
+    assignment_id = Column(
+        Integer, ForeignKey("assignments.id", ondelete="CASCADE"), primary_key=True
+    )
+    weights = Column(JSON, default=dict)
+    pass_threshold = Column(Float, default=50)
+    letter_scale = Column(JSON, default=None)
+    deadline = Column(DateTime, default=None)
+    late_penalty = Column(Float, default=0)
+    max_late_penalty = Column(Float, default=100)
 
 
 class Classroom(Base):
@@ -136,7 +381,7 @@ class Classroom(Base):
     name = Column(String, index=True, default=None)
     description = Column(String, default=None)
     year = Column(Integer, default=None)
-    owner_id = Column(Integer, ForeignKey("users.id"))
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
     owner = relationship("User", back_populates="own_classrooms")
     assignments = relationship(
         "Assignment", back_populates="classroom", passive_deletes=True
@@ -164,8 +409,111 @@ class UserClassroom(Base):
         Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
     )
     classroom_id = Column(
-        Integer, ForeignKey("classrooms.id", ondelete="CASCADE"), primary_key=True
+        Integer,
+        ForeignKey("classrooms.id", ondelete="CASCADE"),
+        primary_key=True,
+        index=True,
+    )
+
+
+class StudentProgress(Base):
+    """
+    Represents the status of a student in an assignment, kept by gradebook.sync.
+
+    There is a row for every student enrolled in the class of the assignment,
+    also when nothing was turned in yet.
+
+    Attributes:
+        assignment_id (int): The ID of the assignment.
+        user_id (int): The ID of the student.
+        classroom_id (int): The ID of the class of the assignment.
+        item_id (int): The ID of the submission, None if nothing was turned in.
+        status (int): 0 not tested yet, 1 tested and failed, 2 passed.
+        mark (int): The mark of the submission, 0 if there is none.
+    """
+
+    __tablename__ = "student_progress"
+    __table_args__ = (
+        Index("ix_student_progress_user", "user_id", "classroom_id"),
+        # result pages of an assignment sorted by mark or status
+        Index("ix_student_progress_mark", "assignment_id", "mark", "user_id"),
+        Index("ix_student_progress_status", "assignment_id", "status", "user_id"),
+    )
+
+    assignment_id = Column(
+        Integer, ForeignKey("assignments.id", ondelete="CASCADE"), primary_key=True
     )
+    user_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    classroom_id = Column(Integer)
+    item_id = Column(Integer, default=None)
+    status = Column(Integer, default=0)
+    mark = Column(Integer, default=0)
+
+
+class AssignmentStats(Base):
+    """
+    Represents the aggregated results of an assignment, kept by gradebook.sync.
+
+    Attributes:
+        assignment_id (int): The ID of the assignment.
+        enrolled (int): The number of students in the class.
+        submitted (int): The number of students who turned something in.
+        tested (int): The number of tested submissions.
+        passed (int): The number of passed submissions.
+        mean_mark (float): The mean mark of the tested submissions.
+        median_mark (float): The median mark of the tested submissions.
+    """
+
+    __tablename__ = "assignment_stats"
+
+    assignment_id = Column(
+        Integer, ForeignKey("assignments.id", ondelete="CASCADE"), primary_key=True
+    )
+    enrolled = Column(Integer, default=0)
+    submitted = Column(Integer, default=0)
+    tested = Column(Integer, default=0)
+    passed = Column(Integer, default=0)
+    mean_mark = Column(Float, default=None)
+    median_mark = Column(Float, default=None)
+
+
+class OutboxEmail(Base):
+    """
+    Represents an email queued for the background sender of mailer.
+
+    Attributes:
+        id (int): The unique identifier of the email.
+        recipient (str): The address of the recipient.
+        subject (str): The subject.
+        template (str): The file name of the HTML template in templates.
+        template_body (dict): The template variables, cleared once the email is
+            sent or given up.
+        status (str): "pending", "sent" or "failed".
+        attempts (int): The number of failed delivery attempts.
+        next_attempt_at (datetime): The email is not sent before this time in UTC.
+        locked_until (datetime): A sender has claimed the email until this time in UTC.
+        last_error (str): The error of the last failed attempt.
+        sent_at (datetime): The time the email was delivered to the SMTP server.
+        created_at (datetime): The time the email was queued.
+    """
+
+    __tablename__ = "outbox"
+    __table_args__ = (Index("ix_outbox_due", "status", "next_attempt_at"),)
+
+    id = Column(Integer, primary_key=True)
+    recipient = Column(String)
+    subject = Column(String)
+    template = Column(String)
+    template_body = Column(JSON(none_as_null=True), default=None)
+    status = Column(String(16), default="pending")
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    locked_until = Column(DateTime, default=None)
+    last_error = Column(String, default=None)
+    sent_at = Column(DateTime, default=None)
+    created_at = Column(DateTime, server_default=func.now())
 
 
 class Role(Base):
@@ -188,3 +536,20 @@ class Role(Base):
     users = relationship(
         "User", back_populates="role", passive_deletes=True
     )  # one to many
+
+
+class SchemaVersion(Base):
+    """
+    Represents a migration applied to the database, see migrations.py.
+
+    Attributes:
+        version (int): The number of the migration.
+        name (str): The description of the migration.
+        applied_at (datetime): When the migration was applied.
+    """
+
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String)
+    applied_at = Column(DateTime, server_default=func.now())
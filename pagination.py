@@ -0,0 +1,44 @@
+import base64
+import json
+
+from fastapi import HTTPException
+
+
+def encode_cursor(values: list) -> str:
+    """
+    Encode the sort key of the last row of a page as an opaque cursor.
+
+    Args:
+        values (list): The sort key values, the last one is the unique ID.
+
+    Returns:
+        str: The URL safe cursor.
+    """
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str, types: tuple) -> list:
+    """
+    Decode a cursor from encode_cursor.
+
+    Args:
+        cursor (str): The cursor.
+        types (tuple): The expected type of each sort key value, e.g. (str, int).
+
+    Returns:
+        list: The sort key values.
+
+    Raises:
+        HTTPException: If the cursor is not valid.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(types):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    for value, expected in zip(values, types):
+        # bool is an int subclass, but no sort key is a boolean
+        if isinstance(value, bool) or not isinstance(value, expected):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
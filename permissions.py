@@ -0,0 +1,38 @@
+from enum import IntFlag
+
+
+class Permission(IntFlag):
+    """
+    Permissions of a user as a bitmask, resolved from the role once at login.
+
+    The bitmask is stored in the "perm" claim of the access token, so checking
+    it does not need the database.
+    """
+
+    NONE = 0
+    TEACHER = 1
+    SUPER_TEACHER = 2
+    ADMIN = 4
+
+
+TEACHER_PLUS = Permission.TEACHER | Permission.SUPER_TEACHER | Permission.ADMIN
+SUPER_TEACHER_PLUS = Permission.SUPER_TEACHER | Permission.ADMIN
+
+ROLE_PERMISSIONS = {
+    "Teacher": Permission.TEACHER,
+    "Super teacher": Permission.SUPER_TEACHER,
+    "Admin": Permission.ADMIN,
+}
+
+
+def for_role(role_name: str | None) -> Permission:
+    """
+    Return the permissions of a role.
+
+    Args:
+        role_name (str): The name of the role.
+
+    Returns:
+        Permission: The permissions, Permission.NONE for students and unknown roles.
+    """
+    return ROLE_PERMISSIONS.get(role_name, Permission.NONE)
@@ -0,0 +1,309 @@
+import os
+import re
+import sys
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import models
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+load_dotenv()
+
+ARCHIVE_DIR = Path(
+    os.getenv("REPORT_ARCHIVE_DIR", Path(__file__).parent / "HW" / "archive")
+)
+# only the latest REPORT_KEEP_PER_STUDENT reports of each student are kept,
+# older ones are dropped when a new one is archived
+REPORT_KEEP_PER_STUDENT = int(os.getenv("REPORT_KEEP_PER_STUDENT", 3))
+# apply_retention also drops reports older than REPORT_RETENTION_DAYS, except
+# the latest report of each student
+REPORT_RETENTION_DAYS = int(os.getenv("REPORT_RETENTION_DAYS", 180))
+# an archive is compacted when it is this many times the size of its kept reports
+REPORT_COMPACT_RATIO = float(os.getenv("REPORT_COMPACT_RATIO", 2))
+CHUNK_SIZE = 64 * 1024
+# reports written next to the submissions before the archive, see import_reports
+LEGACY_REPORT_DIR = Path(__file__).parent / "HW"
+re_legacy_report = re.compile(r"HW_(\d+)_(\d+)_report\.json")
+
+
+def pack_path(assignment_id: int) -> Path:
+    """Return the path of the packed archive of an assignment."""
+    return ARCHIVE_DIR / f"reports_{assignment_id}.pack"
+
+
+def _lock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def locked_pack(assignment_id: int, mode: str):
+    """
+    Open the archive of an assignment with an exclusive lock shared by all workers.
+
+    Compaction replaces the pack file, so a file that was replaced while
+    waiting for the lock is reopened.
+
+    Args:
+        assignment_id (int): The ID of the assignment.
+        mode (str): The mode to open the file in.
+    """
+    path = pack_path(assignment_id)
+    while True:
+        with open(path, mode) as f:
+            _lock(f)
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                    yield f
+                    return
+            finally:
+                _unlock(f)
+
+
+def archive_report(
+    db: Session,
+    path: str,
+    assignment_id: int,
+    user_id: int,
+    created_at: datetime | None = None,
+):
+    """
+    Move a pytest report into the packed archive of its assignment.
+
+    The report is compressed chunk by chunk straight into the archive as one
+    zlib frame, its offset is recorded in the report_archive table and the
+    report file is deleted. The reports of the student beyond the latest
+    REPORT_KEEP_PER_STUDENT are dropped, and the archive is compacted once
+    the dropped frames make up most of it.
+
+    Args:
+        db (Session): The database session.
+        path (str): The path of the report.
+        assignment_id (int): The ID of the assignment.
+        user_id (int): The ID of the student.
+        created_at (datetime, optional): The time of the report. Defaults to now.
+
+    Returns:
+        ReportArchiveEntry: The index entry of the archived report.
+    """
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    with locked_pack(assignment_id, "ab") as f, open(path, "rb") as report:
+        f.seek(0, os.SEEK_END)
+        offset = f.tell()
+        compressor = zlib.compressobj(9)
+        size = 0
+        while chunk := report.read(CHUNK_SIZE):
+            size += len(chunk)
+            f.write(compressor.compress(chunk))
+        f.write(compressor.flush())
+        f.flush()
+        entry = models.ReportArchiveEntry(
+            assignment_id=assignment_id,
+            user_id=user_id,
+            offset=offset,
+            length=f.tell() - offset,
+            size=size,
+        )
+        if created_at is not None:
+            entry.created_at = created_at
+        db.add(entry)
+        db.flush()
+        superseded = (
+            db.query(models.ReportArchiveEntry)
+            .filter(models.ReportArchiveEntry.assignment_id == assignment_id)
+            .filter(models.ReportArchiveEntry.user_id == user_id)
+            .order_by(models.ReportArchiveEntry.id.desc())
+            .offset(REPORT_KEEP_PER_STUDENT)
+            .all()
+        )
+        for old in superseded:
+            db.delete(old)
+        db.commit()
+        pack_size = f.tell()
+    os.remove(path)
+    kept_size = (
+        db.query(func.sum(models.ReportArchiveEntry.length))
+        .filter(models.ReportArchiveEntry.assignment_id == assignment_id)
+        .scalar()
+    )
+    if pack_size > REPORT_COMPACT_RATIO * (kept_size or 0):
+        compact(db, assignment_id)
+    db.refresh(entry)
+    return entry
+
+
+def read_report(db: Session, assignment_id: int, user_id: int) -> bytes | None:
+    """
+    Read the latest archived report of a student.
+
+    Args:
+        db (Session): The database session.
+        assignment_id (int): The ID of the assignment.
+        user_id (int): The ID of the student.
+
+    Returns:
+        bytes: The JSON report, or None if there is none.
+    """
+    if not pack_path(assignment_id).exists():
+        return None
+    with locked_pack(assignment_id, "rb") as f:
+        entry = (
+            db.query(models.ReportArchiveEntry)
+            .filter(models.ReportArchiveEntry.assignment_id == assignment_id)
+            .filter(models.ReportArchiveEntry.user_id == user_id)
+            .order_by(models.ReportArchiveEntry.id.desc())
+            .first()
+        )
+        if entry is None:
+            return None
+        f.seek(entry.offset)
+        return zlib.decompress(f.read(entry.length))
+
+
+def _rewrite(db: Session, f, assignment_id: int, kept: list, dropped: list):
+    """
+    Copy the kept frames of a locked archive into a new pack file replacing it.
+
+    The offsets of the kept reports are updated and the dropped reports are
+    deleted in the same transaction.
+    """
+    path = pack_path(assignment_id)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as new:
+        for entry in sorted(kept, key=lambda entry: entry.offset):
+            f.seek(entry.offset)
+            entry.offset = new.tell()
+            new.write(f.read(entry.length))
+    for entry in dropped:
+        db.delete(entry)
+    os.replace(tmp_path, path)
+    db.commit()
+
+
+def compact(db: Session, assignment_id: int):
+    """
+    Remove the frames of dropped reports from the archive of an assignment.
+
+    Args:
+        db (Session): The database session.
+        assignment_id (int): The ID of the assignment.
+    """
+    with locked_pack(assignment_id, "r+b") as f:
+        entries = (
+            db.query(models.ReportArchiveEntry)
+            .filter(models.ReportArchiveEntry.assignment_id == assignment_id)
+            .all()
+        )
+        _rewrite(db, f, assignment_id, entries, [])
+
+
+def apply_retention(db: Session, assignment_id: int, now: datetime | None = None):
+    """
+    Drop expired reports of an assignment and compact its archive.
+
+    Reports older than REPORT_RETENTION_DAYS are dropped, except the latest
+    report of each student, which the report page shows.
+
+    Args:
+        db (Session): The database session.
+        assignment_id (int): The ID of the assignment.
+        now (datetime, optional): The current time. Defaults to datetime.utcnow().
+
+    Returns:
+        int: The number of dropped reports.
+    """
+    path = pack_path(assignment_id)
+    if not path.exists():
+        return 0
+    cutoff = (now or datetime.utcnow()) - timedelta(days=REPORT_RETENTION_DAYS)
+    with locked_pack(assignment_id, "r+b") as f:
+        entries = (
+            db.query(models.ReportArchiveEntry)
+            .filter(models.ReportArchiveEntry.assignment_id == assignment_id)
+            .order_by(
+                models.ReportArchiveEntry.user_id,
+                models.ReportArchiveEntry.id.desc(),
+            )
+            .all()
+        )
+        kept, dropped = [], []
+        rank, user_id = 0, None
+        for entry in entries:
+            rank = rank + 1 if entry.user_id == user_id else 1
+            user_id = entry.user_id
+            if rank == 1 or entry.created_at >= cutoff:
+                kept.append(entry)
+            else:
+                dropped.append(entry)
+        if not dropped:
+            return 0
+        _rewrite(db, f, assignment_id, kept, dropped)
+    return len(dropped)
+
+
+def import_reports(db: Session, folder: Path = LEGACY_REPORT_DIR) -> int:
+    """
+    Move the reports written next to the submissions before the archive into it.
+
+    Reports of deleted assignments or students are left in place. Run it once
+    after upgrading, while no tests are running.
+
+    Args:
+        db (Session): The database session.
+        folder (Path, optional): The folder of the reports. Defaults to LEGACY_REPORT_DIR.
+
+    Returns:
+        int: The number of archived reports.
+    """
+    imported = 0
+    for path in sorted(folder.glob("HW_*_report.json"), key=os.path.getmtime):
+        match = re_legacy_report.fullmatch(path.name)
+        if match is None:
+            continue
+        assignment_id, user_id = int(match[1]), int(match[2])
+        if (
+            db.get(models.Assignment, assignment_id) is None
+            or db.get(models.User, user_id) is None
+        ):
+            continue
+        created_at = datetime.utcfromtimestamp(path.stat().st_mtime)
+        archive_report(db, str(path), assignment_id, user_id, created_at)
+        imported += 1
+    return imported
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    db = SessionLocal()
+    if sys.argv[1:] == ["import"]:
+        print(f"{import_reports(db)} reports archived")
+    else:
+        for (assignment_id,) in db.query(
+            models.ReportArchiveEntry.assignment_id
+        ).distinct():
+            dropped = apply_retention(db, assignment_id)
+            print(f"assignment {assignment_id}: {dropped} dropped")
+    db.close()
@@ -0,0 +1,250 @@
+import io
+import re
+
+CHUNK_SIZE = 64 * 1024
+# longest string kept from the report, the rest of a longer string is skipped
+STRING_LIMIT = 1000
+
+# parts of a pytest-json-report test entry that are kept, everything else
+# (longrepr, tracebacks, captured stdout/stderr and logs, ...) is skipped
+# without being read into memory
+STAGE_FIELDS = {"duration": True, "outcome": True, "crash": {"message": True}}
+TEST_FIELDS = {
+    "nodeid": True,
+    "outcome": True,
+    "setup": STAGE_FIELDS,
+    "call": STAGE_FIELDS,
+    "teardown": STAGE_FIELDS,
+}
+
+_STRING_PART = re.compile(r'[^"\\]*')
+_SCALAR_PART = re.compile(r"[-+.eE0-9a-z]*")
+_WHITESPACE = " \t\r\n"
+_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+
+class ReportParser:
+    """
+    Incremental JSON parser that reads a report in chunks and keeps only selected fields.
+
+    Strings are cut to STRING_LIMIT characters and unselected values are
+    skipped, so memory does not depend on the size of the report.
+
+    Attributes:
+        file: The report opened in text mode.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.buffer = ""
+        self.position = 0
+
+    def _fill(self) -> bool:
+        if self.position < len(self.buffer):
+            return True
+        self.buffer = self.file.read(CHUNK_SIZE)
+        self.position = 0
+        return bool(self.buffer)
+
+    def _peek(self) -> str:
+        while self._fill():
+            char = self.buffer[self.position]
+            if char not in _WHITESPACE:
+                return char
+            self.position += 1
+        raise ValueError("Unexpected end of report")
+
+    def _expect(self, char: str):
+        if self._peek() != char:
+            raise ValueError(f"Expected {char!r} in report")
+        self.position += 1
+
+    def _read_char(self) -> str:
+        if not self._fill():
+            raise ValueError("Unexpected end of report")
+        char = self.buffer[self.position]
+        self.position += 1
+        return char
+
+    def _string(self, limit: int) -> str:
+        self._expect('"')
+        parts, kept = [], 0
+        while True:
+            if not self._fill():
+                raise ValueError("Unexpected end of report")
+            match = _STRING_PART.match(self.buffer, self.position)
+            if kept < limit:
+                parts.append(match.group()[: limit - kept])
+                kept += len(parts[-1])
+            self.position = match.end()
+            if self.position == len(self.buffer):
+                continue
+            char = self._read_char()
+            if char == '"':
+                break
+            escape = self._read_char()
+            if escape == "u":
+                char = chr(int("".join(self._read_char() for _ in range(4)), 16))
+            else:
+                char = _ESCAPES.get(escape, escape)
+            if kept < limit:
+                parts.append(char)
+                kept += 1
+        return (
+            "".join(parts).encode("utf-16", "surrogatepass").decode("utf-16", "replace")
+        )
+
+    def _scalar(self):
+        parts = []
+        while self._fill():
+            match = _SCALAR_PART.match(self.buffer, self.position)
+            parts.append(match.group())
+            self.position = match.end()
+            if self.position < len(self.buffer):
+                break
+        token = "".join(parts)
+        if token in ("true", "false", "null"):
+            return {"true": True, "false": False, "null": None}[token]
+        return float(token) if any(c in token for c in ".eE") else int(token)
+
+    def _items(self):
+        """Yield the items of an array one by one, the parser stays at each item."""
+        self._expect("[")
+        if self._peek() == "]":
+            self.position += 1
+            return
+        while True:
+            yield
+            char = self._peek()
+            self.position += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError("Expected ',' in report array")
+
+    def _keys(self):
+        """Yield the keys of an object one by one, the parser stays at each value."""
+        self._expect("{")
+        if self._peek() == "}":
+            self.position += 1
+            return
+        while True:
+            key = self._string(STRING_LIMIT)
+            self._expect(":")
+            yield key
+            char = self._peek()
+            self.position += 1
+            if char == "}":
+                return
+            if char != ",":
+                raise ValueError("Expected ',' in report object")
+
+    def value(self, fields=True):
+        """
+        Parse the next value, keeping only the selected fields.
+
+        Args:
+            fields: True to keep a scalar value, a dict of selected keys of an
+                object, or None to skip the value.
+
+        Returns:
+            The parsed value, or None for skipped values.
+        """
+        char = self._peek()
+        if char == '"':
+            return self._string(STRING_LIMIT if fields is not None else 0)
+        if char == "{":
+            result = {}
+            for key in self._keys():
+                selected = fields.get(key) if isinstance(fields, dict) else None
+                value = self.value(selected)
+                if selected is not None:
+                    result[key] = value
+            return result if isinstance(fields, dict) else None
+        if char == "[":
+            for _ in self._items():
+                self.value(None)
+            return None
+        value = self._scalar()
+        return value if fields is not None else None
+
+    def tests(self):
+        """
+        Yield the tests of a pytest-json-report report one by one.
+
+        Yields:
+            dict: The nodeid, outcome and setup/call/teardown duration and crash
+                message of a test.
+        """
+        for key in self._keys():
+            if key != "tests":
+                self.value(None)
+                continue
+            for _ in self._items():
+                yield self.value(TEST_FIELDS)
+
+
+def iter_tests(path: str):
+    """
+    Yield the tests of a pytest JSON report without loading the whole report.
+
+    Args:
+        path (str): The path of the report.
+
+    Yields:
+        dict: The kept fields of each test.
+    """
+    with open(path, encoding="utf-8", errors="replace") as f:
+        yield from ReportParser(f).tests()
+
+
+class _TeeReader(io.RawIOBase):
+    """Binary stream that writes everything read from source to copy."""
+
+    def __init__(self, source, copy):
+        self.source = source
+        self.copy = copy
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.source.read(len(buffer))
+        self.copy.write(data)
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def copy_tests(source, path: str) -> list:
+    """
+    Parse a report from a binary stream while writing it to a file.
+
+    The report is read once in CHUNK_SIZE chunks, so it is never held in
+    memory as a whole.
+
+    Args:
+        source: The report as a binary stream, e.g. a member of a tar stream.
+        path (str): The file the report is written to.
+
+    Returns:
+        list: The kept fields of each test.
+    """
+    with open(path, "wb") as copy:
+        tee = _TeeReader(source, copy)
+        text = io.TextIOWrapper(
+            io.BufferedReader(tee, CHUNK_SIZE), encoding="utf-8", errors="replace"
+        )
+        tests = list(ReportParser(text).tests())
+        # the parser stops after the tests, the rest of the report is copied as is
+        while chunk := source.read(CHUNK_SIZE):
+            copy.write(chunk)
+    return tests
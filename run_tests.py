@@ -1,59 +1,70 @@
 import io
 import tarfile
-import json
 import os
 import docker
 import re
 
+import grading
+from report_parser import copy_tests
+from storage import storage
+
 re_points = re.compile(r"_\d+")
 re_numeric = re.compile(r"\d+")
 
+# longest error message stored per test in the results table
+MESSAGE_LIMIT = 500
+# total length of the error messages returned from one run
+TOTAL_MESSAGE_LIMIT = 10000
+
 
-def run_tests(test_n: int, user: int):
+def report_path(test_n: int, user: int) -> str:
     """
-    Run tests for a specific homework assignment.
+    Return the path of the pytest report of the latest run until it is archived.
 
     Args:
         test_n (int): The test number.
         user (int): The user ID.
 
     Returns:
-        dict: A dictionary containing the test results.
+        str: The path of the JSON report.
+    """
+    return os.path.join("./HW", f"HW_{test_n}_{user}_report.json")
 
-    Raises:
-        FileNotFoundError: If the homework file or test file does not exist.
 
+def run_tests(test_n: int, user: int, hw_hash: str, test_hash: str):
     """
-    # Rest of the code...
-
+    Run tests for a specific homework assignment.
 
-def run_tests(test_n: int, user: int):
+    Args:
+        test_n (int): The test number.
+        user (int): The user ID.
+        hw_hash (str): The storage digest of the homework file.
+        test_hash (str): The storage digest of the test file.
 
-    HW_folder = "./HW"
+    Returns:
+        dict: A dictionary containing the test results.
+    """
     json_filename = f"HW_{test_n}_{user}_report.json"
-    json_filename_with_path = os.path.join(HW_folder, json_filename)
-    hw_filename = f"HW_{test_n}_{user}.py"
-    hw_filename_with_path = os.path.join(HW_folder, hw_filename)
-    test_filename = f"test_HW_{test_n}.py"
-    test_filename_with_path = os.path.join("TESTS", test_filename)
+    json_filename_with_path = report_path(test_n, user)
+    os.makedirs(os.path.dirname(json_filename_with_path), exist_ok=True)
+    tests = []
 
-    if not os.path.isfile(hw_filename_with_path):
-        print(f"File {hw_filename_with_path} does not exist")
+    if hw_hash is None or not storage.exists(hw_hash):
+        print(f"Homework of user {user} for assignment {test_n} does not exist")
 
-    elif not os.path.isfile(test_filename_with_path):
-        print(f"File {test_filename_with_path} does not exist")
+    elif test_hash is None or not storage.exists(test_hash):
+        print(f"Test file of assignment {test_n} does not exist")
 
     else:
-        create_and_run_container(
-            test_filename_with_path, hw_filename_with_path, json_filename, []
+        tests = create_and_run_container(
+            storage.get_bytes(test_hash),
+            storage.get_bytes(hw_hash),
+            json_filename,
+            [],
+            json_filename_with_path,
         )
 
-    os.replace(json_filename, json_filename_with_path)
-
-    with open(json_filename_with_path) as f:
-        report_data = json.load(f)
-
-    results = how_did_we_do(report_data["tests"], False)
+    results = how_did_we_do(tests, False)
 
     return results
 
@@ -124,18 +135,7 @@ def mark_test(pass_points, fail_points, letter_grade=False):
     else:
         grade = pass_points / (pass_points + fail_points)
         if letter_grade:
-            if grade >= 0.9:
-                return "A"
-            elif grade >= 0.8:
-                return "B"
-            elif grade >= 0.7:
-                return "C"
-            elif grade >= 0.6:
-                return "D"
-            elif grade >= 0.51:
-                return "E"
-            else:
-                return "F"
+            return grading.letter(grade * 100)
         else:
             return round(grade * 100, 2)
 
@@ -153,15 +153,49 @@ def get_test_points(tests):
 
     pass_points, fail_points = 0, 0
     error_messages = []
+    messages_length = 0
     for test in tests:
         pass_point, fail_point, error_message = get_points_from_test(test)
         pass_points += pass_point
         fail_points += fail_point
         if error_message != "":
-            error_messages.append(error_message)
+            if messages_length + len(error_message) <= TOTAL_MESSAGE_LIMIT:
+                error_messages.append(error_message)
+            elif messages_length <= TOTAL_MESSAGE_LIMIT:
+                error_messages.append("More errors were left out.")
+            messages_length += len(error_message)
     return pass_points, fail_points, error_messages
 
 
+def get_test_results(tests):
+    """
+    Extract the outcome of each test for the results table.
+
+    Args:
+        tests (list): A list of test dictionaries.
+
+    Returns:
+        list: Dictionaries with test_id, outcome, duration, points and message.
+    """
+    results = []
+    for test in tests:
+        points = re_points.findall(test["nodeid"])
+        stages = [
+            test[stage] for stage in ("setup", "call", "teardown") if stage in test
+        ]
+        messages = [stage["crash"]["message"] for stage in stages if "crash" in stage]
+        results.append(
+            {
+                "test_id": test["nodeid"].split("::")[-1],
+                "outcome": test["outcome"],
+                "duration": sum(stage.get("duration", 0) for stage in stages),
+                "points": int(re_numeric.findall(points[-1])[0]) if points else 0,
+                "message": messages[0][:MESSAGE_LIMIT] if messages else None,
+            }
+        )
+    return results
+
+
 def how_did_we_do(tests, print_to_terminal: bool):
     """
     Calculate the mark, pass points, and failed points from a list of tests.
@@ -171,7 +205,7 @@ def how_did_we_do(tests, print_to_terminal: bool):
         print_to_terminal (bool): Whether to print the summary to the terminal.
 
     Returns:
-        dict: A dictionary containing the mark, pass points, and failed points.
+        dict: A dictionary containing the mark, pass points, failed points and per-test results.
     """
 
     pass_points, fail_points, error_message = get_test_points(tests)
@@ -188,20 +222,29 @@ def how_did_we_do(tests, print_to_terminal: bool):
         "pass_points": pass_points,
         "failed_points": fail_points,
         "error_message": error_message,
+        "tests": get_test_results(tests),
     }
 
 
 def create_and_run_container(
-    test_file: str, HW_file: str, json_filename: str, packages_to_install: list
-):
+    test_file: bytes,
+    HW_file: bytes,
+    json_filename: str,
+    packages_to_install: list,
+    report_file: str,
+) -> list:
     """
     Create a Docker container and run the tests inside it.
 
     Args:
-        test_file (str): path to the test file
-        HW_file (str): path to the HW file
+        test_file (bytes): content of the test file
+        HW_file (bytes): content of the HW file
         json_filename (str): json file name
         packages_to_install (list): list of packages to install
+        report_file (str): path the report is saved to
+
+    Returns:
+        list: the tests of the report, empty if the tests could not be run
     """
 
     client = docker.from_env()
@@ -222,10 +265,6 @@ def create_and_run_container(
         container.put_archive("/", create_tar(test_file, 0))
         container.put_archive("/", create_tar(HW_file, 1))
 
-        # Get file name from the path
-        test_file = test_file.split("\\")[-1]
-        HW_file = HW_file.split("\\")[-1]
-
         # Start the container
         container.start()
 
@@ -239,40 +278,80 @@ def create_and_run_container(
 
         # Execute the Python file inside the container
 
+        # leave captured output, logs and tracebacks out of the report
         container.exec_run(
-            f"pytest test_HW.py -q --json-report --json-report-file={json_filename}"
+            f"pytest test_HW.py -q --json-report --json-report-file={json_filename} "
+            "--json-report-omit collectors log streams traceback keywords warnings"
         )
 
         # Get the report.json file from the container
         bits, _ = container.get_archive(f"/{json_filename}")
-        bits_data = b"".join(bits)
-
-        # Convert the bits to a tarfile
-        tar_file = tarfile.open(fileobj=io.BytesIO(bits_data))
-
-        # Extract the report.json file from the tarfile
-        tar_file.extractall()
+        tests = read_report_archive(bits, report_file)
 
     except Exception as e:
         print(e)
+        tests = []
 
     # Stop and remove the container
     container.stop()
     container.remove()
+    return tests
+
+
+class ChunkStream(io.RawIOBase):
+    """Binary stream over an iterator of byte chunks, such as get_archive returns."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.chunk = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.chunk:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.chunk = memoryview(chunk)
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        return size
+
+
+def read_report_archive(chunks, report_file: str) -> list:
+    """
+    Save the report from the tar stream of get_archive and parse its tests.
+
+    The tar stream is read sequentially and the report is parsed while it is
+    written to report_file, so neither is held in memory as a whole.
+
+    Args:
+        chunks: The chunks of the tar archive holding the report.
+        report_file (str): The path the report is saved to.
+
+    Returns:
+        list: The kept fields of each test.
+    """
+    with tarfile.open(fileobj=ChunkStream(chunks), mode="r|") as tar:
+        member = tar.next()
+        if member is None or not member.isfile():
+            raise ValueError("The archive does not contain the report")
+        return copy_tests(tar.extractfile(member), report_file)
 
 
-def create_tar(file_path: str, is_HW: bool) -> bytes:
-    """Create a tar archive from a file.
+def create_tar(file_data: bytes, is_HW: bool) -> bytes:
+    """Create a tar archive from a file content.
 
     Args:
-        file_path (str): file name
+        file_data (bytes): file content
+        is_HW (bool): whether the file is the HW file or the test file
 
     Returns:
         bytes: tar archive as bytes
     """
 
-    with open(file_path, "rb") as file:
-        file_data = file.read()
     tarstream = io.BytesIO()
     tar = tarfile.TarFile(fileobj=tarstream, mode="w")
     if is_HW:
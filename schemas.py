@@ -1,5 +1,9 @@
+from datetime import datetime
+
 from pydantic import BaseModel, EmailStr
 
+import grading
+
 
 class RoleBase(BaseModel):
     """
@@ -38,6 +42,7 @@ class Item(ItemBase):
     mark: float | None = 0
     pass_point: int | None = 0
     fail_point: int | None = 0
+    content_hash: str | None = None
 
     class Config:
         """
@@ -47,6 +52,50 @@ class Item(ItemBase):
         from_attributes = True
 
 
+class ItemVersion(BaseModel):
+    """
+    Model for an uploaded version of an item.
+    """
+
+    id: int
+    item_id: int
+    number: int
+    content_hash: str
+    size: int
+    created_at: datetime | None = None
+    tested: bool | None = False
+    passed: bool | None = False
+    mark: float | None = None
+    pass_point: int | None = None
+    fail_point: int | None = None
+
+    class Config:
+        """
+        Configuration for the ItemVersion model.
+        """
+
+        from_attributes = True
+
+
+class TestResult(BaseModel):
+    """
+    Model for the outcome of one test.
+    """
+
+    test_id: str
+    outcome: str
+    duration: float | None = 0
+    points: int | None = 0
+    message: str | None = None
+
+    class Config:
+        """
+        Configuration for the TestResult model.
+        """
+
+        from_attributes = True
+
+
 class UserBase(BaseModel):
     """
     Base model for a user.
@@ -84,6 +133,92 @@ class User(UserBase):
         from_attributes = True
 
 
+class UserRow(UserBase):
+    """
+    Model for a user as listed by the API, built from crud.USER_COLUMNS.
+    """
+
+    id: int
+    role_id: int | None = None
+    roles: str | None = None
+    is_active: bool | None = True
+    is_first_login: bool | None = True
+
+    class Config:
+        """
+        Configuration for the UserRow model.
+        """
+
+        from_attributes = True
+
+
+class SearchHit(BaseModel):
+    """
+    Model for a user, classroom or assignment found by /search.
+    """
+
+    kind: str
+    id: int
+    title: str | None = None
+    body: str | None = None
+    rank: float
+
+
+class Principal(BaseModel):
+    """
+    Model for the authenticated user of a request, cached between requests.
+    """
+
+    id: int
+    username: str
+    email: str | None = None
+    is_active: bool | None = True
+    is_first_login: bool | None = True
+    role_version: int | None = 0
+    permissions: int = 0
+
+    class Config:
+        """
+        Configuration for the Principal model.
+        """
+
+        from_attributes = True
+
+
+class SessionClassroom(BaseModel):
+    """
+    Model for a classroom in the session of a user.
+    """
+
+    id: int
+    name: str | None = None
+    description: str | None = None
+    year: int | None = None
+
+    class Config:
+        """
+        Configuration for the SessionClassroom model.
+        """
+
+        from_attributes = True
+
+
+class UserSession(BaseModel):
+    """
+    Model for everything the pages need to know about the logged in user.
+    """
+
+    id: int
+    username: str
+    email: str | None = None
+    role: str | None = None
+    is_first_login: bool | None = True
+    teacher_plus: bool = False
+    super_teacher_plus: bool = False
+    admin: bool = False
+    classes: list[SessionClassroom] = []
+
+
 class Token(BaseModel):
     """
     Model for a token.
@@ -91,6 +226,15 @@ class Token(BaseModel):
 
     access_token: str
     token_type: str
+    refresh_token: str | None = None
+
+
+class RefreshRequest(BaseModel):
+    """
+    Model for a request with a refresh token.
+    """
+
+    refresh_token: str
 
 
 class TokenData(BaseModel):
@@ -129,6 +273,7 @@ class Assignment(AssignmentBase):
     owner_id: int
     items: list[Item] = []
     classroom_id: int
+    test_hash: str | None = None
 
     class Config:
         """
@@ -138,6 +283,84 @@ class Assignment(AssignmentBase):
         from_attributes = True
 
 
+class AssignmentRow(AssignmentBase):
+    """
+    Model for an assignment without its items, built from crud.ASSIGNMENT_COLUMNS.
+    """
+
+    id: int
+    owner_id: int | None = None
+    classroom_id: int | None = None
+    test_hash: str | None = None
+
+    class Config:
+        """
+        Configuration for the AssignmentRow model.
+        """
+
+        from_attributes = True
+
+
+class AssignmentStats(BaseModel):
+    """
+    Model for the aggregated results of an assignment, kept by gradebook.sync.
+    """
+
+    assignment_id: int
+    enrolled: int = 0
+    submitted: int = 0
+    tested: int = 0
+    passed: int = 0
+    mean_mark: float | None = None
+    median_mark: float | None = None
+
+    class Config:
+        """
+        Configuration for the AssignmentStats model.
+        """
+
+        from_attributes = True
+
+
+class GradingPolicyBase(BaseModel):
+    """
+    Base model for the grading policy of an assignment.
+    """
+
+    weights: dict[str, float] = {}
+    pass_threshold: float = grading.DEFAULT_PASS_THRESHOLD
+    letter_scale: dict[str, float] = grading.DEFAULT_LETTER_SCALE
+    deadline: datetime | None = None
+    late_penalty: float = 0
+    max_late_penalty: float = 100
+
+
+class GradingPolicy(GradingPolicyBase):
+    """
+    Model for the grading policy of an assignment.
+    """
+
+    assignment_id: int
+
+    class Config:
+        """
+        Configuration for the GradingPolicy model.
+        """
+
+        from_attributes = True
+
+
+class Grade(BaseModel):
+    """
+    Model for the mark of an item computed by a grading policy.
+    """
+
+    item_id: int
+    mark: float | None = None
+    passed: bool
+    letter: str | None = None
+
+
 class ClassroomBase(BaseModel):
     """
     Base model for a classroom.
@@ -175,6 +398,19 @@ class Classroom(ClassroomBase):
         from_attributes = True
 
 
+class ClassroomRow(BaseModel):
+    """
+    Model for a classroom without its owner, assignments and students, built
+    from crud.CLASSROOM_COLUMNS.
+    """
+
+    id: int
+    name: str | None = None
+    description: str | None = None
+    year: int | None = None
+    owner_id: int | None = None
+
+
 class EmailSchema(BaseModel):
     """
     Model for an email.
@@ -0,0 +1,173 @@
+import regex as re
+from sqlalchemy import Float, Integer, String, text
+from sqlalchemy.engine import Connection
+
+# searchable records: the kind, its code in the index and the table with the
+# title and body columns that are searched
+SOURCES = {
+    "user": (1, "users", "username", "email"),
+    "classroom": (2, "classrooms", "name", "description"),
+    "assignment": (3, "assignments", "name", "description"),
+}
+# on SQLite the records share one FTS5 table, the rowid is id * KIND_SLOTS + code
+# so a record is found by its rowid when its row changes
+FTS_TABLE = "search_index"
+KIND_SLOTS = 4
+# bm25 weights of the title and body columns
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+
+re_token = re.compile(r"\w+")
+
+
+def tokens(q: str) -> list:
+    """
+    Split a search query into words, everything else is ignored.
+
+    Args:
+        q (str): The query as typed.
+
+    Returns:
+        list: The lower case words, at most 8.
+    """
+    return [token.lower() for token in re_token.findall(q)][:8]
+
+
+def match_query(q: str, sqlite: bool) -> str | None:
+    """
+    Build the full-text query that matches records containing words starting with every typed word.
+
+    Args:
+        q (str): The query as typed.
+        sqlite (bool): Build an FTS5 MATCH query, otherwise a Postgres tsquery.
+
+    Returns:
+        str | None: The query, None if nothing searchable was typed.
+    """
+    words = tokens(q)
+    if not words:
+        return None
+    if sqlite:
+        return " AND ".join(f'"{word}"*' for word in words)
+    return " & ".join(f"{word}:*" for word in words)
+
+
+def _sqlite_triggers(kind: str) -> list:
+    code, table, title, body = SOURCES[kind]
+    rowid = f"{{row}}.id * {KIND_SLOTS} + {code}"
+    insert = (
+        f"INSERT INTO {FTS_TABLE}(rowid, title, body) "
+        f"VALUES ({rowid.format(row='new')}, new.{title}, new.{body});"
+    )
+    delete = f"DELETE FROM {FTS_TABLE} WHERE rowid = {rowid.format(row='old')};"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_{table}_insert "
+        f"AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_{table}_update "
+        f"AFTER UPDATE OF {title}, {body} ON {table} BEGIN {delete} {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_{table}_delete "
+        f"AFTER DELETE ON {table} BEGIN {delete} END",
+    ]
+
+
+def _postgres_vector(kind: str) -> str:
+    _, _, title, body = SOURCES[kind]
+    return (
+        f"setweight(to_tsvector('simple', coalesce({title}, '')), 'A') || "
+        f"setweight(to_tsvector('simple', coalesce({body}, '')), 'D')"
+    )
+
+
+def create_index(conn: Connection):
+    """
+    Create the search index and fill it with the existing records.
+
+    SQLite gets an FTS5 table kept in sync by triggers on the source tables,
+    Postgres GIN indexes over the tsvector of every source table, which the
+    database keeps in sync itself.
+
+    Args:
+        conn (Connection): The database connection.
+    """
+    if conn.dialect.name == "sqlite":
+        conn.execute(
+            text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                "title, body, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+        )
+        for kind in SOURCES:
+            for trigger in _sqlite_triggers(kind):
+                conn.execute(text(trigger))
+        rebuild(conn)
+    else:
+        for kind, (_, table, _, _) in SOURCES.items():
+            conn.execute(
+                text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{table}_search "
+                    f"ON {table} USING gin (({_postgres_vector(kind)}))"
+                )
+            )
+
+
+def rebuild(conn: Connection):
+    """
+    Fill the SQLite search index again from the source tables.
+
+    Args:
+        conn (Connection): The database connection.
+    """
+    conn.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    for code, table, title, body in SOURCES.values():
+        conn.execute(
+            text(
+                f"INSERT INTO {FTS_TABLE}(rowid, title, body) "
+                f"SELECT id * {KIND_SLOTS} + {code}, {title}, {body} FROM {table}"
+            )
+        )
+
+
+def hits_statement(kinds: list, sqlite: bool):
+    """
+    Return the statement of the best matching records of the given kinds.
+
+    The statement takes the parameters q (from match_query) and limit and
+    returns the columns kind, id, title, body and rank, best matches first.
+
+    Args:
+        kinds (list): The kinds of records, keys of SOURCES.
+        sqlite (bool): Query the FTS5 table, otherwise the Postgres indexes.
+
+    Returns:
+        TextClause: The statement.
+    """
+    if sqlite:
+        codes = ", ".join(str(SOURCES[kind][0]) for kind in kinds)
+        kind_names = " ".join(
+            f"WHEN {code} THEN '{kind}'" for kind, (code, *_) in SOURCES.items()
+        )
+        sql = (
+            f"SELECT CASE rowid % {KIND_SLOTS} {kind_names} END AS kind, "
+            f"rowid / {KIND_SLOTS} AS id, title, body, "
+            f"bm25({FTS_TABLE}, {TITLE_WEIGHT}, {BODY_WEIGHT}) AS rank "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :q "
+            f"AND rowid % {KIND_SLOTS} IN ({codes}) "
+            "ORDER BY rank LIMIT :limit"
+        )
+    else:
+        # ts_rank grows with the relevance, it is negated to sort like bm25
+        sql = (
+            " UNION ALL ".join(
+                f"(SELECT '{kind}' AS kind, id, {title} AS title, {body} AS body, "
+                f"-ts_rank({_postgres_vector(kind)}, query) AS rank "
+                f"FROM {table}, to_tsquery('simple', :q) AS query "
+                f"WHERE {_postgres_vector(kind)} @@ query "
+                "ORDER BY rank LIMIT :limit)"
+                for kind, (_, table, title, body) in SOURCES.items()
+                if kind in kinds
+            )
+            + " ORDER BY rank LIMIT :limit"
+        )
+    return text(sql).columns(
+        kind=String, id=Integer, title=String, body=String, rank=Float
+    )
@@ -1,17 +1,14 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from models import User, Item, Assignment, Classroom, Role, Base
+from database import SessionLocal, engine
+import gradebook, migrations
+from models import User, Item, Assignment, Classroom, Role
 from crud import get_password_hash
+from storage import storage
 
-# Create an engine to connect to the database
-engine = create_engine("sqlite:///api.db")
-
-# Create all tables
-Base.metadata.create_all(engine)
+# Create or upgrade the tables in the database configured by DATABASE_URL
+migrations.upgrade(engine)
 
 # Create a session
-Session = sessionmaker(bind=engine)
-session = Session()
+session = SessionLocal()
 
 # Create roles
 roles_data = [
@@ -92,6 +89,8 @@ assignment1 = Assignment(
     classroom=classrooms[0],
     name="add func",
 )
+with open("TESTS/test_HW_1.py", "rb") as f:
+    assignment1.test_hash = storage.put_bytes(f.read())
 
 session.add(assignment1)
 
@@ -101,6 +100,9 @@ students = users[1:]  # Exclude admin
 for student in students:
     classroom.students.append(student)
 
+# Fill the gradebook tables from the rows added above
+gradebook.rebuild(session)
+
 # Commit the session to the database
 session.commit()
 
@@ -0,0 +1,190 @@
+import ast
+import hashlib
+import io
+import random
+import tokenize
+from array import array
+from collections import defaultdict
+
+import numpy as np
+
+# a MinHash signature has NUM_PERM values, split into BANDS bands of ROWS rows
+# for the LSH index; two submissions become candidates when they agree on all
+# rows of at least one band, which happens mostly above ~(1/BANDS)**(1/ROWS)
+NUM_PERM = 128
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+
+_PRIME = (1 << 61) - 1
+_random = random.Random(20240201)
+_PERMUTATIONS = [
+    (_random.randrange(1, _PRIME), _random.randrange(0, _PRIME))
+    for _ in range(NUM_PERM)
+]
+
+
+def _hash64(data: bytes, signed: bool = False) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(data, digest_size=8).digest(), "big", signed=signed
+    )
+
+
+def normalize(source: bytes) -> list:
+    """
+    Turn python source into a list of tokens without identifiers.
+
+    The tokens are the AST node types in depth-first order, so renaming
+    variables, reformatting or changing comments and literals does not change
+    them. Files that do not parse fall back to the lexical tokens with names,
+    numbers and strings replaced by placeholders.
+
+    Args:
+        source (bytes): The python source.
+
+    Returns:
+        list: The normalized tokens.
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return _normalize_tokens(source)
+    return [type(node).__name__ for node in _walk(tree)]
+
+
+def _walk(node):
+    yield node
+    for child in ast.iter_child_nodes(node):
+        yield from _walk(child)
+
+
+def _normalize_tokens(source: bytes) -> list:
+    tokens = []
+    try:
+        for token in tokenize.tokenize(io.BytesIO(source).readline):
+            if token.type == tokenize.NAME:
+                tokens.append("ID")
+            elif token.type == tokenize.NUMBER:
+                tokens.append("NUM")
+            elif token.type == tokenize.STRING:
+                tokens.append("STR")
+            elif token.type == tokenize.OP:
+                tokens.append(token.string)
+    except (tokenize.TokenError, SyntaxError):
+        pass
+    return tokens
+
+
+def shingles(tokens: list) -> set:
+    """
+    Return the hashes of all runs of SHINGLE_SIZE consecutive tokens.
+
+    Args:
+        tokens (list): The normalized tokens.
+
+    Returns:
+        set: The 64 bit shingle hashes.
+    """
+    if len(tokens) < SHINGLE_SIZE:
+        tokens = tokens + [""] * (SHINGLE_SIZE - len(tokens))
+    return {
+        _hash64(" ".join(tokens[i : i + SHINGLE_SIZE]).encode())
+        for i in range(len(tokens) - SHINGLE_SIZE + 1)
+    }
+
+
+def minhash(source: bytes) -> list:
+    """
+    Compute the MinHash signature of python source.
+
+    Args:
+        source (bytes): The python source.
+
+    Returns:
+        list: NUM_PERM minimal hash values.
+    """
+    hashes = shingles(normalize(source))
+    return [min((a * x + b) % _PRIME for x in hashes) for a, b in _PERMUTATIONS]
+
+
+def band_buckets(signature: list) -> list:
+    """
+    Return the LSH bucket of each band of a signature.
+
+    Args:
+        signature (list): The MinHash signature.
+
+    Returns:
+        list: BANDS signed 64 bit bucket hashes.
+    """
+    return [
+        _hash64(
+            array("Q", signature[band * ROWS : (band + 1) * ROWS]).tobytes(),
+            signed=True,
+        )
+        for band in range(BANDS)
+    ]
+
+
+def candidate_pairs(buckets, count: int) -> np.ndarray:
+    """
+    Return the pairs of submissions that share a bucket in at least one band.
+
+    Args:
+        buckets: Tuples (band, bucket, submission) from the LSH index, the
+            submissions are numbered from 0 to count - 1.
+        count (int): The number of submissions.
+
+    Returns:
+        np.ndarray: Unique pairs (a, b) of submissions with a < b, shape (n, 2).
+    """
+    groups = defaultdict(list)
+    for band, bucket, submission in buckets:
+        groups[(band, bucket)].append(submission)
+    codes = []
+    for submissions in groups.values():
+        if len(submissions) > 1:
+            submissions = np.array(sorted(submissions), dtype=np.int64)
+            first, second = np.triu_indices(len(submissions), 1)
+            codes.append(submissions[first] * count + submissions[second])
+    if not codes:
+        return np.empty((0, 2), dtype=np.int64)
+    codes = np.sort(np.concatenate(codes))
+    codes = codes[np.concatenate(([True], codes[1:] != codes[:-1]))]
+    return np.stack([codes // count, codes % count], axis=1)
+
+
+def most_similar(signatures: list, buckets, threshold: float, limit: int) -> list:
+    """
+    Find the most similar pairs of submissions.
+
+    Only the candidate pairs from the LSH buckets are compared, the similarity
+    is estimated as the share of equal signature values, for all pairs at once.
+
+    Args:
+        signatures (list): Packed signatures of the submissions.
+        buckets: Tuples (band, bucket, index into signatures) from the LSH index.
+        threshold (float): Minimal similarity between 0 and 1.
+        limit (int): Maximum number of pairs.
+
+    Returns:
+        list: Tuples (a, b, similarity) of indexes into signatures, most similar first.
+    """
+    pairs = candidate_pairs(buckets, len(signatures))
+    if len(pairs) == 0:
+        return []
+    matrix = np.frombuffer(b"".join(signatures), dtype=np.uint64).reshape(
+        len(signatures), NUM_PERM
+    )
+    scores = (matrix[pairs[:, 0]] == matrix[pairs[:, 1]]).sum(axis=1) / NUM_PERM
+    selected = np.flatnonzero(scores >= threshold)
+    selected = selected[np.argsort(-scores[selected], kind="stable")][:limit]
+    return [(int(pairs[i, 0]), int(pairs[i, 1]), float(scores[i])) for i in selected]
+
+
+def pack(signature: list) -> bytes:
+    return array("Q", signature).tobytes()
+
+
+def unpack(data: bytes) -> list:
+    return array("Q", data).tolist()
@@ -0,0 +1,39 @@
+// The user, role, permissions, first login state and classes of the logged in
+// user from /session, requested once per page and shared by all its scripts.
+let sessionPromise = null;
+
+function getSession() {
+  if (sessionPromise === null) {
+    const token = localStorage.getItem("authToken");
+    if (!token) {
+      sessionPromise = Promise.resolve(null);
+    } else {
+      sessionPromise = fetch("/session", {
+        method: "GET",
+        headers: {
+          Accept: "application/json",
+          Authorization: `Bearer ${token}`,
+        },
+      })
+        .then((response) => (response.ok ? response.json() : null))
+        .catch((error) => {
+          console.error(error);
+          return null;
+        });
+    }
+  }
+  return sessionPromise;
+}
+
+// Redirect to the login page when the user is not logged in.
+function requireSession() {
+  return getSession().then((session) => {
+    if (session === null) {
+      if (localStorage.getItem("authToken")) {
+        alert("Unauthorized access. Please login again.");
+      }
+      window.location.href = "/login";
+    }
+    return session;
+  });
+}
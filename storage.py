@@ -0,0 +1,310 @@
+import hashlib
+import os
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# seconds a blob is kept after it was last stored, even when nothing references
+# it, so an upload can still commit its reference (see collect_garbage)
+STORAGE_GC_MIN_AGE = float(os.getenv("STORAGE_GC_MIN_AGE", 24 * 60 * 60))
+
+
+def is_digest(name: str) -> bool:
+    """Return True if a name is a sha256 hex digest, i.e. the name of a blob."""
+    return len(name) == 64 and all(c in "0123456789abcdef" for c in name)
+
+
+def blob_key(digest: str) -> str:
+    """
+    Return the sharded key of a blob, e.g. ab/cd/abcd....
+
+    Two levels of 256 directories keep every directory small even with
+    hundreds of thousands of stored files.
+
+    Args:
+        digest (str): The sha256 hex digest of the blob.
+
+    Returns:
+        str: The relative key of the blob.
+    """
+    return f"{digest[:2]}/{digest[2:4]}/{digest}"
+
+
+class Storage(ABC):
+    """
+    Content-addressed blob storage, blobs are addressed by the sha256 of their content.
+
+    Attributes:
+        staging_dir (str): Directory for files that are being uploaded.
+    """
+
+    staging_dir: str
+
+    @abstractmethod
+    def exists(self, digest: str) -> bool:
+        """Return True if the blob with the given digest is stored."""
+
+    @abstractmethod
+    def put_file(self, path: str, digest: str):
+        """
+        Move a local file with the given digest into the storage.
+
+        The file is removed from its original location. When the blob is
+        already stored, its modification time is refreshed instead, which
+        keeps it from the garbage collection.
+
+        Args:
+            path (str): Path of the local file.
+            digest (str): The sha256 hex digest of the file.
+        """
+
+    @abstractmethod
+    def get_bytes(self, digest: str) -> bytes:
+        """Return the content of the blob with the given digest."""
+
+    @abstractmethod
+    def delete(self, digest: str):
+        """Delete the blob with the given digest."""
+
+    @abstractmethod
+    def list_blobs(self):
+        """Yield the digest and the modification time (epoch seconds) of every blob."""
+
+    @abstractmethod
+    def collect(self, digest: str, cutoff: float) -> bool:
+        """
+        Delete a blob unless it was stored again after cutoff.
+
+        Args:
+            digest (str): The sha256 hex digest of the blob.
+            cutoff (float): Epoch seconds, blobs stored later are kept.
+
+        Returns:
+            bool: True if the blob was deleted.
+        """
+
+    def put_bytes(self, data: bytes) -> str:
+        """
+        Store the data and return its digest.
+
+        Args:
+            data (bytes): The content to store.
+
+        Returns:
+            str: The sha256 hex digest of the data.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        # put_file also refreshes a blob that is already stored
+        os.makedirs(self.staging_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.staging_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        self.put_file(path, digest)
+        return digest
+
+
+class LocalStorage(Storage):
+    """
+    Storage of blobs in a sharded directory tree on the local (or shared) filesystem.
+
+    Attributes:
+        root (Path): The root directory of the storage.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root).resolve()
+        self.staging_dir = str(self.root / "tmp")
+
+    def path(self, digest: str) -> Path:
+        return self.root / blob_key(digest)
+
+    def exists(self, digest: str) -> bool:
+        return self.path(digest).is_file()
+
+    def put_file(self, path: str, digest: str):
+        target = self.path(digest)
+        if target.is_file():
+            try:
+                os.utime(target)
+            except FileNotFoundError:
+                # collected meanwhile, stored again below
+                pass
+            else:
+                # identical content is stored only once
+                os.remove(path)
+                return
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, target)
+
+    def get_bytes(self, digest: str) -> bytes:
+        return self.path(digest).read_bytes()
+
+    def delete(self, digest: str):
+        self.path(digest).unlink(missing_ok=True)
+
+    def list_blobs(self):
+        for path in self.root.glob("*/*/*"):
+            if is_digest(path.name):
+                yield path.name, path.stat().st_mtime
+
+    def collect(self, digest: str, cutoff: float) -> bool:
+        path = self.path(digest)
+        # an upload that finds the blob gone after the rename stores it again,
+        # one that refreshed it before the rename is seen by the check below
+        collected = path.with_name(f"{digest}.collected")
+        try:
+            os.rename(path, collected)
+        except FileNotFoundError:
+            return False
+        if collected.stat().st_mtime >= cutoff:
+            os.replace(collected, path)
+            return False
+        collected.unlink()
+        return True
+
+
+class S3Storage(Storage):
+    """
+    Storage of blobs in an S3-compatible bucket.
+
+    Any S3-compatible server works through endpoint_url, e.g. MinIO or a local
+    moto server for testing.
+
+    Attributes:
+        bucket (str): The name of the bucket.
+        prefix (str): Prefix of all keys in the bucket.
+        client: The boto3 S3 client.
+    """
+
+    def __init__(self, bucket: str, endpoint_url: str | None = None, prefix: str = ""):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("S3 storage requires boto3, run: pip install boto3")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.staging_dir = tempfile.gettempdir()
+
+    def key(self, digest: str) -> str:
+        return self.prefix + blob_key(digest)
+
+    def exists(self, digest: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(digest))
+        except self.client.exceptions.ClientError:
+            return False
+        return True
+
+    def put_file(self, path: str, digest: str):
+        try:
+            if not self.exists(digest):
+                self.client.upload_file(path, self.bucket, self.key(digest))
+            else:
+                # copying the object onto itself refreshes its LastModified
+                self.client.copy_object(
+                    Bucket=self.bucket,
+                    Key=self.key(digest),
+                    CopySource={"Bucket": self.bucket, "Key": self.key(digest)},
+                    MetadataDirective="REPLACE",
+                )
+        finally:
+            os.remove(path)
+
+    def get_bytes(self, digest: str) -> bytes:
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key(digest))
+        return response["Body"].read()
+
+    def delete(self, digest: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(digest))
+
+    def list_blobs(self):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for entry in page.get("Contents", []):
+                digest = entry["Key"].rsplit("/", 1)[-1]
+                if is_digest(digest):
+                    yield digest, entry["LastModified"].timestamp()
+
+    def collect(self, digest: str, cutoff: float) -> bool:
+        # S3 has no conditional delete, the check narrows the race with an
+        # upload refreshing the blob to the time between the two requests
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.key(digest))
+        except self.client.exceptions.ClientError:
+            return False
+        if head["LastModified"].timestamp() >= cutoff:
+            return False
+        self.delete(digest)
+        return True
+
+
+def get_storage() -> Storage:
+    """
+    Create the storage configured in .env.
+
+    STORAGE_BACKEND is either "local" (default, files in STORAGE_ROOT) or "s3"
+    (S3_BUCKET, optionally S3_ENDPOINT_URL and S3_PREFIX).
+
+    Returns:
+        Storage: The configured storage.
+    """
+    backend = os.getenv("STORAGE_BACKEND", "local")
+    if backend == "local":
+        return LocalStorage(
+            os.getenv("STORAGE_ROOT", str(Path(__file__).parent / "storage"))
+        )
+    elif backend == "s3":
+        return S3Storage(
+            bucket=os.getenv("S3_BUCKET"),
+            endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+            prefix=os.getenv("S3_PREFIX", ""),
+        )
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def collect_garbage(
+    referenced: set, min_age: float = STORAGE_GC_MIN_AGE, store: Storage = None
+) -> int:
+    """
+    Delete the blobs that are not referenced and were not stored for min_age seconds.
+
+    Replaced submissions and test files are not deleted right away, an upload
+    of the same content may be reusing the blob at that moment. They are
+    collected here instead, once they are no longer referenced and have not
+    been stored again for a while.
+
+    Args:
+        referenced (set): The digests referenced by the database, read before
+            this is called.
+        min_age (float, optional): Seconds since a blob was last stored.
+            Defaults to STORAGE_GC_MIN_AGE.
+        store (Storage, optional): The storage. Defaults to the configured one.
+
+    Returns:
+        int: The number of deleted blobs.
+    """
+    store = store or storage
+    cutoff = time.time() - min_age
+    deleted = 0
+    for digest, modified in list(store.list_blobs()):
+        if digest not in referenced and modified < cutoff:
+            deleted += store.collect(digest, cutoff)
+    return deleted
+
+
+storage = get_storage()
+
+
+if __name__ == "__main__":
+    import crud
+    from database import SessionLocal
+
+    with SessionLocal() as db:
+        referenced = crud.get_referenced_blobs(db)
+    print(f"{collect_garbage(referenced)} unreferenced blobs deleted")
@@ -0,0 +1,125 @@
+"""
+Shared setup of the tests.
+
+The modules read their configuration from the environment when they are
+imported, so it is set here first: a throwaway SQLite database, storage and
+cache directory, cheap password hashes and no mail server.
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+TMP = Path(tempfile.mkdtemp(prefix="autograder-tests-"))
+
+os.environ.update(
+    {
+        "DATABASE_URL": f"sqlite:///{TMP / 'api.db'}",
+        "STORAGE_BACKEND": "local",
+        "STORAGE_ROOT": str(TMP / "storage"),
+        "CACHE_DIR": str(TMP / "cache"),
+        "CACHE_BACKEND": "local",
+        "REPORT_ARCHIVE_DIR": str(TMP / "archive"),
+        "SECRET_KEY": "tests",
+        "ALGORITHM": "HS256",
+        "BCRYPT_ROUNDS": "4",
+        "TEMP_BCRYPT_ROUNDS": "4",
+        "MAIL_SERVER": "",
+        "MAIL_FROM": "autograder@example.com",
+        # plain SMTP to the stand-in server of bench_mail, without a rate limit
+        "MAIL_SSL_TLS": "false",
+        "MAIL_STARTTLS": "false",
+        "MAIL_USERNAME": "",
+        "MAIL_RATE": "0",
+        "MAIL_TIMEOUT": "5",
+    }
+)
+# the app serves templates and static files relative to the working directory
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT))
+
+PASSWORD = "1234"
+
+
+@pytest.fixture(scope="session")
+def seeded():
+    """Create the schema and an admin, a teacher, two students, a class and an assignment."""
+    import crud, database, gradebook, migrations, models, schemas
+
+    migrations.upgrade(database.engine)
+    with database.SessionLocal() as db:
+        roles = {}
+        for name, slug in (
+            ("Admin", "admin"),
+            ("Teacher", "teacher"),
+            ("Student", "student"),
+        ):
+            role = models.Role(name=name, slug=slug)
+            db.add(role)
+            db.flush()
+            roles[slug] = role.id
+        hashed = crud.get_password_hash(PASSWORD)
+        users = {}
+        for username, role in (
+            ("admin", "admin"),
+            ("teacher", "teacher"),
+            ("student1", "student"),
+            ("student2", "student"),
+        ):
+            user = models.User(
+                username=username,
+                email=f"{username}@example.com",
+                hashed_password=hashed,
+                role_id=roles[role],
+            )
+            db.add(user)
+            db.flush()
+            users[username] = user.id
+        db.commit()
+        classroom = crud.create_classroom(
+            db,
+            schemas.ClassroomCreate(name="Class", description="", year=2024),
+            users["teacher"],
+        )
+        for student in ("student1", "student2"):
+            crud.enroll_student(db, classroom.id, users[student])
+        assignment = crud.create_assignment(
+            db,
+            schemas.AssignmentCreate(name="add", description="add two numbers"),
+            users["teacher"],
+            classroom.id,
+        )
+        gradebook.rebuild(db)
+        db.commit()
+        return {
+            "users": users,
+            "classroom_id": classroom.id,
+            "assignment_id": assignment.id,
+        }
+
+
+@pytest.fixture
+def client(seeded):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app, raise_server_exceptions=False) as client:
+        yield client
+
+
+@pytest.fixture
+def login(client):
+    """Return the authorization header of a seeded user."""
+
+    def headers(username: str) -> dict:
+        response = client.post(
+            "/token", data={"username": username, "password": PASSWORD}
+        )
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    return headers
@@ -0,0 +1,16 @@
+def test_assignment_is_created_in_a_class(seeded, client, login):
+    response = client.post(
+        f"/class/{seeded['classroom_id']}/assignment/create",
+        json={"name": "sub", "description": "subtract two numbers"},
+        headers=login("teacher"),
+    )
+    assert response.status_code == 200, response.text
+
+
+def test_assignment_of_a_missing_class_is_not_found(client, login):
+    response = client.post(
+        "/class/999999/assignment/create",
+        json={"name": "sub", "description": "subtract two numbers"},
+        headers=login("teacher"),
+    )
+    assert response.status_code == 404
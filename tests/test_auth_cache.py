@@ -0,0 +1,21 @@
+import async_crud, cache
+
+
+def test_principal_invalidated_while_loading_is_not_cached(client, login, monkeypatch):
+    headers = login("student1")
+    cache.principals.clear()
+    get_user_by_username = async_crud.get_user_by_username
+
+    async def changed_while_loading(db, username):
+        user = await get_user_by_username(db, username)
+        # e.g. the role of the user is changed by another request
+        cache.principals.invalidate(username)
+        return user
+
+    monkeypatch.setattr(async_crud, "get_user_by_username", changed_while_loading)
+    assert client.get("/logincheck", headers=headers).status_code == 200
+    assert cache.principals.get("student1") is None
+
+    monkeypatch.setattr(async_crud, "get_user_by_username", get_user_by_username)
+    assert client.get("/logincheck", headers=headers).status_code == 200
+    assert cache.principals.get("student1") is not None
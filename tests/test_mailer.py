@@ -0,0 +1,185 @@
+"""
+The outbox sender against the local SMTP stand-in server of bench_mail.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, select, update
+
+import database, mailer, models
+from bench_mail import StandInSMTP
+
+outbox = models.OutboxEmail
+
+
+@pytest.fixture(autouse=True)
+def empty_outbox(seeded):
+    with database.SessionLocal() as db:
+        db.execute(delete(outbox))
+        db.commit()
+
+
+def queue(*recipients, template="email_template.html"):
+    with database.SessionLocal() as db:
+        for recipient in recipients:
+            values = mailer.welcome_email(recipient, "login", "temporary")
+            db.add(outbox(**values | {"template": template}))
+        db.commit()
+
+
+def emails() -> dict:
+    with database.SessionLocal() as db:
+        return {email.recipient: email for email in db.scalars(select(outbox))}
+
+
+def send_pending(stand_in: StandInSMTP) -> mailer.SMTPConnection:
+    """Send the due emails through one connection to the stand-in server."""
+
+    async def run():
+        port = await stand_in.start()
+        connection = mailer.SMTPConnection("127.0.0.1", port)
+        try:
+            await mailer.send_pending(connection)
+        finally:
+            await connection.close()
+            stand_in.server.close()
+            await stand_in.server.wait_closed()
+            await database.async_engine.dispose()
+        return connection
+
+    return asyncio.run(run())
+
+
+def make_due():
+    with database.SessionLocal() as db:
+        db.execute(update(outbox).values(next_attempt_at=datetime.utcnow()))
+        db.commit()
+
+
+def test_emails_are_sent_through_one_connection():
+    queue(*(f"s{i}@example.com" for i in range(5)))
+    stand_in = StandInSMTP()
+
+    connection = send_pending(stand_in)
+
+    assert connection.opened == 1
+    assert stand_in.connections == 1
+    assert len(stand_in.messages) == 5
+    for email in emails().values():
+        assert email.status == mailer.SENT
+        assert email.attempts == 0
+        # the temporary password is not kept
+        assert email.template_body is None
+
+
+def test_temporary_error_is_retried_with_backoff():
+    queue("busy@example.com", "ok@example.com")
+
+    start = datetime.utcnow()
+    send_pending(StandInSMTP())
+    busy = emails()["busy@example.com"]
+    assert busy.status == mailer.PENDING
+    assert busy.attempts == 1
+    assert "451" in busy.last_error
+    assert busy.locked_until is None
+    first_delay = (busy.next_attempt_at - start).total_seconds()
+    assert mailer.MAIL_RETRY_DELAY <= first_delay < mailer.MAIL_RETRY_DELAY + 5
+    # the other email of the batch is not held up
+    assert emails()["ok@example.com"].status == mailer.SENT
+
+    # not due yet, nothing is sent
+    stand_in = StandInSMTP()
+    send_pending(stand_in)
+    assert stand_in.connections == 0
+
+    make_due()
+    start = datetime.utcnow()
+    send_pending(StandInSMTP())
+    busy = emails()["busy@example.com"]
+    assert busy.attempts == 2
+    second_delay = (busy.next_attempt_at - start).total_seconds()
+    assert 2 * mailer.MAIL_RETRY_DELAY <= second_delay < 2 * mailer.MAIL_RETRY_DELAY + 5
+
+
+def test_temporary_error_fails_after_the_last_attempt(monkeypatch):
+    monkeypatch.setattr(mailer, "MAIL_MAX_ATTEMPTS", 2)
+    queue("busy@example.com")
+
+    send_pending(StandInSMTP())
+    make_due()
+    send_pending(StandInSMTP())
+
+    busy = emails()["busy@example.com"]
+    assert busy.status == mailer.FAILED
+    assert busy.attempts == 2
+
+
+def test_permanent_error_fails_at_once():
+    queue("refused@example.com")
+
+    send_pending(StandInSMTP())
+
+    refused = emails()["refused@example.com"]
+    assert refused.status == mailer.FAILED
+    assert refused.attempts == 1
+    assert "550" in refused.last_error
+    assert refused.template_body is None
+
+
+def test_template_error_fails_the_email_and_the_batch_goes_on():
+    queue("broken@example.com", template="missing_template.html")
+    queue("ok@example.com")
+    stand_in = StandInSMTP()
+
+    send_pending(stand_in)
+
+    broken = emails()["broken@example.com"]
+    assert broken.status == mailer.FAILED
+    assert broken.attempts == 1
+    assert broken.locked_until is None
+    assert "TemplateNotFound" in broken.last_error
+    assert emails()["ok@example.com"].status == mailer.SENT
+    assert len(stand_in.messages) == 1
+
+
+def test_claimed_emails_are_leased_to_one_worker():
+    queue(*(f"s{i}@example.com" for i in range(10)))
+
+    async def claim_concurrently():
+        async with database.AsyncSessionLocal() as first:
+            async with database.AsyncSessionLocal() as second:
+                claimed = await asyncio.gather(
+                    mailer.claim(first, limit=10), mailer.claim(second, limit=10)
+                )
+                ids = [[email.id for email in batch] for batch in claimed]
+        async with database.AsyncSessionLocal() as third:
+            ids.append([email.id for email in await mailer.claim(third)])
+        await database.async_engine.dispose()
+        return ids
+
+    first, second, third = asyncio.run(claim_concurrently())
+    assert sorted(first + second) == sorted(email.id for email in emails().values())
+    assert not set(first) & set(second)
+    # the lease keeps every email from the next claim
+    assert third == []
+
+
+def test_expired_lease_is_claimed_again():
+    queue("s@example.com")
+
+    async def claim():
+        async with database.AsyncSessionLocal() as db:
+            claimed = [email.id for email in await mailer.claim(db)]
+        await database.async_engine.dispose()
+        return claimed
+
+    assert len(asyncio.run(claim())) == 1
+    assert asyncio.run(claim()) == []
+    with database.SessionLocal() as db:
+        db.execute(
+            update(outbox).values(locked_until=datetime.utcnow() - timedelta(seconds=1))
+        )
+        db.commit()
+    assert len(asyncio.run(claim())) == 1
@@ -0,0 +1,43 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import IntegrityError
+
+import migrations, models
+
+
+@pytest.fixture
+def bind(tmp_path):
+    bind = create_engine(f"sqlite:///{tmp_path / 'migrations.db'}")
+    yield bind
+    bind.dispose()
+
+
+def unique_numbers(conn):
+    conn.execute(text("CREATE TABLE numbers (n INTEGER UNIQUE)"))
+    conn.execute(text("INSERT INTO numbers VALUES (1), (1)"))
+
+
+def test_error_of_a_migration_is_raised_and_not_recorded(bind, monkeypatch):
+    monkeypatch.setattr(migrations, "MIGRATIONS", [(1, "numbers", unique_numbers)])
+    with pytest.raises(IntegrityError):
+        migrations.upgrade(bind)
+    with bind.connect() as conn:
+        assert migrations.applied_versions(conn) == {}
+
+
+def test_migration_recorded_by_another_worker_is_skipped(bind, monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        migrations,
+        "MIGRATIONS",
+        [(1, "first", calls.append), (2, "second", calls.append)],
+    )
+    migrations.create_tables(bind)
+    with bind.begin() as conn:
+        conn.execute(
+            models.SchemaVersion.__table__.insert().values(version=1, name="first")
+        )
+    # the other worker recorded it after this one read the applied migrations
+    monkeypatch.setattr(migrations, "applied_versions", lambda conn: {})
+    assert migrations.upgrade(bind) == [2]
+    assert len(calls) == 1
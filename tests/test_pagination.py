@@ -0,0 +1,47 @@
+import pytest
+
+import pagination
+
+
+@pytest.mark.parametrize("sort", ["name", "mark", "status"])
+def test_results_are_paged_with_the_cursor(seeded, client, login, sort):
+    path = f"/assignment/{seeded['assignment_id']}/results"
+    headers = login("teacher")
+    first = client.get(path, params={"sort": sort, "limit": 1}, headers=headers)
+    assert first.status_code == 200, first.text
+    second = client.get(
+        path,
+        params={"sort": sort, "limit": 1, "after": first.json()["next"]},
+        headers=headers,
+    )
+    assert second.status_code == 200, second.text
+    assert second.json()["results"] != first.json()["results"]
+
+
+@pytest.mark.parametrize(
+    "sort, key",
+    [
+        ("mark", [[1], [2]]),
+        ("mark", ["a", 1]),
+        ("mark", [True, 1]),
+        ("name", [1, 1]),
+        ("name", ["a", None]),
+        ("name", ["a"]),
+        ("name", {"a": 1}),
+    ],
+)
+def test_cursor_of_the_wrong_type_is_rejected(seeded, client, login, sort, key):
+    response = client.get(
+        f"/assignment/{seeded['assignment_id']}/results",
+        params={"sort": sort, "after": pagination.encode_cursor(key)},
+        headers=login("teacher"),
+    )
+    assert response.status_code == 400
+
+
+def test_cursor_of_a_list_page_is_an_id(client, login):
+    for cursor in (pagination.encode_cursor(["1"]), "not base64!"):
+        response = client.get(
+            "/items/", params={"after": cursor}, headers=login("admin")
+        )
+        assert response.status_code == 400
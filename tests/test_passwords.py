@@ -0,0 +1,36 @@
+import database, models
+from conftest import PASSWORD
+
+
+def test_password_is_changed_and_changed_back(client, login):
+    headers = login("student2")
+    response = client.post(
+        "/change_password",
+        params={"old_password": PASSWORD, "new_password": "5678"},
+        headers=headers,
+    )
+    assert response.status_code == 200, response.text
+    old = client.post("/token", data={"username": "student2", "password": PASSWORD})
+    assert old.status_code == 401
+    token = client.post("/token", data={"username": "student2", "password": "5678"})
+    assert token.status_code == 200
+    headers = {"Authorization": f"Bearer {token.json()['access_token']}"}
+    response = client.post(
+        "/change_password",
+        params={"old_password": "5678", "new_password": PASSWORD},
+        headers=headers,
+    )
+    assert response.status_code == 200, response.text
+
+
+def test_first_password_is_changed_once(seeded, client, login):
+    with database.SessionLocal() as db:
+        db.get(models.User, seeded["users"]["student2"]).is_first_login = True
+        db.commit()
+    headers = login("student2")
+    response = client.post(
+        "/change_password_first", params={"new_password": PASSWORD}, headers=headers
+    )
+    assert response.status_code == 200, response.text
+    with database.SessionLocal() as db:
+        assert not db.get(models.User, seeded["users"]["student2"]).is_first_login
@@ -0,0 +1,73 @@
+"""
+Query budgets of the list pages and endpoints.
+
+Every endpoint is measured before and after more students with submissions
+join the class, a page that queries once per row fails both checks. The async
+endpoints run on async_engine, their statements are counted on its sync_engine.
+"""
+
+import pytest
+from sqlalchemy import select
+
+import crud, database, models, schemas
+
+SYNC = database.engine
+ASYNC = database.async_engine.sync_engine
+
+# path (formatted with the IDs of seeded), user, engine, budget
+BUDGETS = [
+    ("/users/me/all_items/", "student1", ASYNC, 2),
+    ("/users/{student1}/assignments", "teacher", ASYNC, 2),
+    ("/class/{classroom_id}?user_id={student1}", "student1", ASYNC, 3),
+    ("/class/my", "student1", ASYNC, 1),
+    ("/assignment/{assignment_id}/results", "teacher", ASYNC, 2),
+    ("/class/{classroom_id}/assignment/{assignment_id}/results", "teacher", ASYNC, 2),
+    ("/session", "student1", ASYNC, 2),
+    ("/all_users", "admin", SYNC, 1),
+    ("/items/", "admin", SYNC, 1),
+    ("/assignments/", "teacher", SYNC, 1),
+    ("/class/{classroom_id}/enrolled_users_list", "teacher", SYNC, 1),
+]
+
+
+def add_students(seeded, count: int):
+    """Enroll more students into the seeded class, each with a submission."""
+    with database.SessionLocal() as db:
+        student = db.scalar(select(models.Role.id).where(models.Role.slug == "student"))
+        start = db.query(models.User).count()
+        for n in range(start, start + count):
+            user = models.User(
+                username=f"budget{n}", email=f"budget{n}@example.com", role_id=student
+            )
+            db.add(user)
+            db.flush()
+            crud.enroll_student(db, seeded["classroom_id"], user.id)
+            crud.create_user_item(
+                db,
+                schemas.ItemCreate(assignment_id=seeded["assignment_id"]),
+                user.id,
+                seeded["assignment_id"],
+            )
+
+
+def count(client, headers: dict, path: str, bind) -> int:
+    with database.count_queries(bind) as statements:
+        response = client.get(path, headers=headers)
+    assert response.status_code == 200, response.text
+    return len(statements)
+
+
+@pytest.mark.parametrize("path, username, bind, budget", BUDGETS)
+def test_query_budget(client, login, seeded, path, username, bind, budget):
+    path = path.format(**seeded, **seeded["users"])
+    headers = login(username)
+    # the principal and the catalog rows are cached by the first request
+    client.get(path, headers=headers)
+    before = count(client, headers, path, bind)
+
+    add_students(seeded, 5)
+
+    with database.assert_max_queries(budget, bind=bind):
+        response = client.get(path, headers=headers)
+    assert response.status_code == 200
+    assert count(client, headers, path, bind) == before
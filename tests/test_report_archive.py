@@ -0,0 +1,89 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import crud, database, models, report_archive, schemas
+
+
+@pytest.fixture
+def assignment_id(seeded):
+    with database.SessionLocal() as db:
+        assignment = crud.create_assignment(
+            db,
+            schemas.AssignmentCreate(name="reports"),
+            seeded["users"]["teacher"],
+            seeded["classroom_id"],
+        )
+        return assignment.id
+
+
+def write_report(path, run: int):
+    path.write_text(json.dumps({"run": run, "output": "x" * 1000 * run}))
+    return str(path)
+
+
+def entries(db, assignment_id: int) -> list:
+    return (
+        db.query(models.ReportArchiveEntry)
+        .filter(models.ReportArchiveEntry.assignment_id == assignment_id)
+        .all()
+    )
+
+
+def test_superseded_reports_are_dropped_when_archiving(seeded, assignment_id, tmp_path):
+    student = seeded["users"]["student1"]
+    with database.SessionLocal() as db:
+        for run in range(1, 8):
+            path = write_report(tmp_path / "report.json", run)
+            report_archive.archive_report(db, path, assignment_id, student)
+        assert len(entries(db, assignment_id)) == report_archive.REPORT_KEEP_PER_STUDENT
+        report = report_archive.read_report(db, assignment_id, student)
+        assert json.loads(report)["run"] == 7
+
+
+def test_archive_is_compacted_as_reports_are_dropped(seeded, assignment_id, tmp_path):
+    student = seeded["users"]["student1"]
+    with database.SessionLocal() as db:
+        for _ in range(30):
+            path = write_report(tmp_path / "report.json", 1)
+            report_archive.archive_report(db, path, assignment_id, student)
+        kept = sum(entry.length for entry in entries(db, assignment_id))
+        pack_size = report_archive.pack_path(assignment_id).stat().st_size
+        assert pack_size <= report_archive.REPORT_COMPACT_RATIO * kept
+        assert report_archive.read_report(db, assignment_id, student) is not None
+
+
+def test_retention_keeps_the_latest_report_of_each_student(
+    seeded, assignment_id, tmp_path
+):
+    students = [seeded["users"]["student1"], seeded["users"]["student2"]]
+    old = datetime.utcnow() - timedelta(days=report_archive.REPORT_RETENTION_DAYS + 1)
+    with database.SessionLocal() as db:
+        for student in students:
+            for run in (1, 2):
+                path = write_report(tmp_path / "report.json", run)
+                report_archive.archive_report(db, path, assignment_id, student, old)
+        assert report_archive.apply_retention(db, assignment_id) == 2
+        for student in students:
+            report = report_archive.read_report(db, assignment_id, student)
+            assert json.loads(report)["run"] == 2
+
+
+def test_reports_from_before_the_archive_are_imported(seeded, assignment_id, tmp_path):
+    student = seeded["users"]["student2"]
+    legacy = tmp_path / f"HW_{assignment_id}_{student}_report.json"
+    write_report(legacy, 1)
+    mtime = int(time.time()) - 3600
+    os.utime(legacy, (mtime, mtime))
+    orphan = write_report(tmp_path / f"HW_{assignment_id}_999999_report.json", 1)
+    with database.SessionLocal() as db:
+        assert report_archive.import_reports(db, tmp_path) == 1
+        report = report_archive.read_report(db, assignment_id, student)
+        assert json.loads(report)["run"] == 1
+        (entry,) = entries(db, assignment_id)
+        assert entry.created_at == datetime.utcfromtimestamp(mtime)
+    assert not legacy.exists()
+    assert os.path.exists(orphan)
@@ -0,0 +1,51 @@
+import io
+import json
+import tarfile
+
+import pytest
+
+import run_tests
+
+
+def tar_chunks(name: str, data: bytes, size: int = 1000):
+    """Return a tar archive of one file split into chunks, like get_archive."""
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode="w") as tar:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    archive = stream.getvalue()
+    return (archive[i : i + size] for i in range(0, len(archive), size))
+
+
+def test_report_is_saved_and_parsed_from_the_archive_stream(tmp_path):
+    report = {
+        "created": 1,
+        "tests": [
+            {
+                "nodeid": f"test_HW.py::test_{n}",
+                "outcome": "failed",
+                "call": {"outcome": "failed", "longrepr": "x" * 100_000},
+            }
+            for n in range(5)
+        ],
+        "summary": {"failed": 5},
+    }
+    data = json.dumps(report).encode()
+    path = tmp_path / "report.json"
+    tests = run_tests.read_report_archive(tar_chunks("report.json", data), str(path))
+    assert [test["nodeid"] for test in tests] == [
+        f"test_HW.py::test_{n}" for n in range(5)
+    ]
+    assert "longrepr" not in tests[0]["call"]
+    assert path.read_bytes() == data
+
+
+def test_archive_without_the_report_is_rejected(tmp_path):
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode="w") as tar:
+        info = tarfile.TarInfo("report.json")
+        info.type = tarfile.DIRTYPE
+        tar.addfile(info)
+    with pytest.raises(ValueError):
+        run_tests.read_report_archive([stream.getvalue()], str(tmp_path / "r.json"))
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import time
+
+import pytest
+
+import storage
+
+
+def test_storage_is_abstract():
+    with pytest.raises(TypeError):
+        storage.Storage()
+
+
+def test_local_storage_stores_identical_content_once(tmp_path):
+    local = storage.LocalStorage(tmp_path)
+    digest = local.put_bytes(b"print(1)\n")
+    assert digest == hashlib.sha256(b"print(1)\n").hexdigest()
+    assert local.put_bytes(b"print(1)\n") == digest
+    assert local.path(digest).relative_to(tmp_path).parts[:2] == (
+        digest[:2],
+        digest[2:4],
+    )
+    assert local.get_bytes(digest) == b"print(1)\n"
+    local.delete(digest)
+    assert not local.exists(digest)
+
+
+@pytest.fixture
+def s3_endpoint(monkeypatch):
+    """Run a local moto server standing in for S3 and return its URL."""
+    pytest.importorskip("boto3")
+    server_module = pytest.importorskip("moto.server")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    server = server_module.ThreadedMotoServer(
+        ip_address="127.0.0.1", port=0, verbose=False
+    )
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f"http://{host}:{port}"
+    server.stop()
+
+
+def test_s3_storage(s3_endpoint):
+    s3 = storage.S3Storage("autograder", endpoint_url=s3_endpoint, prefix="blobs/")
+    s3.client.create_bucket(Bucket="autograder")
+
+    digest = s3.put_bytes(b"def add(a, b):\n    return a + b\n")
+    assert s3.exists(digest)
+    assert s3.get_bytes(digest) == b"def add(a, b):\n    return a + b\n"
+    keys = s3.client.list_objects_v2(Bucket="autograder")["Contents"]
+    assert [key["Key"] for key in keys] == ["blobs/" + storage.blob_key(digest)]
+
+    # identical content is uploaded once
+    assert s3.put_bytes(b"def add(a, b):\n    return a + b\n") == digest
+    assert s3.client.list_objects_v2(Bucket="autograder")["KeyCount"] == 1
+
+    s3.delete(digest)
+    assert not s3.exists(digest)
+
+
+def test_upgrade_moves_earlier_uploads_into_the_storage(seeded, tmp_path, monkeypatch):
+    import crud, database, migrations, models, schemas
+
+    with database.SessionLocal() as db:
+        assignment = crud.create_assignment(
+            db,
+            schemas.AssignmentCreate(name="legacy"),
+            seeded["users"]["teacher"],
+            seeded["classroom_id"],
+        )
+        item = crud.create_user_item(
+            db,
+            schemas.ItemCreate(assignment_id=assignment.id),
+            seeded["users"]["student1"],
+            assignment.id,
+        )
+        assignment_id, item_id = assignment.id, item.id
+        (tmp_path / "HW").mkdir()
+        (tmp_path / "TESTS").mkdir()
+        (tmp_path / "HW" / f"{item.filename}.py").write_bytes(b"x = 1\n")
+        (tmp_path / "TESTS" / f"{assignment.filename}.py").write_bytes(
+            b"def test(): pass\n"
+        )
+    monkeypatch.setattr(
+        migrations,
+        "LEGACY_DIRS",
+        {"items": tmp_path / "HW", "assignments": tmp_path / "TESTS"},
+    )
+
+    with database.engine.begin() as conn:
+        migrations.store_legacy_files(conn)
+
+    with database.SessionLocal() as db:
+        item = db.get(models.Item, item_id)
+        assignment = db.get(models.Assignment, assignment_id)
+        assert storage.storage.get_bytes(item.content_hash) == b"x = 1\n"
+        assert storage.storage.get_bytes(assignment.test_hash) == b"def test(): pass\n"
+
+
+def age(local, digest, seconds):
+    """Make a blob look like it was stored seconds ago."""
+    stored = time.time() - seconds
+    os.utime(local.path(digest), (stored, stored))
+
+
+def test_collect_garbage_keeps_referenced_and_recent_blobs(tmp_path):
+    local = storage.LocalStorage(tmp_path)
+    replaced = local.put_bytes(b"old")
+    current = local.put_bytes(b"current")
+    recent = local.put_bytes(b"recent")
+    age(local, replaced, 7200)
+    age(local, current, 7200)
+
+    assert storage.collect_garbage({current}, min_age=3600, store=local) == 1
+    assert not local.exists(replaced)
+    assert local.exists(current)
+    assert local.exists(recent)
+
+
+def test_storing_a_blob_again_keeps_it_from_the_garbage_collection(tmp_path):
+    local = storage.LocalStorage(tmp_path)
+    digest = local.put_bytes(b"reused")
+    age(local, digest, 7200)
+
+    # an upload of the same content dedups onto the blob before its reference
+    # is committed
+    local.put_bytes(b"reused")
+
+    assert storage.collect_garbage(set(), min_age=3600, store=local) == 0
+    assert local.get_bytes(digest) == b"reused"
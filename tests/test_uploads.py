@@ -0,0 +1,44 @@
+import hashlib
+
+import pytest
+
+import storage
+
+TEST_FILE = b"def test_add():\n    assert add(1, 2) == 3\n"
+
+
+def blobs() -> set:
+    return set(storage.storage.list_blobs())
+
+
+@pytest.mark.parametrize(
+    "path", ["/uploadfile/999999", "/uploadfile/assignment/999999"]
+)
+def test_upload_to_a_missing_assignment_stores_nothing(client, login, path):
+    before = blobs()
+    response = client.post(
+        path, files={"file": ("test_HW.py", TEST_FILE)}, headers=login("teacher")
+    )
+    assert response.status_code == 404
+    assert blobs() == before
+
+
+def test_students_cannot_upload_the_tests(seeded, client, login):
+    before = blobs()
+    response = client.post(
+        f"/uploadfile/assignment/{seeded['assignment_id']}",
+        files={"file": ("test_HW.py", TEST_FILE)},
+        headers=login("student1"),
+    )
+    assert response.status_code == 401
+    assert blobs() == before
+
+
+def test_teacher_uploads_the_tests(seeded, client, login):
+    response = client.post(
+        f"/uploadfile/assignment/{seeded['assignment_id']}",
+        files={"file": ("test_HW.py", TEST_FILE)},
+        headers=login("teacher"),
+    )
+    assert response.status_code == 200, response.text
+    assert storage.storage.exists(hashlib.sha256(TEST_FILE).hexdigest())
@@ -0,0 +1,52 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+import crud, database, models, schemas
+
+
+@pytest.fixture
+def item_id(seeded):
+    with database.SessionLocal() as db:
+        assignment = crud.create_assignment(
+            db,
+            schemas.AssignmentCreate(name="versions"),
+            seeded["users"]["teacher"],
+            seeded["classroom_id"],
+        )
+        item = crud.create_user_item(
+            db,
+            schemas.ItemCreate(assignment_id=assignment.id),
+            seeded["users"]["student1"],
+            assignment.id,
+        )
+        return item.id
+
+
+def test_version_numbers_are_unique(item_id):
+    with database.SessionLocal() as db:
+        for _ in range(2):
+            db.add(models.ItemVersion(item_id=item_id, number=1, data=b""))
+        with pytest.raises(IntegrityError):
+            db.commit()
+
+
+def test_version_taken_by_a_concurrent_upload_is_numbered_again(item_id, monkeypatch):
+    with database.SessionLocal() as db:
+        crud.create_item_version(db, item_id, b"a = 1\n", "1" * 64)
+        stale = crud.get_last_item_version(db, item_id)
+        # another upload stores version 2 after this one read version 1
+        crud.create_item_version(db, item_id, b"a = 2\n", "2" * 64)
+        reads = []
+        get_last = crud.get_last_item_version
+
+        def get_last_item_version(db, item_id):
+            reads.append(item_id)
+            return stale if len(reads) == 1 else get_last(db, item_id)
+
+        monkeypatch.setattr(crud, "get_last_item_version", get_last_item_version)
+        version = crud.create_item_version(db, item_id, b"a = 3\n", "3" * 64)
+
+        assert version.number == 3
+        assert len(reads) == 2
+        assert crud.get_item_version_content(db, item_id, 3) == b"a = 3\n"
+        assert crud.get_item_version_content(db, item_id, 2) == b"a = 2\n"
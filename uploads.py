@@ -0,0 +1,91 @@
+import hashlib
+import os
+from uuid import uuid4
+
+import anyio
+from fastapi import HTTPException, UploadFile, status
+
+from storage import storage
+
+# maximum size of one uploaded file in bytes, configurable from .env
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 1024 * 1024))
+CHUNK_SIZE = 64 * 1024
+
+
+def too_large_exception(max_size: int = MAX_UPLOAD_SIZE):
+    """
+    Return the exception raised for an upload over the size limit.
+
+    Args:
+        max_size (int, optional): The size limit in bytes. Defaults to MAX_UPLOAD_SIZE.
+
+    Returns:
+        HTTPException: The 413 exception.
+    """
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File is too large, maximum size is {max_size} bytes",
+    )
+
+
+async def save_upload_file(
+    file: UploadFile, file_name: str, max_size: int = MAX_UPLOAD_SIZE
+):
+    """
+    Stream an uploaded file to disk in chunks and hash it on the fly.
+
+    The file is written to a temporary file next to the target and moved into
+    place only when the whole upload fits into the size limit, so a rejected
+    upload never replaces the previous file.
+
+    Args:
+        file (UploadFile): The uploaded file.
+        file_name (str): The path to write the file to.
+        max_size (int, optional): The size limit in bytes. Defaults to MAX_UPLOAD_SIZE.
+
+    Returns:
+        tuple: The sha256 hex digest of the content and its size in bytes.
+
+    Raises:
+        HTTPException: If the file is larger than max_size.
+    """
+    if file.size is not None and file.size > max_size:
+        raise too_large_exception(max_size)
+
+    os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+    tmp_name = f"{file_name}.part"
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        async with await anyio.open_file(tmp_name, "wb") as f:
+            while chunk := await file.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise too_large_exception(max_size)
+                sha256.update(chunk)
+                await f.write(chunk)
+        os.replace(tmp_name, file_name)
+    finally:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+    return sha256.hexdigest(), size
+
+
+async def store_upload_file(file: UploadFile, max_size: int = MAX_UPLOAD_SIZE):
+    """
+    Stream an uploaded file into the blob storage.
+
+    Args:
+        file (UploadFile): The uploaded file.
+        max_size (int, optional): The size limit in bytes. Defaults to MAX_UPLOAD_SIZE.
+
+    Returns:
+        tuple: The sha256 hex digest of the content and its size in bytes.
+
+    Raises:
+        HTTPException: If the file is larger than max_size.
+    """
+    file_name = os.path.join(storage.staging_dir, uuid4().hex)
+    content_hash, size = await save_upload_file(file, file_name, max_size)
+    await anyio.to_thread.run_sync(storage.put_file, file_name, content_hash)
+    return content_hash, size
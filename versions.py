@@ -0,0 +1,136 @@
+import difflib
+import struct
+import zlib
+
+# every KEYFRAME_INTERVAL-th version is stored whole, so rebuilding a version
+# never applies more than KEYFRAME_INTERVAL - 1 deltas
+KEYFRAME_INTERVAL = 20
+
+_COPY = b"="
+_INSERT = b"+"
+
+
+def keyframe_number(number: int) -> int:
+    """
+    Return the number of the keyframe version that the given version is based on.
+
+    Args:
+        number (int): The version number, starting at 1.
+
+    Returns:
+        int: The number of the keyframe version.
+    """
+    return (number - 1) // KEYFRAME_INTERVAL * KEYFRAME_INTERVAL + 1
+
+
+def is_keyframe(number: int) -> bool:
+    return keyframe_number(number) == number
+
+
+def compress(content: bytes) -> bytes:
+    """
+    Compress a whole version.
+
+    Args:
+        content (bytes): The file content.
+
+    Returns:
+        bytes: The compressed content.
+    """
+    return zlib.compress(content, 9)
+
+
+def encode_delta(old: bytes, new: bytes) -> bytes:
+    """
+    Encode the new content as a line delta against the old content.
+
+    The delta is a sequence of operations, either copy lines i1:i2 of the old
+    content or insert literal bytes, so its size grows with the size of the
+    edit and not with the size of the file.
+
+    Args:
+        old (bytes): The content of the previous version.
+        new (bytes): The content of the new version.
+
+    Returns:
+        bytes: The compressed delta.
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    delta = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            delta.append(struct.pack(">cII", _COPY, i1, i2))
+        elif j2 > j1:
+            data = b"".join(new_lines[j1:j2])
+            delta.append(struct.pack(">cI", _INSERT, len(data)) + data)
+    return zlib.compress(b"".join(delta), 9)
+
+
+def apply_delta(old: bytes, delta: bytes) -> bytes:
+    """
+    Rebuild the new content from the old content and a delta from encode_delta.
+
+    Args:
+        old (bytes): The content of the previous version.
+        delta (bytes): The compressed delta.
+
+    Returns:
+        bytes: The content of the new version.
+    """
+    old_lines = old.splitlines(keepends=True)
+    delta = zlib.decompress(delta)
+    new = []
+    position = 0
+    while position < len(delta):
+        op = delta[position : position + 1]
+        if op == _COPY:
+            _, i1, i2 = struct.unpack_from(">cII", delta, position)
+            new.extend(old_lines[i1:i2])
+            position += struct.calcsize(">cII")
+        else:
+            _, length = struct.unpack_from(">cI", delta, position)
+            position += struct.calcsize(">cI")
+            new.append(delta[position : position + length])
+            position += length
+    return b"".join(new)
+
+
+def rebuild(chain: list) -> bytes:
+    """
+    Rebuild the content of the last version in a chain starting with a keyframe.
+
+    Args:
+        chain (list): Versions ordered by number, the first one is a keyframe.
+
+    Returns:
+        bytes: The content of the last version.
+    """
+    content = zlib.decompress(chain[0].data)
+    for version in chain[1:]:
+        content = apply_delta(content, version.data)
+    return content
+
+
+def unified_diff(old: bytes, new: bytes, old_name: str, new_name: str) -> str:
+    """
+    Return the unified diff of two versions.
+
+    Args:
+        old (bytes): The content of the first version.
+        new (bytes): The content of the second version.
+        old_name (str): The label of the first version.
+        new_name (str): The label of the second version.
+
+    Returns:
+        str: The unified diff.
+    """
+    return "".join(
+        difflib.unified_diff(
+            old.decode(errors="replace").splitlines(keepends=True),
+            new.decode(errors="replace").splitlines(keepends=True),
+            fromfile=old_name,
+            tofile=new_name,
+        )
+    )